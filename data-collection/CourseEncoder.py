@@ -137,7 +137,7 @@ def main():
     embedding_model = initialize_vertexai()
     
     # Specify the path to your CSV file containing course data.
-    csv_path = "./data/courses.csv"
+    csv_path = "./data/catalog.csv"
     
     # Process the CSV file and store embeddings in Firestore.
     process_csv_and_store(csv_path, db, embedding_model)
@@ -3,6 +3,8 @@ from bs4 import BeautifulSoup
 import pandas as pd
 import re
 
+from course_dedup import consolidate_course_df
+
 class CourseScraper:
     def __init__(self):
         self.base = 'https://www.scu.edu/bulletin/undergraduate/'
@@ -394,11 +396,17 @@ def main():
     
     # Process the data with the integrated prerequisite extraction
     df = scraper.add_pre_reqs(df)
-    
-    # Save to CSV
+
+    # Save the raw scrape, so it can be re-consolidated without scraping again
     df.to_csv('data/courses.csv', index=False)
     print("Course data with cleaned descriptions and extracted prerequisites has been saved to 'data/courses.csv'")
 
+    # Merge cross-listed and near-duplicate courses so each is embedded and stored once
+    # (adds the aliases column last, after pre_reqs, where the encoder expects it)
+    df = consolidate_course_df(df)
+    df.to_csv('data/catalog.csv', index=False)
+    print("Consolidated catalog saved to 'data/catalog.csv'")
+
     # print blank description courses
     print("Courses with blank descriptions:")
     print(df[df['description'] == ""])
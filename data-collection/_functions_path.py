@@ -0,0 +1,14 @@
+"""
+Puts the Cloud Function's source on sys.path, so the scripts here reuse the
+catalog, index and snapshot code that ships with it instead of copying it.
+
+    import _functions_path  # noqa: F401
+    from catalog import Catalog
+"""
+import os
+import sys
+
+FUNCTIONS_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "functions"))
+
+if FUNCTIONS_DIR not in sys.path:
+    sys.path.append(FUNCTIONS_DIR)
@@ -0,0 +1,67 @@
+import argparse
+import json
+import sys
+
+import _functions_path  # noqa: F401
+from shadow import summarize
+
+
+def shadow_records(paths):
+    """
+    Yields the comparison records logged on "rag.shadow": either the raw JSON
+    lines or Cloud Logging JSON exports (record in textPayload or
+    jsonPayload.message). Other lines are skipped.
+    """
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line.startswith("{"):
+                    continue
+                try:
+                    entry = json.loads(line)
+                    if "c" not in entry:
+                        payload = entry.get("textPayload") or entry.get("jsonPayload", {}).get("message", "")
+                        entry = json.loads(payload[payload.index("{"):])
+                except (ValueError, AttributeError):
+                    continue
+                if isinstance(entry, dict) and "c" in entry and "pm" in entry:
+                    yield entry
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize shadow-traffic comparisons of retrieval backends")
+    parser.add_argument("logs", nargs="+", help="Exported rag.shadow log lines")
+    parser.add_argument("--min-jaccard", type=float, default=None,
+                        help="Exit nonzero if a candidate's mean Jaccard overlap is below this")
+    parser.add_argument("--max-error-rate", type=float, default=None,
+                        help="Exit nonzero if a candidate fails more often than this")
+    parser.add_argument("--json", action="store_true", help="Print the summary as JSON")
+    args = parser.parse_args()
+
+    summary = summarize(shadow_records(args.logs))
+    if not summary:
+        parser.error("no shadow records found")
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        for name, metrics in summary.items():
+            print(f"{name}: {metrics['samples']} samples, {metrics['error_rate']:.1%} errors {metrics['errors']}")
+            print(f"  latency p50/p95 ms: primary {metrics['primary_ms']['p50']}/{metrics['primary_ms']['p95']}, "
+                  f"candidate {metrics['candidate_ms']['p50']}/{metrics['candidate_ms']['p95']}")
+            print(f"  jaccard mean {metrics['jaccard_mean']} (p10 {metrics['jaccard_p10']}), "
+                  f"kendall tau mean {metrics['tau_mean']}, top-1 agreement {metrics['top1_agreement']}")
+
+    failed = False
+    for name, metrics in summary.items():
+        if args.min_jaccard is not None and (metrics["jaccard_mean"] or 0.0) < args.min_jaccard:
+            print(f"{name}: mean Jaccard {metrics['jaccard_mean']} below {args.min_jaccard}")
+            failed = True
+        if args.max_error_rate is not None and metrics["error_rate"] > args.max_error_rate:
+            print(f"{name}: error rate {metrics['error_rate']} above {args.max_error_rate}")
+            failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,24 @@
+import json
+
+import numpy as np
+
+
+def save_embeddings_artifact(path, ids, vectors, metadata):
+    """
+    Writes course embeddings to a local .npz artifact: document IDs, a float32
+    matrix with one row per ID, and the course fields for each row.
+    """
+    np.savez(
+        path,
+        ids=np.array(json.dumps(list(ids))),
+        vectors=np.asarray(vectors, dtype=np.float32),
+        metadata=np.array(json.dumps(list(metadata))),
+    )
+
+
+def load_embeddings_artifact(path):
+    """
+    Loads an artifact written by save_embeddings_artifact. Returns (ids, vectors, metadata).
+    """
+    data = np.load(path)
+    return json.loads(str(data["ids"])), data["vectors"], json.loads(str(data["metadata"]))
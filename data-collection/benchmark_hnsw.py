@@ -0,0 +1,90 @@
+import argparse
+import json
+import logging
+import tempfile
+import time
+
+import numpy as np
+
+from benchmark_quantization import load_vectors, make_queries, recall_at_k
+
+import _functions_path  # noqa: F401
+from hnsw import HNSWIndex
+from vector_index import normalize_rows, top_k_indices
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+
+def latency_search(index, queries, k, ef):
+    results = []
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        hits = index.search(query, k, ef=ef)
+        latencies.append((time.perf_counter() - start) * 1000)
+        results.append([row for row, _ in hits])
+    return results, latencies
+
+
+def run_benchmark(vectors, queries, k, m_values, ef_values, ef_construction):
+    """
+    Builds one index per M, saves and memory-maps it like a warm instance would,
+    then sweeps ef. Returns one row of measurements per (M, ef) pair.
+    """
+    normalized = normalize_rows(vectors)
+    start = time.perf_counter()
+    truth = [top_k_indices(normalized @ query, k).tolist() for query in queries]
+    brute_ms = (time.perf_counter() - start) * 1000 / len(queries)
+    rows = [{"config": "brute force", "recall": 1.0, "p50_ms": brute_ms, "p95_ms": brute_ms}]
+
+    for m in m_values:
+        start = time.perf_counter()
+        index = HNSWIndex(normalized.shape[1], M=m, ef_construction=ef_construction)
+        index.add_items(normalized, list(range(len(normalized))))
+        build_seconds = time.perf_counter() - start
+        with tempfile.TemporaryDirectory() as directory:
+            index.save(directory)
+            loaded = HNSWIndex.load(directory)
+            for ef in ef_values:
+                results, latencies = latency_search(loaded, queries, k, ef)
+                rows.append({
+                    "config": f"hnsw M={m} ef={ef}",
+                    "recall": recall_at_k(results, truth, k),
+                    "p50_ms": float(np.percentile(latencies, 50)),
+                    "p95_ms": float(np.percentile(latencies, 95)),
+                    "build_seconds": build_seconds,
+                })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall/latency sweep for the HNSW index")
+    parser.add_argument("--artifact", default="./data/course_chunks.npz",
+                        help="Embeddings artifact written by encoder.py --export")
+    parser.add_argument("--synthetic", type=int, default=20000, help="Synthetic corpus size if no artifact")
+    parser.add_argument("--dim", type=int, default=768, help="Synthetic vector dimensionality")
+    parser.add_argument("--queries", type=int, default=200, help="Number of benchmark queries")
+    parser.add_argument("--noise", type=float, default=0.5, help="Relative noise added to query vectors")
+    parser.add_argument("--k", type=int, default=15, help="Results per query (recall@k)")
+    parser.add_argument("--M", type=int, nargs="+", default=[8, 16, 32], help="M values to build")
+    parser.add_argument("--ef", type=int, nargs="+", default=[16, 32, 64, 128], help="ef_search values to sweep")
+    parser.add_argument("--ef-construction", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", default=None, help="Also write the measurements to this JSON file")
+    args = parser.parse_args()
+
+    _, vectors = load_vectors(args)
+    queries = make_queries(vectors, args.queries, args.noise, args.seed)
+    rows = run_benchmark(vectors, queries, args.k, args.M, args.ef, args.ef_construction)
+
+    print(f"{'config':24} {'recall@' + str(args.k):>10} {'p50 ms':>8} {'p95 ms':>8} {'build s':>8}")
+    for row in rows:
+        build = f"{row['build_seconds']:.1f}" if "build_seconds" in row else "-"
+        print(f"{row['config']:24} {row['recall']:>10.4f} {row['p50_ms']:>8.3f} {row['p95_ms']:>8.3f} {build:>8}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+import argparse
+import json
+import logging
+import os
+import time
+
+import numpy as np
+
+from artifacts import load_embeddings_artifact
+from quantization import QuantizedIndex
+
+import _functions_path  # noqa: F401
+from vector_index import normalize_rows, top_k_indices
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+
+def load_vectors(args):
+    """
+    Returns (ids, vectors) from an encoder artifact, or a synthetic clustered
+    corpus of the same shape when no artifact is available.
+    """
+    if args.artifact and os.path.exists(args.artifact):
+        ids, vectors, _ = load_embeddings_artifact(args.artifact)
+        logging.info(f"Loaded {len(ids)} vectors from {args.artifact}")
+        return ids, np.asarray(vectors, dtype=np.float32)
+
+    logging.info(f"No artifact found; generating {args.synthetic} synthetic {args.dim}-dim vectors")
+    rng = np.random.default_rng(args.seed)
+    centers = rng.normal(size=(max(args.synthetic // 40, 1), args.dim))
+    vectors = centers[rng.integers(0, len(centers), args.synthetic)] + 0.6 * rng.normal(size=(args.synthetic, args.dim))
+    return [f"course-{i}" for i in range(args.synthetic)], vectors.astype(np.float32)
+
+
+def make_queries(vectors, count, noise, seed):
+    """
+    Queries are perturbed corpus vectors, a stand-in for paraphrased questions.
+    """
+    rng = np.random.default_rng(seed + 1)
+    picks = vectors[rng.integers(0, len(vectors), count)]
+    scale = noise * np.linalg.norm(picks, axis=1, keepdims=True) / np.sqrt(vectors.shape[1])
+    return normalize_rows(picks + scale * rng.normal(size=picks.shape))
+
+
+def timed_search(search, queries):
+    results = []
+    start = time.perf_counter()
+    for query in queries:
+        results.append(search(query))
+    return results, (time.perf_counter() - start) * 1000 / len(queries)
+
+
+def recall_at_k(results, truth, k):
+    hits = sum(len(set(result[:k]) & set(expected[:k])) for result, expected in zip(results, truth))
+    return hits / (k * len(truth))
+
+
+def run_benchmark(ids, vectors, queries, k=15, pq_subspaces=96, rescore_factor=4):
+    """
+    Compares exact float32 search with int8 and product-quantized scans, with and
+    without float32 rescoring. Returns one row of measurements per configuration.
+    """
+    normalized = normalize_rows(vectors)
+    n, dim = normalized.shape
+    # A Python list of floats costs a pointer plus a float object per element.
+    python_list_bytes = n * (56 + dim * (8 + 24))
+
+    truth, exact_ms = timed_search(lambda q: [ids[i] for i in top_k_indices(normalized @ q, k)], queries)
+    rows = [
+        {"config": "float64 lists (Firestore arrays)", "memory_bytes": python_list_bytes},
+        {"config": "float32 exact", "memory_bytes": normalized.nbytes, "ms_per_query": exact_ms, "recall": 1.0},
+    ]
+
+    for method, kwargs in (("int8", {}), ("pq", {"subspaces": pq_subspaces})):
+        start = time.perf_counter()
+        index = QuantizedIndex.build(ids, normalized, method=method, **kwargs)
+        build_seconds = time.perf_counter() - start
+        for factor in (1, rescore_factor):
+            label = f"{method} scan" + (f" + rescore x{factor}" if factor > 1 else "")
+            results, ms = timed_search(
+                lambda q: [doc_id for doc_id, _ in index.search(q, k, rescore_factor=factor)], queries
+            )
+            rows.append({
+                "config": label,
+                "memory_bytes": index.memory_bytes(),
+                "ms_per_query": ms,
+                "recall": recall_at_k(results, truth, k),
+                "build_seconds": build_seconds,
+            })
+    return rows
+
+
+def print_report(rows, k):
+    baseline = rows[1]["memory_bytes"]
+    print(f"{'config':36} {'memory':>10} {'vs f32':>7} {'ms/query':>9} {'recall@' + str(k):>10}")
+    for row in rows:
+        ms = f"{row['ms_per_query']:.3f}" if "ms_per_query" in row else "-"
+        recall = f"{row['recall']:.4f}" if "recall" in row else "-"
+        print(f"{row['config']:36} {row['memory_bytes'] / 1e6:>8.2f}MB {baseline / row['memory_bytes']:>6.1f}x "
+              f"{ms:>9} {recall:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark quantized course embeddings against float32")
+    parser.add_argument("--artifact", default="./data/course_embeddings.npz",
+                        help="Embeddings artifact written by encoder.py --export")
+    parser.add_argument("--synthetic", type=int, default=2631, help="Synthetic corpus size if no artifact")
+    parser.add_argument("--dim", type=int, default=768, help="Synthetic vector dimensionality")
+    parser.add_argument("--queries", type=int, default=200, help="Number of benchmark queries")
+    parser.add_argument("--noise", type=float, default=0.5, help="Relative noise added to query vectors")
+    parser.add_argument("--k", type=int, default=15, help="Results per query (recall@k)")
+    parser.add_argument("--pq-subspaces", type=int, default=96, help="Product quantization subspaces")
+    parser.add_argument("--rescore-factor", type=int, default=4, help="Candidates rescored per result")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", default=None, help="Also write the measurements to this JSON file")
+    args = parser.parse_args()
+
+    ids, vectors = load_vectors(args)
+    queries = make_queries(vectors, args.queries, args.noise, args.seed)
+    rows = run_benchmark(ids, vectors, queries, k=args.k, pq_subspaces=args.pq_subspaces,
+                         rescore_factor=args.rescore_factor)
+    print_report(rows, args.k)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,387 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from artifacts import load_embeddings_artifact, save_embeddings_artifact
+from course_text import create_rich_text_representation
+from quantization import QuantizedIndex
+
+import _functions_path  # noqa: F401
+from catalog import Catalog
+from hnsw import HNSWIndex
+from vector_index import normalize_rows, top_k_indices
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+RECALL_KS = (1, 5, 10)
+MRR_CUTOFF = 10
+BACKENDS = ("remote_stub", "brute_f32", "int8", "int8_rescore", "pq_rescore", "hnsw")
+
+
+def name_description_text(course):
+    # Same text CourseEncoder.py embeds.
+    return f"{course['course']}\n{course['description']}. "
+
+
+def description_text(course):
+    # The Astra "courses" collection stores the description as page content.
+    return course["description"]
+
+
+class Recipe:
+    """
+    One way of turning a course into a vector: the text that is embedded and
+    the embedding model and dimensionality used for it.
+    """
+
+    def __init__(self, name, text_fn, provider, model, dim):
+        self.name = name
+        self.text_fn = text_fn
+        self.provider = provider
+        self.model = model
+        self.dim = dim
+
+
+RECIPES = {
+    "name_desc_256": Recipe("name_desc_256", name_description_text, "vertex", "text-embedding-004", 256),
+    "rich_768": Recipe("rich_768", create_rich_text_representation, "vertex", "text-embedding-004", 768),
+    "astra_openai": Recipe("astra_openai", description_text, "openai", "text-embedding-3-small", 1536),
+}
+
+
+class VertexEmbedder:
+    def __init__(self, model, dim, project_id, location, batch_size=20):
+        import vertexai
+        from vertexai.language_models import TextEmbeddingModel
+        vertexai.init(project=project_id, location=location)
+        self.model = TextEmbeddingModel.from_pretrained(model)
+        self.dim = dim
+        self.batch_size = batch_size
+
+    def embed(self, texts, task):
+        from vertexai.language_models import TextEmbeddingInput
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            inputs = [TextEmbeddingInput(text, task) for text in texts[start:start + self.batch_size]]
+            embeddings = self.model.get_embeddings(inputs, output_dimensionality=self.dim)
+            vectors.extend(embedding.values for embedding in embeddings)
+        return np.asarray(vectors, dtype=np.float32)
+
+    def embed_query(self, text):
+        start = time.perf_counter()
+        vector = self.embed([text], "RETRIEVAL_QUERY")[0]
+        return vector, (time.perf_counter() - start) * 1000
+
+
+class OpenAIEmbedder:
+    def __init__(self, model):
+        from langchain_openai import OpenAIEmbeddings
+        self.embeddings = OpenAIEmbeddings(model=model, api_key=os.getenv("OPEN_AI_API_KEY"))
+
+    def embed(self, texts, task):
+        return np.asarray(self.embeddings.embed_documents(texts), dtype=np.float32)
+
+    def embed_query(self, text):
+        start = time.perf_counter()
+        vector = np.asarray(self.embeddings.embed_query(text), dtype=np.float32)
+        return vector, (time.perf_counter() - start) * 1000
+
+
+class OfflineEmbedder:
+    """
+    Hash bag-of-words vectors from the load-test fakes, with the modelled
+    embedding round trip added to each query's latency. Exercises the suite
+    without credentials; its quality numbers say nothing about real models.
+    """
+
+    def __init__(self, dim, latency):
+        from loadtest.fakes import hash_embedding
+        self.hash_embedding = hash_embedding
+        self.dim = dim
+        self.latency = latency
+
+    def embed(self, texts, task):
+        return np.asarray([self.hash_embedding(text, self.dim) for text in texts], dtype=np.float32)
+
+    def embed_query(self, text):
+        start = time.perf_counter()
+        vector = np.asarray(self.hash_embedding(text, self.dim), dtype=np.float32)
+        return vector, (time.perf_counter() - start) * 1000 + self.latency.sample_ms("embed")
+
+
+def make_embedder(recipe, args, latency):
+    if args.offline:
+        return OfflineEmbedder(recipe.dim, latency)
+    if recipe.provider == "openai":
+        return OpenAIEmbedder(recipe.model)
+    return VertexEmbedder(recipe.model, recipe.dim, args.project_id, args.location)
+
+
+def load_courses(csv_path):
+    """
+    One catalog entry per course ID (cross-listed copies share their first entry).
+    """
+    catalog = Catalog.from_csv(csv_path)
+    courses = {}
+    for course in catalog.courses:
+        courses.setdefault(course["course_id"], course)
+    return list(courses), list(courses.values())
+
+
+def load_labeled_queries(path, course_ids):
+    """
+    Reads {"query": ..., "relevant": [course IDs]} lines, dropping labels for
+    courses that are not in the catalog.
+    """
+    known = set(course_ids)
+    queries = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            relevant = [course_id for course_id in item["relevant"] if course_id in known]
+            if len(relevant) < len(item["relevant"]):
+                logging.warning(f"Unknown course IDs in label for {item['query']!r}: {item['relevant']}")
+            if relevant:
+                queries.append({"query": item["query"], "relevant": relevant, "set": "labeled"})
+    return queries
+
+
+def generate_queries(course_ids, courses, count, seed):
+    """
+    Description-derived queries: one sentence from a course's description,
+    with course codes and unit counts removed, labeled with that course.
+    Plentiful but easier than real questions; the labeled set is the one to trust.
+    """
+    rng = random.Random(seed)
+    queries = []
+    for position in rng.sample(range(len(courses)), min(count * 2, len(courses))):
+        sentences = [s.strip() for s in re.split(r'(?<=[.!?])\s+', courses[position]["description"])
+                     if len(s.split()) >= 6 and "units)" not in s and not re.search(r'[A-Z]{4} \d', s)]
+        if not sentences:
+            continue
+        queries.append({"query": rng.choice(sentences), "relevant": [course_ids[position]], "set": "generated"})
+        if len(queries) >= count:
+            break
+    return queries
+
+
+def embed_corpus(recipe, embedder, course_ids, courses, cache_dir, refresh):
+    """
+    Document vectors for a recipe, cached as an embeddings artifact with a
+    hash of every embedded text so a rerun does not re-embed the catalog.
+    """
+    texts = [recipe.text_fn(course) for course in courses]
+    rows = [{"course_id": course_id, "text_sha": hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]}
+            for course_id, text in zip(course_ids, texts)]
+    offline = isinstance(embedder, OfflineEmbedder)
+    path = os.path.join(cache_dir, f"{recipe.name}{'-offline' if offline else ''}.npz")
+    if not refresh and os.path.exists(path):
+        _, vectors, cached_rows = load_embeddings_artifact(path)
+        if cached_rows == rows:
+            return vectors, 0.0
+    start = time.perf_counter()
+    vectors = embedder.embed(texts, "RETRIEVAL_DOCUMENT")
+    elapsed = time.perf_counter() - start
+    os.makedirs(cache_dir, exist_ok=True)
+    save_embeddings_artifact(path, course_ids, vectors, rows)
+    return vectors, elapsed
+
+
+def directory_bytes(directory):
+    return sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+
+
+def build_backend(name, ids, vectors, latency, hnsw_m, ef_search):
+    """
+    Returns (search, build_seconds, memory_bytes) where search(query_vector, k)
+    returns the k best course IDs. memory_bytes is what a warm instance holds
+    (0 for the remote store; rescoring vectors stay memory-mapped on disk).
+    """
+    start = time.perf_counter()
+    unit = normalize_rows(vectors)
+    if name in ("remote_stub", "brute_f32"):
+        def exact(query, k):
+            return [ids[i] for i in top_k_indices(unit @ query, k)]
+        if name == "brute_f32":
+            return exact, time.perf_counter() - start, unit.nbytes
+        network = []
+
+        def remote(query, k):
+            # Exact results plus a modelled round trip to the hosted store.
+            network.append(latency.sample_ms("vector_search"))
+            return exact(query, k)
+        remote.network_ms = network
+        return remote, 0.0, 0
+    if name in ("int8", "int8_rescore", "pq_rescore"):
+        method = "pq" if name.startswith("pq") else "int8"
+        kwargs = {"subspaces": unit.shape[1] // 8} if method == "pq" else {}
+        index = QuantizedIndex.build(ids, unit, method=method, **kwargs)
+        factor = 1 if name == "int8" else 4
+        return (lambda query, k: [course_id for course_id, _ in index.search(query, k, rescore_factor=factor)],
+                time.perf_counter() - start, index.memory_bytes())
+    if name == "hnsw":
+        index = HNSWIndex(unit.shape[1], M=hnsw_m, ef_search=ef_search)
+        index.add_items(unit, list(ids))
+        build_seconds = time.perf_counter() - start
+        directory = tempfile.mkdtemp()
+        try:
+            index.save(directory)
+            memory = directory_bytes(directory)
+        finally:
+            shutil.rmtree(directory)
+        return lambda query, k: [index.ids[row] for row, _ in index.search(query, k)], build_seconds, memory
+    raise ValueError(f"Unknown backend: {name}")
+
+
+def score_results(results, queries):
+    """
+    recall@k (share of a query's relevant courses found in its top k, capped
+    at k) and MRR (reciprocal rank of the first relevant course) averaged over
+    queries.
+    """
+    metrics = {}
+    for k in RECALL_KS:
+        metrics[f"recall@{k}"] = float(np.mean([
+            len(set(result[:k]) & set(query["relevant"])) / min(len(query["relevant"]), k)
+            for result, query in zip(results, queries)
+        ]))
+    reciprocal_ranks = []
+    for result, query in zip(results, queries):
+        rank = next((i + 1 for i, course_id in enumerate(result[:MRR_CUTOFF]) if course_id in query["relevant"]), None)
+        reciprocal_ranks.append(1 / rank if rank else 0.0)
+    metrics["mrr"] = float(np.mean(reciprocal_ranks))
+    return metrics
+
+
+def run_benchmark(recipes, backends, queries, course_ids, courses, args, latency):
+    """
+    Embeds the catalog and the queries once per recipe, then builds and
+    queries every backend. Returns one row of measurements per (recipe, backend).
+    """
+    rows = []
+    for recipe in recipes:
+        embedder = make_embedder(recipe, args, latency)
+        vectors, embed_seconds = embed_corpus(recipe, embedder, course_ids, courses, args.cache_dir, args.refresh)
+        embedded = [embedder.embed_query(query["query"]) for query in queries]
+        query_vectors = normalize_rows(np.stack([vector for vector, _ in embedded]))
+        embed_ms = np.array([ms for _, ms in embedded])
+        logging.info(f"{recipe.name}: {len(course_ids)} documents x {vectors.shape[1]} dims, "
+                     f"query embedding p50 {np.percentile(embed_ms, 50):.1f} ms")
+
+        for backend in backends:
+            search, build_seconds, memory = build_backend(backend, course_ids, vectors, latency,
+                                                          args.hnsw_m, args.ef_search)
+            results = []
+            search_ms = []
+            for query_vector in query_vectors:
+                start = time.perf_counter()
+                results.append(search(query_vector, max(max(RECALL_KS), MRR_CUTOFF)))
+                search_ms.append((time.perf_counter() - start) * 1000)
+            search_ms = np.array(search_ms) + np.array(getattr(search, "network_ms", [0.0] * len(search_ms)))
+            total_ms = embed_ms + search_ms
+            rows.append({
+                "recipe": recipe.name,
+                "backend": backend,
+                "dim": int(vectors.shape[1]),
+                **score_results(results, queries),
+                "search_p50_ms": float(np.percentile(search_ms, 50)),
+                "search_p95_ms": float(np.percentile(search_ms, 95)),
+                "total_p50_ms": float(np.percentile(total_ms, 50)),
+                "total_p95_ms": float(np.percentile(total_ms, 95)),
+                "build_seconds": build_seconds,
+                "memory_bytes": int(memory),
+                "embed_corpus_seconds": embed_seconds,
+            })
+    return rows
+
+
+def cheapest(rows, metric, target, optimize):
+    """
+    The configuration that meets the recall target at the lowest p95 latency
+    (optimize="latency") or instance memory (optimize="memory"), or None.
+    """
+    eligible = [row for row in rows if row[metric] >= target]
+    if optimize == "memory":
+        eligible = [row for row in eligible if row["backend"] != "remote_stub"]
+        return min(eligible, key=lambda row: (row["memory_bytes"], row["total_p95_ms"]), default=None)
+    return min(eligible, key=lambda row: (row["total_p95_ms"], row["memory_bytes"]), default=None)
+
+
+def print_report(rows):
+    recall_columns = [f"recall@{k}" for k in RECALL_KS]
+    print(f"{'recipe':14} {'backend':13} {'dim':>5} " + " ".join(f"{c:>9}" for c in recall_columns)
+          + f" {'mrr':>6} {'search p50/p95 ms':>18} {'total p50/p95 ms':>17} {'build s':>8} {'memory':>9}")
+    for row in rows:
+        print(f"{row['recipe']:14} {row['backend']:13} {row['dim']:>5} "
+              + " ".join(f"{row[c]:>9.3f}" for c in recall_columns)
+              + f" {row['mrr']:>6.3f} {row['search_p50_ms']:>8.2f}/{row['search_p95_ms']:<9.2f}"
+              f" {row['total_p50_ms']:>7.1f}/{row['total_p95_ms']:<9.1f} {row['build_seconds']:>8.2f}"
+              f" {row['memory_bytes'] / 1e6:>7.2f}MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare embedding recipes and search backends on labeled queries")
+    parser.add_argument("--csv", default="./data/catalog.csv", help="Course catalog CSV")
+    parser.add_argument("--labels", default="./data/retrieval_queries.jsonl", help="Labeled query -> course set")
+    parser.add_argument("--generated", type=int, default=100, help="Description-derived queries to add")
+    parser.add_argument("--recipes", nargs="+", default=list(RECIPES), choices=list(RECIPES))
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=list(BACKENDS))
+    parser.add_argument("--hnsw-m", type=int, default=16, help="HNSW links per node")
+    parser.add_argument("--ef-search", type=int, default=64, help="HNSW candidate list size while searching")
+    parser.add_argument("--project-id", default="bteam-6f36c", help="Google Cloud project ID")
+    parser.add_argument("--location", default="us-central1", help="Google Cloud location")
+    parser.add_argument("--offline", action="store_true",
+                        help="Use hash embeddings and modelled network latency instead of the real models")
+    parser.add_argument("--cache-dir", default="./data/benchmark", help="Where document embeddings are cached")
+    parser.add_argument("--refresh", action="store_true", help="Re-embed the catalog even if cached")
+    parser.add_argument("--recall-target", type=float, default=None,
+                        help="Report the cheapest configuration reaching this recall; exit 1 if none does")
+    parser.add_argument("--target-k", type=int, default=10, choices=RECALL_KS, help="k for --recall-target")
+    parser.add_argument("--optimize", choices=["latency", "memory"], default="latency",
+                        help="What 'cheapest' minimizes among configurations meeting the target")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", default=None, help="Also write the measurements to this JSON file")
+    args = parser.parse_args()
+
+    # Modelled round trips to the hosted vector store (and, offline, the embedding API).
+    from loadtest.fakes import LatencyModel
+    latency = LatencyModel(seed=args.seed)
+
+    course_ids, courses = load_courses(args.csv)
+    queries = load_labeled_queries(args.labels, course_ids) if args.labels else []
+    queries += generate_queries(course_ids, courses, args.generated, args.seed)
+    logging.info(f"Benchmarking {len(queries)} queries "
+                 f"({sum(q['set'] == 'labeled' for q in queries)} labeled) against {len(course_ids)} courses")
+
+    rows = run_benchmark([RECIPES[name] for name in args.recipes], args.backends, queries,
+                         course_ids, courses, args, latency)
+    print_report(rows)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(rows, f, indent=2)
+
+    if args.recall_target is not None:
+        metric = f"recall@{args.target_k}"
+        best = cheapest(rows, metric, args.recall_target, args.optimize)
+        if best is None:
+            print(f"No configuration reaches {metric} >= {args.recall_target}")
+            sys.exit(1)
+        print(f"Cheapest by {args.optimize} with {metric} >= {args.recall_target}: {best['recipe']} + "
+              f"{best['backend']} ({metric} {best[metric]:.3f}, p95 {best['total_p95_ms']:.1f} ms, "
+              f"{best['memory_bytes'] / 1e6:.2f} MB)")
+
+
+if __name__ == '__main__':
+    main()
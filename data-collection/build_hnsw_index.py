@@ -0,0 +1,38 @@
+import argparse
+import logging
+import time
+
+from artifacts import load_embeddings_artifact
+
+import _functions_path  # noqa: F401
+from local_index import LocalCourseIndex
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the local HNSW index served by the rag function")
+    parser.add_argument("--artifact", default="./data/course_chunks.npz",
+                        help="Embeddings artifact written by encoder.py --export (course or chunk rows)")
+    parser.add_argument("--output", default="../functions/data/hnsw_index", help="Index directory to write")
+    parser.add_argument("--embedding-model", default="text-embedding-004",
+                        help="Model the artifact was embedded with (used for query embeddings)")
+    parser.add_argument("--M", type=int, default=16, help="Links per node (level 0 uses 2*M)")
+    parser.add_argument("--ef-construction", type=int, default=100, help="Candidate list size while building")
+    parser.add_argument("--ef-search", type=int, default=64, help="Default candidate list size while searching")
+    args = parser.parse_args()
+
+    ids, vectors, rows = load_embeddings_artifact(args.artifact)
+    logging.info(f"Building HNSW index over {len(ids)} rows (M={args.M}, ef_construction={args.ef_construction})")
+    start_time = time.time()
+    index = LocalCourseIndex.build(
+        ids, vectors, rows,
+        embedding_model=args.embedding_model,
+        M=args.M, ef_construction=args.ef_construction, ef_search=args.ef_search,
+    )
+    index.save(args.output)
+    logging.info(f"Built and saved index to {args.output} in {time.time() - start_time:.2f} seconds")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+import argparse
+import logging
+import os
+import time
+
+import numpy as np
+
+from artifacts import load_embeddings_artifact
+
+import _functions_path  # noqa: F401
+from neighbors import BLOCK_SIZE, DEFAULT_NEIGHBORS, NeighborGraph
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+
+def course_vectors(vectors, rows):
+    """
+    Collapses artifact rows to one vector per course ID ("TAG NUM", as in the
+    catalog): chunk rows and cross-listed duplicates are mean-pooled.
+    """
+    positions = {}
+    for row_index, row in enumerate(rows):
+        course_id = row.get("course_id") or f"{row.get('tag', '')} {row.get('number', '')}".strip()
+        positions.setdefault(course_id, []).append(row_index)
+    vectors = np.asarray(vectors, dtype=np.float32)
+    pooled = np.stack([vectors[group].mean(axis=0) if len(group) > 1 else vectors[group[0]]
+                       for group in positions.values()])
+    return list(positions), pooled
+
+
+def build_neighbor_graph(artifact_path, output_path, k=DEFAULT_NEIGHBORS, block_size=BLOCK_SIZE, full=False):
+    """
+    Builds the similar-courses graph from an embeddings artifact and saves it.
+    If a graph already exists at output_path, only the courses whose
+    embeddings changed (and the lists that referenced them) are recomputed.
+    """
+    _, vectors, rows = load_embeddings_artifact(artifact_path)
+    course_ids, pooled = course_vectors(vectors, rows)
+    start_time = time.time()
+    if not full and os.path.exists(output_path):
+        graph, stats = NeighborGraph.load(output_path).update(course_ids, pooled, k=k, block_size=block_size)
+        logging.info(f"Updated neighbor graph: {stats}")
+    else:
+        graph = NeighborGraph.build(course_ids, pooled, k=k, block_size=block_size)
+    graph.save(output_path)
+    logging.info(f"Saved top-{graph.k} neighbors for {len(graph)} courses to {output_path} "
+                 f"in {time.time() - start_time:.2f} seconds ({os.path.getsize(output_path) / 1024:.0f} KiB)")
+    return graph
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute the similar-courses graph served by the functions")
+    parser.add_argument("--artifact", default="./data/course_embeddings.npz",
+                        help="Embeddings artifact written by encoder.py --export")
+    parser.add_argument("--output", default="../functions/data/course_neighbors.npz", help="Graph artifact to write")
+    parser.add_argument("--k", type=int, default=DEFAULT_NEIGHBORS, help="Neighbors kept per course")
+    parser.add_argument("--block-size", type=int, default=BLOCK_SIZE, help="Courses per similarity matmul block")
+    parser.add_argument("--full", action="store_true", help="Rebuild from scratch instead of incrementally")
+    args = parser.parse_args()
+
+    build_neighbor_graph(args.artifact, args.output, k=args.k, block_size=args.block_size, full=args.full)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,271 @@
+import argparse
+import csv
+import logging
+import re
+import zlib
+
+import numpy as np
+
+SHINGLE_WORDS = 3
+NUM_PERM = 128
+BANDS = 16  # 16 bands of 8 rows: pairs above ~0.7 Jaccard become candidates
+MIN_JACCARD = 0.8  # Candidates are kept only above this exact Jaccard
+# Boilerplate like "(1-5 units)" is identical across unrelated courses; only
+# descriptions with at least this many shingles are compared.
+MIN_SHINGLES = 8
+MERSENNE_PRIME = (1 << 31) - 1
+# Title words that mark a variant of a course rather than a different course.
+VARIANT_WORDS = {"honors", "honor", "scholars", "scholar", "section"}
+ALIAS_SEPARATOR = ";"
+# The catalog's own cross-listing notes ("Also listed as CLAS 172 and HIST 107.").
+CROSS_LISTING = re.compile(
+    r'(?:also listed as|cross[- ]?listed (?:with|as)|same as)\s+((?:[A-Z]{4}\s*\d+[A-Z]{0,2}(?:/\d+[A-Z]{0,2})?'
+    r'(?:\s*(?:,|and|or)\s*)?)+)', re.IGNORECASE)
+LISTED_CODE = re.compile(r'([A-Z]{4})\s*(\d+[A-Z]{0,2})')
+# Titles shared by unrelated courses across departments; never merged on description alone.
+BOILERPLATE_TITLE = re.compile(
+    r'\b(special topics?|topics in|selected topics|independent study|directed (reading|research|study)|'
+    r'internship|practicum|senior (thesis|project)|capstone|thesis|seminar)\b', re.IGNORECASE)
+# Sequence markers in titles: "Part 2", "II", "1", "A" in "Elementary French A".
+SEQUENCE_MARKER = re.compile(r'\b(part\s+\w+|[ivx]+|\d+|[a-z])\b', re.IGNORECASE)
+
+
+def description_shingles(description):
+    """
+    CRC32 hashes of the word n-grams of a description, without its
+    cross-listing note. Too-short descriptions have none.
+    """
+    words = re.findall(r'\w+', CROSS_LISTING.sub(" ", description or "").lower())
+    return {zlib.crc32(" ".join(words[i:i + SHINGLE_WORDS]).encode("utf-8"))
+            for i in range(len(words) - SHINGLE_WORDS + 1)}
+
+
+def minhash_signatures(shingle_sets, num_perm=NUM_PERM, seed=0):
+    """
+    One MinHash signature per shingle set, using num_perm universal hash
+    functions (a*x + b) mod p. Rows for empty sets are all max values.
+    """
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, MERSENNE_PRIME, num_perm, dtype=np.uint64)
+    b = rng.integers(0, MERSENNE_PRIME, num_perm, dtype=np.uint64)
+    signatures = np.full((len(shingle_sets), num_perm), MERSENNE_PRIME, dtype=np.uint64)
+    for row, shingles in enumerate(shingle_sets):
+        if shingles:
+            values = np.fromiter(shingles, dtype=np.uint64, count=len(shingles))
+            signatures[row] = ((np.outer(values, a) + b) % MERSENNE_PRIME).min(axis=0)
+    return signatures
+
+
+def lsh_candidates(signatures, has_shingles, bands=BANDS):
+    """
+    Pairs of rows that agree on every row of at least one band.
+    """
+    rows_per_band = signatures.shape[1] // bands
+    pairs = set()
+    for band in range(bands):
+        buckets = {}
+        block = signatures[:, band * rows_per_band:(band + 1) * rows_per_band]
+        for row in np.flatnonzero(has_shingles):
+            buckets.setdefault(block[row].tobytes(), []).append(int(row))
+        for members in buckets.values():
+            for i in range(len(members)):
+                for j in range(i + 1, len(members)):
+                    pairs.add((members[i], members[j]))
+    return pairs
+
+
+def title_key(title):
+    words = [word for word in re.findall(r'\w+', (title or "").lower()) if word not in VARIANT_WORDS]
+    return " ".join(words)
+
+
+def titles_compatible(first, second):
+    """
+    Near-identical descriptions under unrelated titles are usually a
+    sequence ("... I" / "... II"), not a duplicate.
+    """
+    a, b = title_key(first).split(), title_key(second).split()
+    if len(a) > len(b):
+        a, b = b, a
+    # Equal, or one title's words appear as a run in the other ("Seminar - X" and "X").
+    return bool(a) and any(b[i:i + len(a)] == a for i in range(len(b) - len(a) + 1)) or a == b
+
+
+class _UnionFind:
+    def __init__(self, size):
+        self.parent = list(range(size))
+
+    def find(self, i):
+        while self.parent[i] != i:
+            self.parent[i] = self.parent[self.parent[i]]
+            i = self.parent[i]
+        return i
+
+    def union(self, i, j):
+        i, j = self.find(i), self.find(j)
+        if i != j:
+            self.parent[max(i, j)] = min(i, j)
+
+
+def course_code(row):
+    return f"{row['tag']} {row['number']}"
+
+
+def listed_codes(row):
+    """
+    Codes a row's description says it is cross-listed as.
+    """
+    codes = set()
+    for listing in CROSS_LISTING.finditer(str(row["description"] or "")):
+        codes.update(f"{tag.upper()} {number.upper()}" for tag, number in LISTED_CODE.findall(listing.group(1)))
+    return codes
+
+
+def level_band(number):
+    """
+    0 for lower division (1-99), 1 for upper division (100-199), 2 for graduate.
+    """
+    digits = re.match(r'\d+', str(number))
+    value = int(digits.group()) if digits else 0
+    return 0 if value < 100 else 1 if value < 200 else 2
+
+
+def sequence_markers(title):
+    return [marker.lower() for marker in SEQUENCE_MARKER.findall(title_key(title))]
+
+
+def same_course(first, second, first_listed, second_listed):
+    """
+    Whether two near-identical rows are one course: the same code listed
+    twice (across colleges, say), or codes in different subjects that the
+    catalog says are cross-listed, in the same level band. Different numbers
+    in one subject, different parts of a sequence and generic titles like
+    "Special Topics" are always separate courses.
+    """
+    if first["tag"] == second["tag"] and first["number"] != second["number"]:
+        return False
+    if sequence_markers(first["course"]) != sequence_markers(second["course"]):
+        return False
+    if not titles_compatible(first["course"], second["course"]):
+        return False
+    if course_code(first) == course_code(second):
+        return True
+    if BOILERPLATE_TITLE.search(first["course"]) or BOILERPLATE_TITLE.search(second["course"]):
+        return False
+    if level_band(first["number"]) != level_band(second["number"]):
+        return False
+    return course_code(second) in first_listed or course_code(first) in second_listed
+
+
+def _canonical_rank(row, position, code_counts):
+    # Plain numbers before variants (179 before 179S), then the code listed
+    # most often (cross-listed copies), then catalog order.
+    return (not str(row["number"]).isdigit(), -code_counts[course_code(row)], position)
+
+
+def consolidate_courses(rows, min_jaccard=MIN_JACCARD, bands=BANDS, seed=0):
+    """
+    Groups repeated rows of a course and its explicitly cross-listed copies
+    into one canonical row each. Candidates come from MinHash/LSH over
+    description shingles plus the catalog's cross-listing notes, and are
+    confirmed by exact Jaccard and same_course.
+    The canonical row gets an `aliases` field with the other codes of its
+    group and the colleges of all copies. Returns (canonical rows, groups),
+    where groups lists the merged codes per canonical code.
+    """
+    rows = [dict(row) for row in rows]
+    union = _UnionFind(len(rows))
+    exact = {}
+    for i, row in enumerate(rows):
+        key = (row["tag"], row["number"], title_key(row["course"]), " ".join(str(row["description"]).split()))
+        if key in exact:
+            union.union(exact[key], i)
+        else:
+            exact[key] = i
+
+    shingle_sets = [description_shingles(row["description"]) for row in rows]
+    has_shingles = np.array([len(shingles) >= MIN_SHINGLES for shingles in shingle_sets])
+    signatures = minhash_signatures(shingle_sets, seed=seed)
+    candidates = lsh_candidates(signatures, has_shingles, bands)
+    listed = [listed_codes(row) for row in rows]
+    positions = {}
+    for i, row in enumerate(rows):
+        positions.setdefault(course_code(row), []).append(i)
+    for i, codes in enumerate(listed):
+        for code in codes:
+            candidates.update((min(i, j), max(i, j)) for j in positions.get(code, []) if j != i)
+    for i, j in candidates:
+        first, second = shingle_sets[i], shingle_sets[j]
+        if not has_shingles[i] or not has_shingles[j]:
+            continue
+        if len(first & second) / len(first | second) >= min_jaccard and \
+                same_course(rows[i], rows[j], listed[i], listed[j]):
+            union.union(i, j)
+
+    groups = {}
+    for i in range(len(rows)):
+        groups.setdefault(union.find(i), []).append(i)
+    canonical_rows = []
+    merged = {}
+    for members in sorted(groups.values()):
+        code_counts = {}
+        for i in members:
+            code_counts[course_code(rows[i])] = code_counts.get(course_code(rows[i]), 0) + 1
+        canonical_index = min(members, key=lambda i: _canonical_rank(rows[i], i, code_counts))
+        canonical = rows[canonical_index]
+        aliases = []
+        for i in members:
+            # Aliases from an earlier consolidation carry over.
+            codes = [course_code(rows[i])] + str(rows[i].get("aliases") or "").split(ALIAS_SEPARATOR)
+            for code in codes:
+                if code and code != course_code(canonical) and code not in aliases:
+                    aliases.append(code)
+        colleges = []
+        for i in members:
+            for college in str(rows[i]["college"]).split(ALIAS_SEPARATOR):
+                if college and college not in colleges:
+                    colleges.append(college)
+        canonical["college"] = ALIAS_SEPARATOR.join(colleges)
+        canonical["aliases"] = ALIAS_SEPARATOR.join(aliases)
+        canonical_rows.append((canonical_index, canonical))
+        if len(members) > 1:
+            merged[course_code(canonical)] = [course_code(rows[i]) for i in members if i != canonical_index]
+    return [row for _, row in sorted(canonical_rows, key=lambda item: item[0])], merged
+
+
+def consolidate_course_df(df, **kwargs):
+    """
+    consolidate_courses for the scraper's DataFrame.
+    """
+    import pandas as pd
+    rows, merged = consolidate_courses(df.to_dict("records"), **kwargs)
+    logging.info(f"Consolidated {len(df)} courses into {len(rows)} ({len(merged)} groups merged)")
+    return pd.DataFrame(rows, columns=list(df.columns) + ["aliases"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge cross-listed and near-duplicate courses in a catalog CSV")
+    parser.add_argument("--input", default="./data/courses.csv", help="Raw scraped courses")
+    parser.add_argument("--output", default="./data/catalog.csv", help="Consolidated catalog")
+    parser.add_argument("--min-jaccard", type=float, default=MIN_JACCARD)
+    parser.add_argument("--show", action="store_true", help="Print every merged group")
+    args = parser.parse_args()
+
+    with open(args.input, newline='', encoding='utf-8') as f:
+        reader = csv.DictReader(f)
+        fields = [field for field in reader.fieldnames if field != "aliases"] + ["aliases"]
+        rows = list(reader)
+    canonical, merged = consolidate_courses(rows, min_jaccard=args.min_jaccard)
+    with open(args.output, "w", newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=fields, lineterminator="\n")
+        writer.writeheader()
+        writer.writerows(canonical)
+    logging.info(f"{len(rows)} rows -> {len(canonical)} canonical courses; {len(merged)} groups merged")
+    if args.show:
+        for code, others in sorted(merged.items()):
+            print(f"{code}: {', '.join(others)}")
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    main()
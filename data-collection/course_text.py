@@ -0,0 +1,33 @@
+def create_rich_text_representation(course_data):
+    """
+    Creates a rich text representation of the course data for better embeddings.
+    """
+    # Extract fields with default empty strings for missing values
+    college = course_data.get("college", "")
+    department = course_data.get("department", "")
+    number = course_data.get("number", "")
+    course = course_data.get("course", "")
+    description = course_data.get("description", "")
+    tag = course_data.get("tag", "")
+    pre_reqs = course_data.get("pre_reqs", "")
+    aliases = course_data.get("aliases", "")
+    
+    # Create a rich text representation that includes all available information
+    rich_text = f"""Course Name: {course}
+        Department: {department}
+        College: {college}
+        Course Number: {number}
+        Course Tag: {tag}
+        Description: {description}
+        Prerequisites: {pre_reqs}
+        """
+    # Add more contextual information to differentiate from the structured part
+    summary = f"This is a {tag} {number} course titled '{course}' in the {department} department at {college}. "
+    if description:
+        summary += description + " "
+    if pre_reqs:
+        summary += f"Students should complete {pre_reqs} before enrolling in this course."
+    if aliases:
+        summary += f" It is also listed as {aliases.replace(';', ',')}."
+    result = rich_text + "\n" + summary
+    return result
@@ -4,12 +4,15 @@ from firebase_admin import credentials, firestore
 import vertexai
 from vertexai.language_models import TextEmbeddingModel, TextEmbeddingInput
 import time
+import re
 import argparse
 import logging
 from tqdm import tqdm
 import numpy as np
 from concurrent.futures import ThreadPoolExecutor
 import json
+from artifacts import save_embeddings_artifact
+from course_text import create_rich_text_representation
 
 # Configure logging
 logging.basicConfig(
@@ -21,6 +24,9 @@ logging.basicConfig(
     ]
 )
 
+COURSE_COLLECTION = "course_embeddings_large"
+CHUNK_COLLECTION = "course_chunks_large"
+
 def initialize_firebase(service_account_path):
     """
     Initializes Firebase Admin SDK and returns a Firestore client.
@@ -51,37 +57,6 @@ def initialize_vertexai(project_id, location):
         logging.error(f"Failed to initialize Vertex AI: {e}")
         raise
 
-def create_rich_text_representation(course_data):
-    """
-    Creates a rich text representation of the course data for better embeddings.
-    """
-    # Extract fields with default empty strings for missing values
-    college = course_data.get("college", "")
-    department = course_data.get("department", "")
-    number = course_data.get("number", "")
-    course = course_data.get("course", "")
-    description = course_data.get("description", "")
-    tag = course_data.get("tag", "")
-    pre_reqs = course_data.get("pre_reqs", "")
-    
-    # Create a rich text representation that includes all available information
-    rich_text = f"""Course Name: {course}
-        Department: {department}
-        College: {college}
-        Course Number: {number}
-        Course Tag: {tag}
-        Description: {description}
-        Prerequisites: {pre_reqs}
-        """
-    # Add more contextual information to differentiate from the structured part
-    summary = f"This is a {tag} {number} course titled '{course}' in the {department} department at {college}. "
-    if description:
-        summary += description + " "
-    if pre_reqs:
-        summary += f"Students should complete {pre_reqs} before enrolling in this course."
-    result = rich_text + "\n" + summary
-    return result
-
 def generate_embedding(text_input, embedding_model, dimensionality=768, retries=3):
     """
     Generates embedding for a given text with retry logic.
@@ -100,9 +75,32 @@ def generate_embedding(text_input, embedding_model, dimensionality=768, retries=
                 raise
             time.sleep(2 ** attempt)  # Exponential backoff
 
-def process_course(row, embedding_model, dimensionality, docs_set):
+def quantize_embedding(embedding_vector):
+    """
+    Encodes an embedding as int8 bytes plus one float scale (symmetric per-vector
+    quantization). A 768-dim vector becomes 768 bytes instead of a 768-element
+    array of doubles in Firestore.
+    """
+    vector = np.asarray(embedding_vector, dtype=np.float32)
+    scale = max(float(np.abs(vector).max()), 1e-12) / 127.0
+    codes = np.clip(np.rint(vector / scale), -127, 127).astype(np.int8)
+    return codes.tobytes(), scale
+
+def decode_stored_embedding(data):
+    """
+    Returns the float32 embedding of a stored course document, whichever format it was written in.
+    """
+    if data.get("embedding_int8") is not None:
+        codes = np.frombuffer(data["embedding_int8"], dtype=np.int8)
+        return codes.astype(np.float32) * np.float32(data.get("embedding_scale", 1.0))
+    if data.get("embedding"):
+        return np.asarray(data["embedding"], dtype=np.float32)
+    return None
+
+def process_course(row, embedding_model, dimensionality, docs_set, storage="float"):
     """
     Process a single course row and return the document data and ID.
+    With storage="int8" the embedding is stored quantized (see quantize_embedding).
     """
     # Ensure there are at least six columns (required fields)
     if len(row) < 6:
@@ -117,6 +115,7 @@ def process_course(row, embedding_model, dimensionality, docs_set):
     description = row[4].strip()
     tag = row[5].strip()
     pre_reqs = row[6].strip() if len(row) > 6 else ""
+    aliases = row[7].strip() if len(row) > 7 else ""  # From course_dedup.py
     
     # Create a course data dictionary
     course_data = {
@@ -127,6 +126,7 @@ def process_course(row, embedding_model, dimensionality, docs_set):
         "description": description,
         "tag": tag,
         "pre_reqs": pre_reqs,
+        "aliases": aliases,
     }
     
     # Build rich text representation
@@ -137,7 +137,10 @@ def process_course(row, embedding_model, dimensionality, docs_set):
         embedding_vector = generate_embedding(text_input, embedding_model, dimensionality)
         
         # Add embedding to course data
-        course_data["embedding"] = embedding_vector
+        if storage == "int8":
+            course_data["embedding_int8"], course_data["embedding_scale"] = quantize_embedding(embedding_vector)
+        else:
+            course_data["embedding"] = embedding_vector
         
         # Create document ID
         base_doc_id = f"{tag}-{number}".replace(" ", "_").replace("/", "_")
@@ -163,7 +166,57 @@ def process_course(row, embedding_model, dimensionality, docs_set):
         logging.error(f"Error processing course {course}: {e}")
         return None, None
 
-def batch_upload_to_firestore(db, batch_data):
+def chunk_description(description, max_words=80, overlap=20):
+    """
+    Splits a long description into overlapping chunks of at most max_words words,
+    breaking on sentence boundaries where possible. Short descriptions stay whole.
+    """
+    words = description.split()
+    if len(words) <= max_words:
+        return [description] if description else []
+
+    sentences = re.split(r'(?<=[.!?])\s+', description)
+    chunks = []
+    current = []
+    for sentence in sentences:
+        sentence_words = sentence.split()
+        if current and len(current) + len(sentence_words) > max_words:
+            chunks.append(" ".join(current))
+            current = current[-overlap:] if overlap else []
+        current.extend(sentence_words)
+        # A single sentence longer than a chunk is split on word boundaries.
+        while len(current) > max_words:
+            chunks.append(" ".join(current[:max_words]))
+            current = current[max_words - overlap:] if overlap else current[max_words:]
+    if current and (not chunks or len(current) > overlap):
+        chunks.append(" ".join(current))
+    return chunks
+
+def process_course_chunks(course_data, doc_id, embedding_model, dimensionality, storage="float", chunk_words=80):
+    """
+    Embeds each description chunk of a processed course as its own row, so
+    long descriptions (and later syllabi or section notes) are searchable
+    piece by piece. Every chunk row carries the parent course fields.
+    """
+    chunk_docs = []
+    base = {key: value for key, value in course_data.items() if not key.startswith("embedding")}
+    chunks = chunk_description(course_data["description"], max_words=chunk_words, overlap=chunk_words // 4)
+    for index, chunk in enumerate(chunks):
+        text_input = f"{course_data['course']} ({course_data['tag']} {course_data['number']})\n{chunk}"
+        try:
+            embedding_vector = generate_embedding(text_input, embedding_model, dimensionality)
+        except Exception as e:
+            logging.error(f"Error embedding chunk {index} of {doc_id}: {e}")
+            continue
+        chunk_data = dict(base, course_doc_id=doc_id, chunk_index=index, chunk_text=chunk)
+        if storage == "int8":
+            chunk_data["embedding_int8"], chunk_data["embedding_scale"] = quantize_embedding(embedding_vector)
+        else:
+            chunk_data["embedding"] = embedding_vector
+        chunk_docs.append((f"{doc_id}--c{index}", chunk_data))
+    return chunk_docs
+
+def batch_upload_to_firestore(db, batch_data, collection=COURSE_COLLECTION):
     """
     Upload a batch of documents to Firestore using batch writes.
     """
@@ -173,9 +226,9 @@ def batch_upload_to_firestore(db, batch_data):
     for doc_id, data in batch_data:
         if not doc_id.strip("_"):
             # Auto-generate ID if doc_id is empty
-            ref = db.collection("course_embeddings_large").document()
+            ref = db.collection(collection).document()
         else:
-            ref = db.collection("course_embeddings_large").document(doc_id)
+            ref = db.collection(collection).document(doc_id)
         
         batch.set(ref, data)
         count += 1
@@ -183,17 +236,20 @@ def batch_upload_to_firestore(db, batch_data):
     batch.commit()
     return count
 
-def process_csv_and_store(csv_path, db, embedding_model, dimensionality=768, batch_size=25):
+def process_csv_and_store(csv_path, db, embedding_model, dimensionality=768, batch_size=25, storage="float",
+                          chunk_words=None):
     """
     Process CSV file and store embeddings in Firestore with batching.
+    With chunk_words set, description chunks are also embedded into CHUNK_COLLECTION.
     """
     docs_set = set()
     current_batch = []
+    chunk_batch = []
     total_processed = 0
     
     # First, load existing document IDs to avoid duplicates
     try:
-        existing_docs = db.collection("course_embeddings_large").stream()
+        existing_docs = db.collection(COURSE_COLLECTION).stream()
         for doc in existing_docs:
             docs_set.add(doc.id)
         logging.info(f"Loaded {len(docs_set)} existing document IDs")
@@ -209,10 +265,22 @@ def process_csv_and_store(csv_path, db, embedding_model, dimensionality=768, bat
             
             with tqdm(total=len(rows), desc="Processing courses") as pbar:
                 for row in rows:
-                    course_data, doc_id = process_course(row, embedding_model, dimensionality, docs_set)
+                    course_data, doc_id = process_course(row, embedding_model, dimensionality, docs_set, storage)
                     
                     if course_data and doc_id:
                         current_batch.append((doc_id, course_data))
+                        if chunk_words:
+                            chunk_batch.extend(process_course_chunks(
+                                course_data, doc_id, embedding_model, dimensionality, storage, chunk_words
+                            ))
+                    
+                    if len(chunk_batch) >= batch_size:
+                        try:
+                            uploaded = batch_upload_to_firestore(db, chunk_batch, CHUNK_COLLECTION)
+                            logging.info(f"Uploaded batch of {uploaded} chunks.")
+                            chunk_batch = []
+                        except Exception as e:
+                            logging.error(f"Error uploading chunk batch: {e}")
                     
                     # If batch is full, upload to Firestore
                     if len(current_batch) >= batch_size:
@@ -234,6 +302,12 @@ def process_csv_and_store(csv_path, db, embedding_model, dimensionality=768, bat
                     logging.info(f"Uploaded final batch of {uploaded} documents. Total: {total_processed}")
                 except Exception as e:
                     logging.error(f"Error uploading final batch: {e}")
+            if chunk_batch:
+                try:
+                    uploaded = batch_upload_to_firestore(db, chunk_batch, CHUNK_COLLECTION)
+                    logging.info(f"Uploaded final batch of {uploaded} chunks.")
+                except Exception as e:
+                    logging.error(f"Error uploading final chunk batch: {e}")
     
     except Exception as e:
         logging.error(f"Error processing CSV file: {e}")
@@ -249,14 +323,14 @@ def create_embedding_stats(db):
     stats = {"count": 0, "departments": {}, "colleges": {}}
     
     try:
-        docs = db.collection("course_embeddings_large").stream()
+        docs = db.collection(COURSE_COLLECTION).stream()
         embeddings = []
         
         for doc in docs:
             data = doc.to_dict()
-            embedding = data.get("embedding")
-            if embedding:
-                embeddings.append(np.array(embedding))
+            embedding = decode_stored_embedding(data)
+            if embedding is not None:
+                embeddings.append(embedding)
             
             # Count by department and college
             dept = data.get("department", "Unknown")
@@ -290,9 +364,30 @@ def create_embedding_stats(db):
         logging.error(f"Error generating embedding statistics: {e}")
         return {"error": str(e)}
 
+def export_embeddings(db, output_path, collection=COURSE_COLLECTION):
+    """
+    Exports every stored course (or chunk) embedding to a local .npz artifact
+    (ids, float32 vectors and course metadata) for building in-memory indexes offline.
+    """
+    ids = []
+    vectors = []
+    metadata = []
+    for doc in db.collection(collection).stream():
+        data = doc.to_dict()
+        embedding = decode_stored_embedding(data)
+        if embedding is None:
+            continue
+        ids.append(doc.id)
+        vectors.append(embedding)
+        metadata.append({key: value for key, value in data.items() if not key.startswith("embedding")})
+
+    save_embeddings_artifact(output_path, ids, vectors, metadata)
+    logging.info(f"Exported {len(ids)} embeddings to {output_path}")
+    return len(ids)
+
 def main():
     parser = argparse.ArgumentParser(description="Generate and store course embeddings")
-    parser.add_argument("--csv", default="./data/courses.csv", help="Path to CSV file")
+    parser.add_argument("--csv", default="./data/catalog.csv", help="Path to the consolidated catalog CSV")
     parser.add_argument("--service-account", default="./bteam-6f36c-firebase-adminsdk-fbsvc-de6d814156.json", 
                         help="Path to Firebase service account file")
     parser.add_argument("--project-id", default="bteam-6f36c", help="Google Cloud project ID")
@@ -301,6 +396,14 @@ def main():
                         help="Embedding dimensionality (768 recommended for better quality)")
     parser.add_argument("--batch-size", type=int, default=25, help="Firestore batch size")
     parser.add_argument("--stats", action="store_true", help="Generate embedding statistics")
+    parser.add_argument("--storage", choices=["float", "int8"], default="float",
+                        help="Store embeddings as float arrays or as int8 bytes with a scale")
+    parser.add_argument("--chunk-words", type=int, default=None,
+                        help="Also embed description chunks of at most this many words")
+    parser.add_argument("--export", default=None,
+                        help="Export all stored embeddings to this .npz artifact after processing")
+    parser.add_argument("--neighbors", default=None,
+                        help="Also (incrementally) rebuild the similar-courses graph at this path from the export")
     
     args = parser.parse_args()
     
@@ -317,7 +420,9 @@ def main():
         total_processed = process_csv_and_store(
             args.csv, db, embedding_model, 
             dimensionality=args.dimensionality,
-            batch_size=args.batch_size
+            batch_size=args.batch_size,
+            storage=args.storage,
+            chunk_words=args.chunk_words
         )
         
         elapsed_time = time.time() - start_time
@@ -328,6 +433,12 @@ def main():
             stats = create_embedding_stats(db)
             logging.info(f"Embedding statistics: {total_processed} courses, " 
                         f"{stats.get('embedding_dimension', 'unknown')} dimensions")
+
+        if args.export:
+            export_embeddings(db, args.export, CHUNK_COLLECTION if args.chunk_words else COURSE_COLLECTION)
+            if args.neighbors:
+                from build_neighbors import build_neighbor_graph
+                build_neighbor_graph(args.export, args.neighbors)
     
     except Exception as e:
         logging.error(f"Error in main function: {e}")
@@ -0,0 +1,55 @@
+import argparse
+import logging
+import os
+
+from _functions_path import FUNCTIONS_DIR
+from catalog import DEFAULT_CATALOG_PATH
+from snapshots import LocalSnapshotStore, StorageSnapshotStore
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Publish an immutable catalog/index snapshot and point warm instances at it")
+    parser.add_argument("--catalog", default=DEFAULT_CATALOG_PATH)
+    parser.add_argument("--local-index", default=os.path.join(FUNCTIONS_DIR, "data", "hnsw_index"),
+                        help="Index directory from build_hnsw_index.py (skipped if missing)")
+    parser.add_argument("--neighbors", default=os.path.join(FUNCTIONS_DIR, "data", "course_neighbors.npz"),
+                        help="Graph from build_neighbors.py (skipped if missing)")
+    parser.add_argument("--store-dir", default=None, help="Publish to a directory store (RAG_SNAPSHOT_DIR)")
+    parser.add_argument("--bucket", default=None, help="Publish to a Cloud Storage bucket (RAG_SNAPSHOT_BUCKET)")
+    parser.add_argument("--prefix", default="snapshots", help="Object prefix inside the bucket")
+    parser.add_argument("--version", default=None, help="Version ID (default: UTC time + content hash)")
+    parser.add_argument("--no-activate", action="store_true", help="Upload without moving the version pointer")
+    parser.add_argument("--activate", default=None, metavar="VERSION",
+                        help="Only move the pointer to an already published version (rollback)")
+    args = parser.parse_args()
+
+    if args.store_dir:
+        store = LocalSnapshotStore(args.store_dir)
+    elif args.bucket:
+        import firebase_admin
+        firebase_admin.initialize_app(options={"storageBucket": args.bucket})
+        store = StorageSnapshotStore(args.bucket, args.prefix)
+    else:
+        parser.error("one of --store-dir or --bucket is required")
+
+    if args.activate:
+        store.set_pointer(args.activate)
+        logging.info(f"Pointer now at {args.activate}")
+        return
+
+    components = {"catalog": args.catalog}
+    for name, path in (("local_index", args.local_index), ("neighbors", args.neighbors)):
+        if path and os.path.exists(path):
+            components[name] = path
+        else:
+            logging.info(f"No {name} at {path}; publishing without it")
+    version = store.publish(components, version=args.version, activate=not args.no_activate)
+    logging.info(f"Published snapshot {version} with {', '.join(components)}"
+                 + ("" if args.no_activate else "; pointer updated"))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,214 @@
+import json
+import logging
+
+import numpy as np
+
+import _functions_path  # noqa: F401
+from vector_index import normalize_rows, top_k_indices
+
+# Candidates kept from the approximate scan for each requested result before
+# exact float32 rescoring.
+RESCORE_FACTOR = 4
+SCAN_BLOCK = 4096  # Rows decoded at a time during the int8 scan
+
+
+def _index_paths(path: str):
+    """
+    The .npz and sibling .f32 file of an index saved at path, with or without
+    the .npz extension.
+    """
+    base = path[:-len(".npz")] if path.endswith(".npz") else path
+    return base + ".npz", base + ".f32"
+
+
+class Int8Quantizer:
+    """
+    Symmetric per-dimension scalar quantization to int8 (4x smaller than float32).
+    """
+
+    def __init__(self, scale: np.ndarray):
+        self.scale = np.asarray(scale, dtype=np.float32)
+
+    @classmethod
+    def fit(cls, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        return cls(np.maximum(np.abs(vectors).max(axis=0), 1e-12) / 127.0)
+
+    def encode(self, vectors) -> np.ndarray:
+        return np.clip(np.rint(np.asarray(vectors, dtype=np.float32) / self.scale), -127, 127).astype(np.int8)
+
+    def decode(self, codes) -> np.ndarray:
+        return codes.astype(np.float32) * self.scale
+
+    def scan(self, codes: np.ndarray, query: np.ndarray) -> np.ndarray:
+        """
+        Approximate inner products between the query and every encoded vector.
+        The scale is folded into the query, so rows are only cast, never rescaled.
+        """
+        scaled_query = query.astype(np.float32) * self.scale
+        scores = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), SCAN_BLOCK):
+            block = codes[start:start + SCAN_BLOCK]
+            scores[start:start + len(block)] = block.astype(np.float32) @ scaled_query
+        return scores
+
+    @property
+    def nbytes(self) -> int:
+        return self.scale.nbytes
+
+
+def _kmeans(data: np.ndarray, clusters: int, iterations: int, rng) -> np.ndarray:
+    centroids = data[rng.choice(len(data), clusters, replace=False)].copy()
+    for _ in range(iterations):
+        distances = (
+            (data ** 2).sum(axis=1, keepdims=True)
+            - 2 * data @ centroids.T
+            + (centroids ** 2).sum(axis=1)
+        )
+        assignment = distances.argmin(axis=1)
+        for c in range(clusters):
+            members = data[assignment == c]
+            if len(members):
+                centroids[c] = members.mean(axis=0)
+    return centroids
+
+
+class ProductQuantizer:
+    """
+    Product quantization: each vector is split into `subspaces` chunks and every
+    chunk is replaced by the index of its nearest centroid (one byte per chunk).
+    Search uses asymmetric distance computation with per-query lookup tables.
+    """
+
+    def __init__(self, codebooks: np.ndarray):
+        # codebooks: (subspaces, centroids, sub_dim)
+        self.codebooks = np.asarray(codebooks, dtype=np.float32)
+
+    @property
+    def subspaces(self) -> int:
+        return self.codebooks.shape[0]
+
+    @classmethod
+    def fit(cls, vectors, subspaces: int = 96, centroids: int = 256, iterations: int = 15, seed: int = 0):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.shape[1] % subspaces:
+            raise ValueError(f"Dimension {vectors.shape[1]} is not divisible into {subspaces} subspaces")
+        centroids = min(centroids, len(vectors))
+        sub_dim = vectors.shape[1] // subspaces
+        rng = np.random.default_rng(seed)
+        codebooks = np.stack([
+            _kmeans(vectors[:, j * sub_dim:(j + 1) * sub_dim], centroids, iterations, rng)
+            for j in range(subspaces)
+        ])
+        return cls(codebooks)
+
+    def encode(self, vectors) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        sub_dim = self.codebooks.shape[2]
+        codes = np.empty((len(vectors), self.subspaces), dtype=np.uint8)
+        for j, codebook in enumerate(self.codebooks):
+            chunk = vectors[:, j * sub_dim:(j + 1) * sub_dim]
+            distances = (codebook ** 2).sum(axis=1) - 2 * chunk @ codebook.T
+            codes[:, j] = distances.argmin(axis=1)
+        return codes
+
+    def decode(self, codes) -> np.ndarray:
+        return np.concatenate([self.codebooks[j][codes[:, j]] for j in range(self.subspaces)], axis=1)
+
+    def scan(self, codes: np.ndarray, query: np.ndarray) -> np.ndarray:
+        sub_dim = self.codebooks.shape[2]
+        tables = np.einsum("jcd,jd->jc", self.codebooks, query.astype(np.float32).reshape(self.subspaces, sub_dim))
+        scores = np.zeros(len(codes), dtype=np.float32)
+        for j in range(self.subspaces):
+            scores += tables[j][codes[:, j]]
+        return scores
+
+    @property
+    def nbytes(self) -> int:
+        return self.codebooks.nbytes
+
+
+class QuantizedIndex:
+    """
+    Compact vector index: an approximate scan over quantized codes selects
+    candidates that are then rescored exactly against float32 vectors.
+    Vectors are L2-normalized, so scores are cosine similarities.
+    """
+
+    def __init__(self, ids, codes, quantizer, vectors=None):
+        self.ids = list(ids)
+        self.codes = codes
+        self.quantizer = quantizer
+        # Full-precision vectors are only needed for rescoring; they can be a
+        # memory-mapped array so they stay on disk until touched.
+        self.vectors = vectors
+
+    @classmethod
+    def build(cls, ids, vectors, method: str = "int8", keep_vectors: bool = True, **kwargs):
+        vectors = normalize_rows(vectors)
+        if method == "int8":
+            quantizer = Int8Quantizer.fit(vectors)
+        elif method == "pq":
+            quantizer = ProductQuantizer.fit(vectors, **kwargs)
+        else:
+            raise ValueError(f"Unknown quantization method: {method}")
+        return cls(ids, quantizer.encode(vectors), quantizer, vectors if keep_vectors else None)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def search(self, query_vector, k: int = 10, rescore_factor: int = RESCORE_FACTOR):
+        """
+        Returns (id, score) pairs for the k nearest vectors, best first.
+        """
+        query = normalize_rows(query_vector)
+        approximate = self.quantizer.scan(self.codes, query)
+        if self.vectors is None or rescore_factor <= 1:
+            candidates = top_k_indices(approximate, k)
+            return [(self.ids[i], float(approximate[i])) for i in candidates]
+        # Sorted so rows are read from a memory-mapped file in order.
+        candidates = np.sort(top_k_indices(approximate, k * rescore_factor))
+        exact = np.asarray(self.vectors[candidates], dtype=np.float32) @ query
+        return [(self.ids[candidates[i]], float(exact[i])) for i in top_k_indices(exact, k)]
+
+    def memory_bytes(self, include_vectors: bool = False) -> int:
+        total = self.codes.nbytes + self.quantizer.nbytes
+        if include_vectors and self.vectors is not None:
+            total += self.vectors.nbytes
+        return total
+
+    def save(self, path: str):
+        """
+        Writes the index as an .npz. Float vectors go to a sibling .f32 file so
+        load() can memory-map them instead of reading them into RAM.
+        """
+        arrays = {"codes": self.codes, "ids": np.array(json.dumps(self.ids))}
+        if isinstance(self.quantizer, Int8Quantizer):
+            arrays["int8_scale"] = self.quantizer.scale
+        else:
+            arrays["pq_codebooks"] = self.quantizer.codebooks
+        index_path, vectors_path = _index_paths(path)
+        np.savez(index_path, **arrays)
+        if self.vectors is not None:
+            np.asarray(self.vectors, dtype=np.float32).tofile(vectors_path)
+
+    @classmethod
+    def load(cls, path: str, mmap_vectors: bool = True):
+        index_path, vectors_path = _index_paths(path)
+        data = np.load(index_path)
+        ids = json.loads(str(data["ids"]))
+        if "int8_scale" in data:
+            quantizer = Int8Quantizer(data["int8_scale"])
+        else:
+            quantizer = ProductQuantizer(data["pq_codebooks"])
+        vectors = None
+        try:
+            dim = quantizer.scale.shape[0] if isinstance(quantizer, Int8Quantizer) else \
+                quantizer.subspaces * quantizer.codebooks.shape[2]
+            if mmap_vectors:
+                vectors = np.memmap(vectors_path, dtype=np.float32, mode="r", shape=(len(ids), dim))
+            else:
+                vectors = np.fromfile(vectors_path, dtype=np.float32).reshape(len(ids), dim)
+        except OSError:
+            logging.warning("No float32 vectors at %s; searching without rescoring.", vectors_path)
+        return cls(ids, data["codes"], quantizer, vectors)
@@ -0,0 +1,267 @@
+import argparse
+import asyncio
+import functools
+import hashlib
+import json
+import logging
+import os
+import random
+import sys
+import time
+
+import _functions_path  # noqa: F401
+from catalog import DEFAULT_CATALOG_PATH, Catalog
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+HASH_FIELD = "content_hash"
+
+
+def content_hash(content, metadata):
+    """
+    Hash of everything that ends up in a serving document; metadata order does not matter.
+    """
+    payload = json.dumps([content, {k: v for k, v in metadata.items() if k != HASH_FIELD}], sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+
+def catalog_documents(csv_path):
+    """
+    The serving documents for the catalog, shaped like the Astra `courses`
+    collection (description as content; course_id, course_name, department,
+    pre_reqs and any alias codes as metadata), keyed by a stable document
+    ID. Cross-listed copies of a course get the college appended to their ID.
+    """
+    documents = {}
+    for course in Catalog.from_csv(csv_path).courses:
+        doc_id = f"{course['tag']}-{course['number']}".replace(" ", "_").replace("/", "_")
+        if doc_id in documents:
+            doc_id = f"{doc_id}-{course['college']}"
+        while doc_id in documents:
+            doc_id = f"{doc_id}-{len(documents)}"
+        metadata = {
+            "course_id": course["course_id"],
+            "course_name": course["course"],
+            "department": course["department"],
+            "pre_reqs": course["pre_reqs"],
+        }
+        if course["aliases"]:
+            metadata["aliases"] = ", ".join(course["aliases"])
+        metadata[HASH_FIELD] = content_hash(course["description"], metadata)
+        documents[doc_id] = {"content": course["description"], "metadata": metadata}
+    return documents
+
+
+def plan_sync(local, remote_hashes, delete=True):
+    """
+    Compares local documents with the serving store's {doc_id: content hash}.
+    Returns (upsert_ids, delete_ids): documents that are new or whose hash
+    differs, and serving documents that no longer exist locally.
+    """
+    upserts = [doc_id for doc_id, doc in local.items()
+               if remote_hashes.get(doc_id) != doc["metadata"][HASH_FIELD]]
+    deletes = [doc_id for doc_id in remote_hashes if doc_id not in local] if delete else []
+    return upserts, deletes
+
+
+class LocalSyncStore:
+    """
+    In-memory stand-in for the serving collection, optionally persisted to a
+    JSON file between runs. Each call waits latency_ms and fails with
+    probability failure_rate, to exercise batching and retries.
+    """
+
+    def __init__(self, path=None, latency_ms=0.0, failure_rate=0.0, seed=None):
+        self.path = path
+        self.latency_ms = latency_ms
+        self.failure_rate = failure_rate
+        self._random = random.Random(seed)
+        self.documents = {}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.documents = json.load(f)
+
+    async def _call(self):
+        if self.latency_ms:
+            await asyncio.sleep(self.latency_ms / 1000 * (0.5 + self._random.random()))
+        if self._random.random() < self.failure_rate:
+            raise ConnectionError("Simulated store failure")
+
+    async def content_hashes(self):
+        await self._call()
+        return {doc_id: doc["metadata"].get(HASH_FIELD) for doc_id, doc in self.documents.items()}
+
+    async def upsert(self, ids, documents):
+        await self._call()
+        for doc_id, doc in zip(ids, documents):
+            self.documents[doc_id] = doc
+
+    async def delete(self, ids):
+        await self._call()
+        for doc_id in ids:
+            self.documents.pop(doc_id, None)
+
+    def close(self):
+        if self.path:
+            with open(self.path, "w") as f:
+                json.dump(self.documents, f)
+
+
+class AstraSyncStore:
+    """
+    The Astra `courses` collection the rag function serves from. Upserts go
+    through the LangChain store (which embeds the content with OpenAI, as
+    main.py does for queries); hashes are read with a projection so listing
+    the collection does not transfer vectors.
+    """
+
+    def __init__(self, collection_name="courses"):
+        from dotenv import load_dotenv
+        from langchain_astradb import AstraDBVectorStore
+        from langchain_openai import OpenAIEmbeddings
+        load_dotenv()
+        self.vector_store = AstraDBVectorStore(
+            collection_name=collection_name,
+            embedding=OpenAIEmbeddings(model="text-embedding-3-small", api_key=os.getenv("OPEN_AI_API_KEY")),
+            api_endpoint=os.getenv("ASTRA_DB_API_ENDPOINT"),
+            token=os.getenv("ASTRA_DB_APPLICATION_TOKEN"),
+        )
+        from astrapy import DataAPIClient
+        database = DataAPIClient(os.getenv("ASTRA_DB_APPLICATION_TOKEN")).get_database(
+            os.getenv("ASTRA_DB_API_ENDPOINT"))
+        self.collection = database.get_collection(collection_name)
+
+    async def content_hashes(self):
+        def scan():
+            cursor = self.collection.find({}, projection={f"metadata.{HASH_FIELD}": True})
+            return {doc["_id"]: doc.get("metadata", {}).get(HASH_FIELD) for doc in cursor}
+        return await asyncio.to_thread(scan)
+
+    async def upsert(self, ids, documents):
+        from langchain_core.documents import Document
+        await self.vector_store.aadd_documents(
+            [Document(page_content=doc["content"], metadata=doc["metadata"]) for doc in documents], ids=ids,
+        )
+
+    async def delete(self, ids):
+        await self.vector_store.adelete(ids)
+
+    def close(self):
+        pass
+
+
+class SyncStats:
+    def __init__(self):
+        self.upserted = 0
+        self.deleted = 0
+        self.batches = 0
+        self.retries = 0
+        self.failed = []
+
+    def report(self, elapsed):
+        written = self.upserted + self.deleted
+        return {
+            "upserted": self.upserted,
+            "deleted": self.deleted,
+            "batches": self.batches,
+            "retries": self.retries,
+            "failed_batches": len(self.failed),
+            "failed_ids": [doc_id for batch in self.failed for doc_id in batch],
+            "elapsed_s": round(elapsed, 3),
+            "docs_per_s": round(written / elapsed, 1) if elapsed > 0 else 0.0,
+        }
+
+
+async def with_retries(call, stats, retries, backoff_s):
+    """
+    Awaits call(), retrying failures with exponential backoff and jitter.
+    """
+    for attempt in range(retries + 1):
+        try:
+            return await call()
+        except Exception as e:
+            if attempt == retries:
+                raise
+            stats.retries += 1
+            delay = backoff_s * 2 ** attempt * (0.5 + random.random())
+            logging.warning(f"Store call failed ({e}); retrying in {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+
+async def sync(store, local, batch_size=100, concurrency=8, retries=4, backoff_s=0.5, delete=True, dry_run=False):
+    """
+    Brings the serving store in line with the local documents: diffs by
+    content hash, then runs the upserts and deletes in batches of batch_size
+    with up to `concurrency` batches in flight. Batches that still fail after
+    the retries are reported, not raised, so one bad batch does not stop the rest.
+    """
+    stats = SyncStats()
+    start = time.perf_counter()
+    remote = await with_retries(store.content_hashes, stats, retries, backoff_s)
+    upserts, deletes = plan_sync(local, remote, delete=delete)
+    logging.info(f"Serving store has {len(remote)} documents; {len(upserts)} to upsert, {len(deletes)} to delete, "
+                 f"{len(local) - len(upserts)} unchanged")
+    if dry_run:
+        return dict(stats.report(time.perf_counter() - start), planned_upserts=len(upserts),
+                    planned_deletes=len(deletes))
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run_batch(kind, ids):
+        async with semaphore:
+            if kind == "upsert":
+                call = functools.partial(store.upsert, ids, [local[doc_id] for doc_id in ids])
+            else:
+                call = functools.partial(store.delete, ids)
+            try:
+                await with_retries(call, stats, retries, backoff_s)
+            except Exception as e:
+                logging.error(f"{kind} batch of {len(ids)} failed after {retries} retries: {e}")
+                stats.failed.append(ids)
+                return
+            stats.batches += 1
+            if kind == "upsert":
+                stats.upserted += len(ids)
+            else:
+                stats.deleted += len(ids)
+
+    batches = [("upsert", upserts[i:i + batch_size]) for i in range(0, len(upserts), batch_size)]
+    batches += [("delete", deletes[i:i + batch_size]) for i in range(0, len(deletes), batch_size)]
+    await asyncio.gather(*(run_batch(kind, ids) for kind, ids in batches))
+    return stats.report(time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sync the course catalog into the serving vector store")
+    parser.add_argument("--catalog", default=DEFAULT_CATALOG_PATH, help="Catalog CSV the function ships with")
+    parser.add_argument("--store", choices=["astra", "local"], default="astra")
+    parser.add_argument("--collection", default="courses", help="Astra collection name")
+    parser.add_argument("--local-state", default=None, help="JSON file the local store persists to")
+    parser.add_argument("--local-latency-ms", type=float, default=0.0, help="Simulated latency per local store call")
+    parser.add_argument("--local-failure-rate", type=float, default=0.0, help="Simulated local store failure rate")
+    parser.add_argument("--batch-size", type=int, default=100, help="Documents per upsert/delete call")
+    parser.add_argument("--concurrency", type=int, default=8, help="Batches in flight at once")
+    parser.add_argument("--retries", type=int, default=4, help="Retries per batch")
+    parser.add_argument("--backoff", type=float, default=0.5, help="Initial retry backoff in seconds")
+    parser.add_argument("--no-delete", action="store_true", help="Keep serving documents missing from the catalog")
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would change")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    local = catalog_documents(args.catalog)
+    if args.store == "local":
+        store = LocalSyncStore(args.local_state, args.local_latency_ms, args.local_failure_rate, args.seed)
+    else:
+        store = AstraSyncStore(args.collection)
+    report = asyncio.run(sync(store, local, batch_size=args.batch_size, concurrency=args.concurrency,
+                              retries=args.retries, backoff_s=args.backoff, delete=not args.no_delete,
+                              dry_run=args.dry_run))
+    store.close()
+    logging.info(f"Sync finished: {json.dumps({k: v for k, v in report.items() if k != 'failed_ids'})}")
+    if report["failed_ids"]:
+        logging.error(f"Failed document IDs: {report['failed_ids']}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,226 @@
+import argparse
+import asyncio
+import collections
+import json
+import logging
+import re
+import sys
+import time
+
+import numpy as np
+
+import _functions_path  # noqa: F401
+from carryover import ANAPHORA_PATTERN
+from query_embeddings import normalize_query
+from query_planner import detect_course_codes
+from response_cache import FirestoreResponseBackend, LocalResponseBackend
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+# The line rag logs for every request (main.handle_rag_request).
+QUERY_LOG_PATTERN = re.compile(r'Received query: (.+)$')
+
+
+def queries_from_logs(paths):
+    """
+    Yields (timestamp, query) from request logs: Cloud Logging JSON exports
+    (one entry per line, textPayload or jsonPayload.message) or plain text.
+    Timestamps are None for plain text lines.
+    """
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                timestamp, text = None, line.rstrip("\n")
+                if line.startswith("{"):
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    timestamp = entry.get("timestamp")
+                    text = entry.get("textPayload") or entry.get("jsonPayload", {}).get("message", "")
+                match = QUERY_LOG_PATTERN.search(text)
+                if match:
+                    yield timestamp, match.group(1).strip()
+
+
+def queries_from_histories(db):
+    """
+    Yields (timestamp, query) for every user message in chat_histories.
+    """
+    for doc in db.collection("chat_histories").stream():
+        for message in (doc.to_dict() or {}).get("messages", []):
+            if message.get("role") == "user" and message.get("message"):
+                timestamp = message.get("timestamp")
+                yield (timestamp.isoformat() if hasattr(timestamp, "isoformat") else timestamp), message["message"]
+
+
+def standalone_traffic(records):
+    """
+    Normalized standalone queries in time order. Follow-ups that refer back
+    to the conversation can never be served from the cache and are dropped.
+    """
+    records = [(timestamp or "", query) for timestamp, query in records if not ANAPHORA_PATTERN.search(query)]
+    records.sort(key=lambda record: record[0])
+    return [normalize_query(query) for _, query in records if normalize_query(query)]
+
+
+def cluster_queries(counts, vectors, catalog, threshold):
+    """
+    Greedy single-pass clustering: queries in descending frequency either
+    join the most similar existing cluster (cosine >= threshold) or start
+    one. Queries only share a cluster when they name the same courses, so
+    "prereqs for CSEN 174" and "prereqs for CSEN 177" never merge.
+    Returns clusters as {"leader", "members", "count"}, largest first.
+    """
+    keys = list(counts)
+    unit = np.asarray(vectors, dtype=np.float32)
+    unit /= np.maximum(np.linalg.norm(unit, axis=1, keepdims=True), 1e-12)
+    clusters = []
+    leaders = {}  # course-code signature -> (cluster indices, leader vectors)
+    for row in sorted(range(len(keys)), key=lambda i: -counts[keys[i]]):
+        key = keys[row]
+        signature = tuple(detect_course_codes(key, catalog))
+        indices, leader_rows = leaders.setdefault(signature, ([], []))
+        best = -1
+        if leader_rows:
+            similarities = unit[leader_rows] @ unit[row]
+            best = int(np.argmax(similarities))
+            if similarities[best] < threshold:
+                best = -1
+        if best >= 0:
+            cluster = clusters[indices[best]]
+            cluster["members"].append(key)
+            cluster["count"] += counts[key]
+        else:
+            indices.append(len(clusters))
+            leader_rows.append(row)
+            clusters.append({"leader": key, "members": [key], "count": counts[key]})
+    return sorted(clusters, key=lambda cluster: -cluster["count"])
+
+
+async def precompute(main, clusters, concurrency):
+    """
+    Answers each cluster's leader with at most `concurrency` requests in
+    flight. Returns {leader: entry} and the leaders that failed.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    answers, failed = {}, []
+
+    async def answer(cluster):
+        async with semaphore:
+            try:
+                answers[cluster["leader"]] = await main.precompute_answer(cluster["leader"])
+            except Exception as e:
+                logging.error(f"Precomputing '{cluster['leader']}' failed: {e}")
+                failed.append(cluster["leader"])
+
+    await asyncio.gather(*(answer(cluster) for cluster in clusters))
+    return answers, failed
+
+
+def coverage(traffic, cached_keys):
+    hits = sum(1 for key in traffic if key in cached_keys)
+    return round(hits / len(traffic), 3) if traffic else 0.0
+
+
+def warm(main, backend, traffic, top, threshold, concurrency, holdout, dry_run=False):
+    """
+    Mines the traffic (normalized queries, oldest first), clusters it, and
+    stores answers for the top clusters under every query variant seen in
+    each. The newest `holdout` fraction of traffic is left out of mining and
+    used to estimate coverage of traffic the cache has not seen.
+    """
+    start = time.perf_counter()
+    split = len(traffic) - int(len(traffic) * holdout)
+    mined, held_out = traffic[:split], traffic[split:]
+    counts = collections.Counter(mined)
+    keys = list(counts)
+    snapshot = main.current_snapshot()
+    logging.info(f"Mined {len(mined)} standalone queries ({len(keys)} distinct); snapshot {snapshot.version}")
+
+    vectors = main.run_sync(main.embed_queries(keys)) if keys else []
+    clusters = cluster_queries(counts, vectors, snapshot.catalog, threshold) if keys else []
+    selected = clusters[:top]
+    answers, failed = {}, []
+    if not dry_run and selected:
+        answers, failed = main.run_sync(precompute(main, selected, concurrency))
+
+    entries = {}
+    for cluster in selected:
+        answer = answers.get(cluster["leader"])
+        if answer is not None or dry_run:
+            for key in cluster["members"]:
+                entries[key] = dict(answer or {}, leader=cluster["leader"], cluster_count=cluster["count"])
+    if not dry_run and entries:
+        backend.put_many(snapshot.version, entries)
+
+    return {
+        "snapshot_version": snapshot.version,
+        "mined_queries": len(mined),
+        "distinct_queries": len(keys),
+        "clusters": len(clusters),
+        "cached_clusters": len(selected) - len(failed),
+        "cached_variants": len(entries),
+        "failed": failed,
+        "coverage_mined": coverage(mined, entries),
+        "coverage_holdout": coverage(held_out, entries),
+        "holdout_queries": len(held_out),
+        "elapsed_s": round(time.perf_counter() - start, 2),
+        "top_clusters": [{"leader": c["leader"], "count": c["count"], "variants": len(c["members"])}
+                         for c in selected[:10]],
+    }
+
+
+def print_report(report):
+    print(f"Snapshot {report['snapshot_version']}: {report['mined_queries']} standalone queries, "
+          f"{report['distinct_queries']} distinct, {report['clusters']} clusters")
+    print(f"Cached {report['cached_clusters']} clusters as {report['cached_variants']} query variants "
+          f"in {report['elapsed_s']:.1f} s ({len(report['failed'])} failed)")
+    print(f"Coverage of mined traffic: {report['coverage_mined']:.1%}; "
+          f"of newer held-out traffic ({report['holdout_queries']} queries): {report['coverage_holdout']:.1%}")
+    for cluster in report["top_clusters"]:
+        print(f"  {cluster['count']:>6}  {cluster['variants']:>3} variants  {cluster['leader']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Precompute answers for the most frequent questions and load them into the response cache")
+    parser.add_argument("--logs", nargs="*", default=[], help="rag request log exports (JSON lines or text)")
+    parser.add_argument("--chat-histories", action="store_true", help="Also mine user messages in chat_histories")
+    parser.add_argument("--top", type=int, default=300, help="Clusters to precompute")
+    parser.add_argument("--similarity", type=float, default=0.92, help="Cosine similarity to join a cluster")
+    parser.add_argument("--concurrency", type=int, default=4, help="Answers computed at once")
+    parser.add_argument("--holdout", type=float, default=0.2,
+                        help="Newest fraction of traffic kept out of mining to measure coverage")
+    parser.add_argument("--dry-run", action="store_true", help="Cluster and report coverage without answering")
+    parser.add_argument("--offline", action="store_true",
+                        help="Run against the load-test fakes and an in-memory cache")
+    parser.add_argument("--json", default=None, help="Also write the report to this JSON file")
+    args = parser.parse_args()
+
+    if args.offline:
+        from loadtest.fakes import load_main
+        main_module = load_main()
+        backend = LocalResponseBackend()
+    else:
+        import main as main_module
+        backend = FirestoreResponseBackend(main_module.db)
+
+    records = list(queries_from_logs(args.logs))
+    if args.chat_histories:
+        records += list(queries_from_histories(main_module.db))
+    if not records:
+        parser.error("no queries found; pass --logs and/or --chat-histories")
+
+    report = warm(main_module, backend, standalone_traffic(records), args.top, args.similarity,
+                  args.concurrency, args.holdout, args.dry_run)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    if report["failed"]:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,29 @@
+import asyncio
+import threading
+
+_loop = None
+_lock = threading.Lock()
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    """
+    Returns the instance-wide event loop, starting it on a daemon thread the
+    first time. Async clients (Firestore, gRPC) are bound to the loop they
+    first run on, so every request must use this one loop rather than
+    asyncio.run, which would create a fresh loop per call.
+    """
+    global _loop
+    with _lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="rag-event-loop", daemon=True).start()
+            _loop = loop
+    return _loop
+
+
+def run_sync(coro, timeout: float = None):
+    """
+    Runs a coroutine on the shared loop and blocks the calling thread until it
+    finishes. Used by sync entry points (the callable, job workers).
+    """
+    return asyncio.run_coroutine_threadsafe(coro, get_loop()).result(timeout)
@@ -0,0 +1,145 @@
+import re
+
+from query_planner import detect_course_codes
+
+# Follow-ups are short; longer questions usually bring their own topic.
+FOLLOWUP_MAX_WORDS = 15
+# Courses added to the carried context when a follow-up asks for "another one".
+EXTEND_NEIGHBORS = 4
+CONTEXT_LIMIT = 10
+
+# Words that point back at courses already under discussion.
+ANAPHORA_PATTERN = re.compile(
+    r"\b(it|its|it's|that one|this one|that class|this class|that course|this course|those|these|them|they|"
+    r"their|either|both|which ones?|the (first|second|third|last|other|former|latter)( one| course| class)?|"
+    r"(the )?same|what about|how about|and (the|its)|(a|an|the|another) (\w+ ){0,2}one|"
+    r"something (easier|harder|similar|else|like (it|that)))\b|\b(that|this)\W*$",
+    re.IGNORECASE,
+)
+# Follow-ups asking for courses near the ones discussed rather than about them.
+EXTEND_PATTERN = re.compile(
+    r'\b(another|more advanced|advanced|easier|harder|alternatives?|instead|similar|else|other options?|'
+    r'next (one|course|class)|follow[- ]?up|after (it|that|those))\b',
+    re.IGNORECASE,
+)
+WORD_PATTERN = re.compile(r"[a-z][a-z']+")
+# Words a follow-up may use without changing the topic: function words and
+# the catalog facts people ask about.
+FOLLOWUP_WORDS = frozenset("""
+a an the and or but of for to in on at by with from about as is are was were be been do does did can could
+would should will shall may might must has have had i me my we you your it its it's this that these those
+them they their one ones what which who whom when where why how there any some more most less than then so
+something anything if not no yes also too very really just tell explain describe mention mentioned said say again please
+thanks ok okay course courses class classes option options first second third last other former latter same
+either both prereq prereqs prerequisite prerequisites requirement requirements require required need needed
+offered offer spring fall winter summer quarter quarters term year taught teach teaches professor instructor
+units unit credit credits hard harder easy easier difficult difficulty workload lab labs level upper lower
+division graduate undergraduate advanced another else instead similar alternative alternatives compare
+compared comparison difference different better worse take taking took before after next follow
+""".split())
+
+
+def _words(text: str) -> set:
+    return {word.rstrip("s") if len(word) > 3 else word for word in WORD_PATTERN.findall(text.lower())}
+
+
+_FOLLOWUP_STEMS = frozenset(_words(" ".join(FOLLOWUP_WORDS)))
+
+
+class CarryOver:
+    """
+    A follow-up answered from the previous turn's context. mode is "reuse"
+    (same courses) or "extend" (those plus named or neighboring courses).
+    """
+
+    def __init__(self, mode: str, context: list, course_ids=()):
+        self.mode = mode
+        self.context = context
+        self.course_ids = list(course_ids)
+
+    def __repr__(self):
+        return f"CarryOver({self.mode!r}, {len(self.context)} carried, extra={self.course_ids})"
+
+
+def context_entries(relevant_docs, limit: int = CONTEXT_LIMIT) -> list:
+    """
+    The retrieved course IDs and scores stored with a bot turn, best first.
+    """
+    entries = []
+    seen = set()
+    for score, doc_item in relevant_docs:
+        course_id = f"{doc_item['tag']} {doc_item['number']}"
+        if course_id not in seen:
+            seen.add(course_id)
+            entries.append({"id": course_id, "score": round(float(score), 4)})
+    return entries[:limit]
+
+
+def previous_context(messages) -> list:
+    """
+    The context stored with the most recent bot turn, or [] if it has none.
+    messages ends with the current query.
+    """
+    for message in reversed(messages[:-1]):
+        if message.get("role") == "bot":
+            return message.get("context") or []
+    return []
+
+
+def classify_followup(query: str, messages, catalog) -> CarryOver:
+    """
+    Decides with local rules whether a query is a follow-up about the
+    courses of the previous turn. It must be short, refer back ("it",
+    "those", "the first one"), and bring no topic words that neither the
+    carried courses nor the previous exchange mention. Returns None when a
+    fresh retrieval is needed.
+    """
+    context = previous_context(messages)
+    if not context or catalog is None or len(query.split()) > FOLLOWUP_MAX_WORDS:
+        return None
+    if not ANAPHORA_PATTERN.search(query):
+        return None
+
+    carried_ids = {entry["id"] for entry in context}
+    new_codes = [code for code in detect_course_codes(query, catalog) if code not in carried_ids]
+    known = set(_FOLLOWUP_STEMS)
+    for message in messages[-3:-1]:
+        known |= _words(message.get("message", ""))
+    for entry in context:
+        for course in catalog.lookup(entry["id"])[:1]:
+            known |= _words(f"{course['course']} {course['department']} {course['description']}")
+    for code in new_codes:
+        known |= _words(code)
+    if _words(query) - known:
+        return None
+
+    if new_codes:
+        return CarryOver("extend", context, new_codes)
+    if EXTEND_PATTERN.search(query):
+        return CarryOver("extend", context)
+    return CarryOver("reuse", context)
+
+
+def carried_documents(carry: CarryOver, catalog, neighbors=None, top_k: int = CONTEXT_LIMIT) -> list:
+    """
+    Rebuilds (score, doc_item) pairs from the carried IDs. Courses named in
+    the follow-up go first; an "extend" without named courses adds the
+    nearest neighbors of the top carried courses from the precomputed graph.
+    Courses no longer in the catalog are dropped.
+    """
+    scored = [(1.0, course_id) for course_id in carry.course_ids]
+    scored += [(entry["score"], entry["id"]) for entry in carry.context]
+    if carry.mode == "extend" and not carry.course_ids and neighbors is not None:
+        carried = {entry["id"] for entry in carry.context}
+        extra = []
+        for entry in carry.context[:2]:
+            for neighbor_id, score in neighbors.similar(entry["id"], EXTEND_NEIGHBORS):
+                if neighbor_id not in carried:
+                    carried.add(neighbor_id)
+                    extra.append((score * entry["score"], neighbor_id))
+        # Neighbors go ahead of the tail of the old context so they survive top_k.
+        scored = scored[:2] + extra[:EXTEND_NEIGHBORS] + scored[2:]
+    docs = []
+    for score, course_id in scored:
+        docs.extend((score, catalog.doc_item(course)) for course in catalog.lookup(course_id)[:1])
+    return docs[:top_k]
@@ -0,0 +1,182 @@
+import csv
+import functools
+import logging
+import os
+import re
+
+FUNCTIONS_DIR = os.path.dirname(os.path.abspath(__file__))
+# The consolidated catalog lives in data-collection; the firebase.json predeploy
+# step copies it into data/courses.csv, which is all a deployed function has.
+SOURCE_CATALOG_PATH = os.path.join(FUNCTIONS_DIR, "..", "data-collection", "data", "catalog.csv")
+BUNDLED_CATALOG_PATH = os.path.join(FUNCTIONS_DIR, "data", "courses.csv")
+DEFAULT_CATALOG_PATH = SOURCE_CATALOG_PATH if os.path.exists(SOURCE_CATALOG_PATH) else BUNDLED_CATALOG_PATH
+
+LEVEL_BUCKET = 10  # Course numbers are bucketed by tens for level-range bitmaps
+# Separates the alias codes and colleges of a consolidated (cross-listed) course.
+MULTI_VALUE_SEPARATOR = ";"
+
+
+def course_level(number: str) -> int:
+    """
+    Returns the numeric part of a course number, e.g. 174 for "174L". -1 if there is none.
+    """
+    match = re.match(r'^(\d+)', number or "")
+    return int(match.group(1)) if match else -1
+
+
+def normalize_department(department: str) -> str:
+    return " ".join((department or "").split())
+
+
+class Catalog:
+    """
+    In-memory course catalog with precomputed facet bitmaps.
+
+    Every course gets a position in `courses`; each facet value (tag, college,
+    level bucket) maps to a Python int used as a bitmap over those positions, so
+    combining filters is a handful of integer AND/OR operations.
+    """
+
+    def __init__(self, rows):
+        self.courses = []
+        self.index_by_id = {}
+        self.facets = {"tag": {}, "college": {}, "level": {}}
+        self.department_tags = {}
+        aliases = []
+
+        for row in rows:
+            tag = (row.get("tag") or "").strip()
+            number = (row.get("number") or "").strip()
+            if not tag or not number:
+                continue
+            course = {
+                "college": (row.get("college") or "").strip(),
+                "department": normalize_department(row.get("department")),
+                "number": number,
+                "course": (row.get("course") or "").strip(),
+                "description": (row.get("description") or "").strip(),
+                "tag": tag,
+                "pre_reqs": (row.get("pre_reqs") or "").strip(),
+                "course_id": f"{tag} {number}",
+                "level": course_level(number),
+                "aliases": [code.strip() for code in (row.get("aliases") or "").split(MULTI_VALUE_SEPARATOR)
+                            if code.strip()],
+            }
+            position = len(self.courses)
+            self.courses.append(course)
+            self.index_by_id.setdefault(course["course_id"], []).append(position)
+
+            bit = 1 << position
+            for code in [course["course_id"]] + course["aliases"]:
+                alias_tag, _, alias_number = code.partition(" ")
+                self._add_bit("tag", alias_tag, bit)
+                if course_level(alias_number) >= 0:
+                    self._add_bit("level", course_level(alias_number) // LEVEL_BUCKET, bit)
+            for college in course["college"].split(MULTI_VALUE_SEPARATOR):
+                self._add_bit("college", college, bit)
+            self.department_tags.setdefault(course["department"].lower(), tag)
+            aliases.extend((code, position) for code in course["aliases"])
+
+        # Alias codes of consolidated courses resolve to their canonical entry,
+        # unless the catalog also lists the code on its own.
+        listed = set(self.index_by_id)
+        for code, position in aliases:
+            if code not in listed:
+                self.index_by_id.setdefault(code, []).append(position)
+
+        self.all_bits = (1 << len(self.courses)) - 1
+        self.tags = frozenset(self.facets["tag"])
+        self.colleges = frozenset(self.facets["college"])
+
+    @classmethod
+    def from_csv(cls, path: str):
+        with open(path, newline='', encoding='utf-8') as csvfile:
+            return cls(csv.DictReader(csvfile))
+
+    def _add_bit(self, facet: str, value, bit: int):
+        self.facets[facet][value] = self.facets[facet].get(value, 0) | bit
+
+    def __len__(self):
+        return len(self.courses)
+
+    def lookup(self, course_id: str) -> list:
+        """
+        Returns every catalog entry for a course ID such as "CSEN 174"
+        (cross-listed courses can appear once per college). Alias codes of a
+        consolidated course return its canonical entry.
+        """
+        return [self.courses[i] for i in self.index_by_id.get(course_id, [])]
+
+    def select(self, tags=None, colleges=None, level_range=None) -> int:
+        """
+        Returns the bitmap of courses matching every given facet. Each facet
+        accepts several values, which are OR-ed together.
+        """
+        bits = self.all_bits
+        if tags:
+            bits &= self._union("tag", tags)
+        if colleges:
+            bits &= self._union("college", colleges)
+        if level_range:
+            low, high = level_range
+            low_bucket, high_bucket = low // LEVEL_BUCKET, high // LEVEL_BUCKET
+            level_bits = self._union("level", range(low_bucket + 1, high_bucket))
+            # Buckets are coarse; only the two edge buckets need a per-course check.
+            for bucket in {low_bucket, high_bucket}:
+                for position in self.positions(self.facets["level"].get(bucket, 0)):
+                    if low <= self.courses[position]["level"] <= high:
+                        level_bits |= 1 << position
+            bits &= level_bits
+        return bits
+
+    def _union(self, facet: str, values) -> int:
+        bits = 0
+        for value in values:
+            bits |= self.facets[facet].get(value, 0)
+        return bits
+
+    def positions(self, bits: int):
+        while bits:
+            lowest = bits & -bits
+            yield lowest.bit_length() - 1
+            bits ^= lowest
+
+    def course_ids(self, bits: int) -> list:
+        """
+        Returns the distinct course IDs in a bitmap, in catalog order.
+        """
+        return list(dict.fromkeys(self.courses[p]["course_id"] for p in self.positions(bits)))
+
+    @staticmethod
+    def doc_item(course: dict) -> dict:
+        """
+        Formats a catalog entry like the documents returned by retrieve_relevant_documents.
+        """
+        return {
+            'course': course["course"],
+            'number': course["number"],
+            'department': course["department"],
+            'description': course["description"],
+            'tag': course["tag"],
+            'pre_reqs': course["pre_reqs"],
+            'aliases': ", ".join(course.get("aliases", [])),
+        }
+
+    def matches(self, bits: int, course_id: str) -> bool:
+        return any(bits >> position & 1 for position in self.index_by_id.get(course_id, []))
+
+
+@functools.lru_cache(maxsize=1)
+def get_catalog():
+    """
+    Loads the catalog once per warm instance. Returns None if the catalog file
+    is missing, in which case retrieval runs without metadata filtering.
+    """
+    path = os.getenv("COURSE_CATALOG_PATH", DEFAULT_CATALOG_PATH)
+    try:
+        catalog = Catalog.from_csv(path)
+        logging.info("Loaded %d catalog courses from %s.", len(catalog), path)
+        return catalog
+    except OSError as e:
+        logging.warning("Course catalog unavailable (%s); metadata filters disabled.", str(e))
+        return None
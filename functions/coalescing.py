@@ -0,0 +1,365 @@
+import asyncio
+import collections
+import datetime
+import hashlib
+import logging
+import threading
+import uuid
+
+from firebase_admin import firestore
+
+from query_embeddings import normalize_query
+from tracing import incr
+
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class TooManyRequests(Exception):
+    pass
+
+
+def coalescing_key(user_id: str, query: str, history_version: int) -> str:
+    """
+    Identifies identical requests: same user, same normalized query, and the
+    same chat history version (completed turns) when the request started.
+    """
+    raw = f"{user_id}\n{normalize_query(query)}\n{history_version}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:40]
+
+
+def _utcnow():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+class LocalFlightBackend:
+    """
+    In-memory stand-in for a shared in-flight request store. Several
+    coalescers (e.g. simulated instances in a load test) can share one.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+
+    async def claim(self, key: str, lease_seconds: float) -> bool:
+        now = _utcnow()
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight and flight["status"] != FAILED and flight["expires"] > now:
+                return False
+            self._flights[key] = {"status": RUNNING, "expires": now + datetime.timedelta(seconds=lease_seconds)}
+            return True
+
+    async def publish(self, key: str, result: dict, ttl_seconds: float):
+        with self._lock:
+            self._flights[key] = {
+                "status": DONE, "result": result, "expires": _utcnow() + datetime.timedelta(seconds=ttl_seconds),
+            }
+
+    async def fail(self, key: str):
+        with self._lock:
+            self._flights[key] = {"status": FAILED, "expires": _utcnow()}
+
+    async def get(self, key: str):
+        with self._lock:
+            flight = self._flights.get(key)
+            return dict(flight) if flight else None
+
+
+class FirestoreFlightBackend:
+    """
+    Shared in-flight request store in the `inflight_requests` collection, so
+    a retry that lands on another instance waits for the first one's answer.
+    """
+
+    def __init__(self, db, collection: str = "inflight_requests"):
+        self.db = db
+        self.collection = collection
+
+    def _ref(self, key: str):
+        return self.db.collection(self.collection).document(key)
+
+    async def claim(self, key: str, lease_seconds: float) -> bool:
+        doc_ref = self._ref(key)
+
+        @firestore.async_transactional
+        async def claim_in_transaction(transaction):
+            now = _utcnow()
+            snapshot = await doc_ref.get(transaction=transaction)
+            if snapshot.exists:
+                flight = snapshot.to_dict()
+                if flight.get("status") != FAILED and flight.get("expires") and flight["expires"] > now:
+                    return False
+            transaction.set(doc_ref, {"status": RUNNING, "expires": now + datetime.timedelta(seconds=lease_seconds)})
+            return True
+
+        return await claim_in_transaction(self.db.transaction())
+
+    async def publish(self, key: str, result: dict, ttl_seconds: float):
+        await self._ref(key).set({
+            "status": DONE, "result": result, "expires": _utcnow() + datetime.timedelta(seconds=ttl_seconds),
+        })
+
+    async def fail(self, key: str):
+        await self._ref(key).set({"status": FAILED, "expires": _utcnow()})
+
+    async def get(self, key: str):
+        snapshot = await self._ref(key).get()
+        return snapshot.to_dict() if snapshot.exists else None
+
+
+class RequestCoalescer:
+    """
+    Single-flight execution: while a request with a given key is running,
+    identical requests wait for and share its result instead of running the
+    pipeline again. In-process duplicates share an asyncio future; with a
+    backend, duplicates on other instances poll the shared store. If the
+    leader fails or its lease runs out, a waiting duplicate runs it itself.
+    """
+
+    def __init__(self, backend=None, lease_seconds: float = 60.0, result_ttl_seconds: float = 30.0,
+                 poll_interval: float = 0.1):
+        self.backend = backend
+        self.lease_seconds = lease_seconds
+        self.result_ttl_seconds = result_ttl_seconds
+        self.poll_interval = poll_interval
+        self._inflight = {}
+        self.coalesced = 0
+
+    async def run(self, key: str, fn):
+        """
+        Returns fn()'s result (fn is a coroutine function), sharing it with
+        every identical request that arrives while it runs.
+        """
+        shared = self._inflight.get(key)
+        if shared is not None:
+            self.coalesced += 1
+            incr("coalesced")
+            return await asyncio.shield(shared)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await self._run_shared(key, fn)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # Mark retrieved; the waiters re-raise it.
+            raise
+        finally:
+            del self._inflight[key]
+
+    async def _run_shared(self, key: str, fn):
+        if self.backend is None:
+            return await fn()
+        try:
+            claimed = await self.backend.claim(key, self.lease_seconds)
+        except Exception as e:
+            logging.warning("Coalescing claim failed for %s: %s", key, str(e))
+            return await fn()
+        if not claimed:
+            result = await self._wait_for_leader(key)
+            if result is not None:
+                self.coalesced += 1
+                incr("coalesced_remote")
+                return result
+            logging.info("Leader for request %s did not finish; running it here.", key)
+            return await fn()
+        try:
+            result = await fn()
+        except Exception:
+            await self.backend.fail(key)
+            raise
+        await self.backend.publish(key, result, self.result_ttl_seconds)
+        return result
+
+    async def _wait_for_leader(self, key: str):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            flight = await self.backend.get(key)
+            if flight is None or flight["status"] == FAILED:
+                return None
+            if flight["status"] == DONE:
+                return flight["result"]
+            if flight["expires"] <= _utcnow():
+                return None
+
+
+class LocalSlotBackend:
+    """
+    In-memory stand-in for shared per-user request slots.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._slots = collections.defaultdict(dict)
+
+    async def try_acquire(self, user_id: str, slot_id: str, limit: int, lease_seconds: float) -> bool:
+        now = _utcnow()
+        with self._lock:
+            slots = self._slots[user_id]
+            for stale in [slot for slot, expires in slots.items() if expires <= now]:
+                del slots[stale]
+            if len(slots) >= limit:
+                return False
+            slots[slot_id] = now + datetime.timedelta(seconds=lease_seconds)
+            return True
+
+    async def release(self, user_id: str, slot_id: str):
+        with self._lock:
+            self._slots[user_id].pop(slot_id, None)
+
+
+class FirestoreSlotBackend:
+    """
+    Per-user request slots shared by all instances, one document per user in
+    `request_slots` mapping slot IDs to lease expiry, so a crashed instance's
+    slots free themselves.
+    """
+
+    def __init__(self, db, collection: str = "request_slots"):
+        self.db = db
+        self.collection = collection
+
+    async def try_acquire(self, user_id: str, slot_id: str, limit: int, lease_seconds: float) -> bool:
+        doc_ref = self.db.collection(self.collection).document(user_id)
+
+        @firestore.async_transactional
+        async def acquire_in_transaction(transaction):
+            now = _utcnow()
+            snapshot = await doc_ref.get(transaction=transaction)
+            slots = (snapshot.to_dict() or {}).get("slots", {}) if snapshot.exists else {}
+            slots = {slot: expires for slot, expires in slots.items() if expires > now}
+            if len(slots) >= limit:
+                return False
+            slots[slot_id] = now + datetime.timedelta(seconds=lease_seconds)
+            transaction.set(doc_ref, {"slots": slots})
+            return True
+
+        return await acquire_in_transaction(self.db.transaction())
+
+    async def release(self, user_id: str, slot_id: str):
+        doc_ref = self.db.collection(self.collection).document(user_id)
+
+        @firestore.async_transactional
+        async def release_in_transaction(transaction):
+            snapshot = await doc_ref.get(transaction=transaction)
+            slots = (snapshot.to_dict() or {}).get("slots", {}) if snapshot.exists else {}
+            if slot_id in slots:
+                del slots[slot_id]
+                transaction.set(doc_ref, {"slots": slots})
+
+        await release_in_transaction(self.db.transaction())
+
+
+class _UserState:
+    __slots__ = ("active", "waiting", "changed")
+
+    def __init__(self):
+        self.active = 0
+        self.waiting = 0
+        self.changed = asyncio.Event()
+
+
+class UserConcurrencyLimiter:
+    """
+    Caps how many requests one user can have running at once (max_active)
+    and how many more may wait for a slot (max_waiting); beyond that,
+    requests are rejected with TooManyRequests. With a slot backend the cap
+    holds across instances, and waiting requests poll for a free slot.
+    """
+
+    def __init__(self, max_active: int = 2, max_waiting: int = 4, wait_timeout: float = 10.0, backend=None,
+                 lease_seconds: float = 60.0, poll_interval: float = 0.05):
+        self.max_active = max_active
+        self.max_waiting = max_waiting
+        self.wait_timeout = wait_timeout
+        self.backend = backend
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self._users = {}
+        self.rejected = 0
+
+    async def _try_acquire(self, user_id: str, state: _UserState, slot_id: str) -> bool:
+        if state.active >= self.max_active:
+            return False
+        # Reserve the local slot before awaiting the backend, so the state
+        # is neither over-admitted nor dropped as idle in the meantime.
+        state.active += 1
+        if self.backend is not None:
+            try:
+                if not await self.backend.try_acquire(user_id, slot_id, self.max_active, self.lease_seconds):
+                    state.active -= 1
+                    state.changed.set()
+                    return False
+            except Exception as e:
+                logging.warning("Request slot backend failed for %s: %s", user_id, str(e))
+        return True
+
+    def _forget_if_idle(self, user_id: str, state: _UserState):
+        if state.active == 0 and state.waiting == 0 and self._users.get(user_id) is state:
+            del self._users[user_id]
+
+    async def acquire(self, user_id: str) -> str:
+        """
+        Waits for a request slot for the user and returns its ID.
+        Raises TooManyRequests if the queue is full or the wait times out.
+        """
+        state = self._users.setdefault(user_id, _UserState())
+        slot_id = uuid.uuid4().hex
+        if await self._try_acquire(user_id, state, slot_id):
+            return slot_id
+        if state.waiting >= self.max_waiting:
+            self._forget_if_idle(user_id, state)
+            self._reject(user_id, state)
+        state.waiting += 1
+        deadline = asyncio.get_running_loop().time() + self.wait_timeout
+        try:
+            while True:
+                remaining = deadline - asyncio.get_running_loop().time()
+                if remaining <= 0:
+                    self._reject(user_id, state)
+                state.changed.clear()
+                # Slots held on other instances free up without a local signal, so poll too.
+                timeout = min(remaining, self.poll_interval) if self.backend is not None else remaining
+                try:
+                    await asyncio.wait_for(state.changed.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                if await self._try_acquire(user_id, state, slot_id):
+                    return slot_id
+        finally:
+            state.waiting -= 1
+            self._forget_if_idle(user_id, state)
+
+    async def release(self, user_id: str, slot_id: str):
+        state = self._users.get(user_id)
+        if state is not None:
+            state.active -= 1
+            state.changed.set()
+            self._forget_if_idle(user_id, state)
+        if self.backend is not None:
+            try:
+                await self.backend.release(user_id, slot_id)
+            except Exception as e:
+                logging.warning("Releasing request slot failed for %s: %s", user_id, str(e))
+
+    def _reject(self, user_id: str, state: _UserState):
+        self.rejected += 1
+        incr("user_throttled")
+        logging.warning("User %s has %d requests running and %d waiting; rejecting.",
+                        user_id, state.active, state.waiting)
+        raise TooManyRequests(user_id)
+
+    async def run(self, user_id: str, fn):
+        """
+        Runs fn() (a coroutine function) in one of the user's request slots.
+        """
+        slot_id = await self.acquire(user_id)
+        try:
+            return await fn()
+        finally:
+            await self.release(user_id, slot_id)
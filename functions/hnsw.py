@@ -0,0 +1,222 @@
+import heapq
+import json
+import math
+import os
+
+import numpy as np
+
+from vector_index import normalize_rows
+
+
+class HNSWIndex:
+    """
+    Hierarchical Navigable Small World graph for approximate nearest-neighbor
+    search over L2-normalized vectors (distance is 1 - cosine similarity).
+
+    Pure Python + NumPy: the graph walk is Python, every distance evaluation
+    is one vectorized dot product over a node's neighbor list. A saved index
+    is a directory whose vectors and level-0 links are memory-mapped on load,
+    so warm instances only page in the parts of the graph queries touch.
+    """
+
+    def __init__(self, dim: int, M: int = 16, ef_construction: int = 100, ef_search: int = 64, seed: int = 0):
+        self.dim = dim
+        self.M = M
+        self.M0 = 2 * M
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self.level_mult = 1 / math.log(M)
+        self.rng = np.random.default_rng(seed)
+        self.vectors = np.empty((0, dim), dtype=np.float32)
+        self.ids = []
+        self.entry_point = None
+        self.max_level = -1
+        # Build-time links: _links[node][level] is a list of neighbor nodes.
+        self._links = []
+        # Frozen links after load(): level 0 is an (n, M0) array padded with -1,
+        # upper levels are {level: {node: array}}.
+        self._level0 = None
+        self._upper = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    # -- construction ---------------------------------------------------------
+
+    def add_items(self, vectors, ids):
+        """
+        Inserts vectors one by one. Only supported on an index that was built
+        in this process, not on one loaded from disk.
+        """
+        if self._level0 is not None:
+            raise ValueError("Cannot add items to an index loaded from disk; rebuild it instead")
+        vectors = normalize_rows(vectors).reshape(-1, self.dim)
+        start = len(self.ids)
+        self.vectors = np.concatenate([self.vectors, vectors])
+        self.ids.extend(ids)
+        for node in range(start, len(self.ids)):
+            self._insert(node)
+
+    def _random_level(self) -> int:
+        return int(-math.log(1.0 - self.rng.random()) * self.level_mult)
+
+    def _insert(self, node: int):
+        level = self._random_level()
+        self._links.append([[] for _ in range(level + 1)])
+        if self.entry_point is None:
+            self.entry_point, self.max_level = node, level
+            return
+
+        query = self.vectors[node]
+        entry = [self.entry_point]
+        for layer in range(self.max_level, level, -1):
+            entry = [self._search_layer(query, entry, 1, layer)[0][1]]
+        for layer in range(min(level, self.max_level), -1, -1):
+            found = self._search_layer(query, entry, self.ef_construction, layer)
+            max_links = self.M0 if layer == 0 else self.M
+            neighbors = self._select_neighbors(query, found, self.M)
+            self._links[node][layer] = neighbors
+            for neighbor in neighbors:
+                links = self._links[neighbor][layer]
+                links.append(node)
+                if len(links) > max_links:
+                    candidates = sorted(zip(self._distances(self.vectors[neighbor], links).tolist(), links))
+                    self._links[neighbor][layer] = self._select_neighbors(self.vectors[neighbor], candidates, max_links)
+            entry = [n for _, n in found]
+        if level > self.max_level:
+            self.entry_point, self.max_level = node, level
+
+    def _select_neighbors(self, query, candidates, count: int) -> list:
+        """
+        Neighbor selection heuristic from the HNSW paper: prefer candidates that
+        are closer to the query than to any neighbor already chosen, which keeps
+        links spread across clusters. Tops up with the closest rejects.
+        """
+        selected = []
+        rejected = []
+        for distance, candidate in candidates:
+            if len(selected) >= count:
+                break
+            if selected:
+                closest_selected = 1.0 - float(np.max(self.vectors[selected] @ self.vectors[candidate]))
+                if closest_selected < distance:
+                    rejected.append(candidate)
+                    continue
+            selected.append(candidate)
+        return selected + rejected[:count - len(selected)]
+
+    # -- search ---------------------------------------------------------------
+
+    def _neighbors(self, node: int, layer: int):
+        if self._level0 is None:
+            links = self._links[node]
+            return links[layer] if layer < len(links) else []
+        if layer == 0:
+            row = self._level0[node]
+            return row[row >= 0].tolist()
+        return self._upper.get(layer, {}).get(node, [])
+
+    def _distances(self, query, nodes) -> np.ndarray:
+        return 1.0 - self.vectors[nodes] @ query
+
+    def _search_layer(self, query, entry_points, ef: int, layer: int) -> list:
+        """
+        Best-first search within one layer. Returns up to ef (distance, node)
+        pairs sorted by distance.
+        """
+        visited = set(entry_points)
+        distances = self._distances(query, entry_points).tolist()
+        candidates = list(zip(distances, entry_points))
+        heapq.heapify(candidates)
+        results = [(-d, n) for d, n in candidates]
+        heapq.heapify(results)
+        while len(results) > ef:
+            heapq.heappop(results)
+
+        while candidates:
+            distance, node = heapq.heappop(candidates)
+            if distance > -results[0][0] and len(results) >= ef:
+                break
+            fresh = [n for n in self._neighbors(node, layer) if n not in visited]
+            if not fresh:
+                continue
+            visited.update(fresh)
+            for neighbor_distance, neighbor in zip(self._distances(query, fresh).tolist(), fresh):
+                if len(results) < ef or neighbor_distance < -results[0][0]:
+                    heapq.heappush(candidates, (neighbor_distance, neighbor))
+                    heapq.heappush(results, (-neighbor_distance, neighbor))
+                    if len(results) > ef:
+                        heapq.heappop(results)
+        return sorted((-d, n) for d, n in results)
+
+    def search(self, query_vector, k: int = 10, ef: int = None) -> list:
+        """
+        Returns up to k (row, similarity) pairs, best first.
+        """
+        if self.entry_point is None:
+            return []
+        query = normalize_rows(query_vector)
+        entry = [self.entry_point]
+        for layer in range(self.max_level, 0, -1):
+            entry = [self._search_layer(query, entry, 1, layer)[0][1]]
+        found = self._search_layer(query, entry, max(ef or self.ef_search, k), 0)
+        return [(node, 1.0 - distance) for distance, node in found[:k]]
+
+    # -- persistence ----------------------------------------------------------
+
+    def save(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, "vectors.npy"), np.asarray(self.vectors, dtype=np.float32))
+
+        level0 = np.full((len(self.ids), self.M0), -1, dtype=np.int32)
+        upper = {}
+        for node in range(len(self.ids)):
+            row = self._neighbors(node, 0)
+            level0[node, :len(row)] = row
+            for layer in range(1, self._node_level(node) + 1):
+                upper.setdefault(layer, {})[node] = self._neighbors(node, layer)
+        np.save(os.path.join(directory, "level0.npy"), level0)
+
+        arrays = {}
+        for layer, links in upper.items():
+            nodes = sorted(links)
+            padded = np.full((len(nodes), self.M), -1, dtype=np.int32)
+            for i, node in enumerate(nodes):
+                padded[i, :len(links[node])] = links[node]
+            arrays[f"nodes_{layer}"] = np.asarray(nodes, dtype=np.int32)
+            arrays[f"links_{layer}"] = padded
+        np.savez(os.path.join(directory, "upper.npz"), **arrays)
+
+        with open(os.path.join(directory, "index.json"), "w") as f:
+            json.dump({
+                "dim": self.dim, "M": self.M, "ef_construction": self.ef_construction,
+                "ef_search": self.ef_search, "entry_point": self.entry_point,
+                "max_level": self.max_level, "ids": self.ids,
+            }, f)
+
+    def _node_level(self, node: int) -> int:
+        if self._level0 is None:
+            return len(self._links[node]) - 1
+        return max([layer for layer, links in self._upper.items() if node in links], default=0)
+
+    @classmethod
+    def load(cls, directory: str, mmap: bool = True):
+        with open(os.path.join(directory, "index.json")) as f:
+            meta = json.load(f)
+        index = cls(meta["dim"], M=meta["M"], ef_construction=meta["ef_construction"], ef_search=meta["ef_search"])
+        mode = "r" if mmap else None
+        index.vectors = np.load(os.path.join(directory, "vectors.npy"), mmap_mode=mode)
+        index._level0 = np.load(os.path.join(directory, "level0.npy"), mmap_mode=mode)
+        index._upper = {}
+        upper = np.load(os.path.join(directory, "upper.npz"))
+        for key in upper.files:
+            if key.startswith("nodes_"):
+                layer = int(key.split("_")[1])
+                links = upper[f"links_{layer}"]
+                index._upper[layer] = {
+                    int(node): [int(n) for n in row if n >= 0] for node, row in zip(upper[key], links)
+                }
+        index.ids = meta["ids"]
+        index.entry_point = meta["entry_point"]
+        index.max_level = meta["max_level"]
+        return index
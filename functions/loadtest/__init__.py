@@ -0,0 +1,3 @@
+"""
+Offline load testing for the rag callable. See loadtest/harness.py.
+"""
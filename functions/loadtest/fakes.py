@@ -0,0 +1,714 @@
+"""
+Local stand-ins for every remote client functions/main.py talks to, so the
+rag pipeline can run offline: an in-memory Firestore, a fake Gemini
+GenerativeModel, a hashing embedder and a brute-force vector store over the
+bundled course catalog. Each remote call sleeps for a latency drawn from a
+configurable log-normal distribution.
+"""
+import asyncio
+import copy
+import csv
+import hashlib
+import importlib
+import importlib.util
+import math
+import os
+import random
+import re
+import sys
+import threading
+import time
+import types
+import uuid
+
+import numpy as np
+
+FUNCTIONS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# (median ms, p95 ms) per client call.
+DEFAULT_LATENCIES = {
+    "firestore": (15, 40),
+    "embed": (120, 300),
+    "vector_search": (80, 200),
+    "gemini_fast": (400, 900),
+    "gemini_answer": (1500, 3500),
+}
+
+
+class FakeUpstreamError(Exception):
+    pass
+
+
+class LatencyModel:
+    """
+    Log-normal latency with a given median and 95th percentile. scale shrinks
+    or stretches every sample, e.g. 0.01 for quick smoke runs. error_rates
+    makes a fraction of calls of a kind fail after their latency.
+    """
+
+    def __init__(self, latencies=None, scale: float = 1.0, seed: int = None, error_rates=None):
+        self.latencies = dict(DEFAULT_LATENCIES, **(latencies or {}))
+        self.scale = scale
+        self.error_rates = dict(error_rates or {})
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def maybe_fail(self, kind: str):
+        rate = self.error_rates.get(kind, 0.0)
+        if rate:
+            with self._lock:
+                failed = self._random.random() < rate
+            if failed:
+                raise FakeUpstreamError(f"Simulated {kind} failure")
+
+    def sample_ms(self, kind: str) -> float:
+        median, p95 = self.latencies[kind]
+        sigma = math.log(max(p95, median + 1e-9) / median) / 1.645 if median > 0 else 0.0
+        with self._lock:
+            value = median * math.exp(self._random.gauss(0.0, 1.0) * sigma) if median > 0 else 0.0
+        return value * self.scale
+
+    def sleep(self, kind: str):
+        delay = self.sample_ms(kind)
+        if delay > 0:
+            time.sleep(delay / 1000)
+        self.maybe_fail(kind)
+
+    async def asleep(self, kind: str):
+        delay = self.sample_ms(kind)
+        if delay > 0:
+            await asyncio.sleep(delay / 1000)
+        self.maybe_fail(kind)
+
+
+LATENCY = LatencyModel()
+
+
+# -- Firestore ----------------------------------------------------------------
+
+class Increment:
+    def __init__(self, value):
+        self.value = value
+
+
+class ArrayUnion:
+    def __init__(self, values):
+        self.values = list(values)
+
+
+def _apply_update(current: dict, data: dict) -> dict:
+    updated = dict(current)
+    for key, value in data.items():
+        if isinstance(value, Increment):
+            updated[key] = updated.get(key, 0) + value.value
+        elif isinstance(value, ArrayUnion):
+            existing = list(updated.get(key, []))
+            updated[key] = existing + [item for item in value.values if item not in existing]
+        else:
+            updated[key] = copy.deepcopy(value)
+    return updated
+
+
+class AlreadyExists(Exception):
+    pass
+
+
+class FakeSnapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+
+    @property
+    def exists(self) -> bool:
+        return self._data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field):
+        return copy.deepcopy((self._data or {}).get(field))
+
+
+class FakeDocumentReference:
+    def __init__(self, db, collection: str, doc_id: str):
+        self._db = db
+        self.id = doc_id
+        self.path = f"{collection}/{doc_id}"
+        self.collection_name = collection
+
+    def get(self, transaction=None):
+        LATENCY.sleep("firestore")
+        with self._db.lock:
+            if transaction is not None:
+                transaction.reads[self.path] = self._db.versions.get(self.path, 0)
+            return FakeSnapshot(self, copy.deepcopy(self._db.documents.get(self.path)))
+
+    def set(self, data, merge=False):
+        LATENCY.sleep("firestore")
+        self._db.write(self.path, data, merge=merge)
+
+    def update(self, data):
+        LATENCY.sleep("firestore")
+        self._db.write(self.path, data, merge=True, must_exist=True)
+
+    def create(self, data):
+        LATENCY.sleep("firestore")
+        with self._db.lock:
+            if self.path in self._db.documents:
+                raise AlreadyExists(self.path)
+            self._db.write(self.path, data)
+
+    def delete(self):
+        LATENCY.sleep("firestore")
+        self._db.delete(self.path)
+
+
+class FakeQuery:
+    def __init__(self, db, collection: str, filters=None, limit=None):
+        self._db = db
+        self._collection = collection
+        self._filters = filters or []
+        self._limit = limit
+
+    def where(self, field, op, value):
+        return FakeQuery(self._db, self._collection, self._filters + [(field, op, value)], self._limit)
+
+    def limit(self, count):
+        return FakeQuery(self._db, self._collection, self._filters, count)
+
+    def _matches(self, data) -> bool:
+        for field, op, value in self._filters:
+            actual = data.get(field)
+            if op == "==" and actual != value:
+                return False
+            if op == "in" and actual not in value:
+                return False
+            if op == ">=" and not (actual is not None and actual >= value):
+                return False
+            if op == "<=" and not (actual is not None and actual <= value):
+                return False
+        return True
+
+    def stream(self):
+        LATENCY.sleep("firestore")
+        prefix = self._collection + "/"
+        with self._db.lock:
+            items = [(path, copy.deepcopy(data)) for path, data in self._db.documents.items()
+                     if path.startswith(prefix) and self._matches(data)]
+        if self._limit is not None:
+            items = items[:self._limit]
+        for path, data in items:
+            yield FakeSnapshot(FakeDocumentReference(self._db, self._collection, path[len(prefix):]), data)
+
+
+class FakeCollection(FakeQuery):
+    def document(self, doc_id=None):
+        return FakeDocumentReference(self._db, self._collection, doc_id or uuid.uuid4().hex[:20])
+
+
+class Contention(Exception):
+    pass
+
+
+class FakeBatch:
+    def __init__(self, db):
+        self._db = db
+        self._writes = []
+
+    def set(self, reference, data, merge=False):
+        self._writes.append((reference.path, data, merge, False))
+
+    def update(self, reference, data):
+        self._writes.append((reference.path, data, True, True))
+
+    def delete(self, reference):
+        self._writes.append((reference.path, None, False, False))
+
+    def commit(self):
+        LATENCY.sleep("firestore")
+        self.commit_now()
+
+    def commit_now(self):
+        with self._db.lock:
+            self._check()
+            for path, data, merge, must_exist in self._writes:
+                if data is None:
+                    self._db.delete(path)
+                else:
+                    self._db.write(path, data, merge=merge, must_exist=must_exist)
+        self._writes = []
+
+    def _check(self):
+        pass
+
+
+class FakeTransaction(FakeBatch):
+    """
+    Optimistic transaction: remembers the version of every document read and
+    fails the commit with Contention if any of them changed since.
+    """
+
+    def __init__(self, db):
+        super().__init__(db)
+        self.reads = {}
+
+    def _check(self):
+        for path, version in self.reads.items():
+            if self._db.versions.get(path, 0) != version:
+                raise Contention(path)
+
+
+class FakeFirestore:
+    """
+    In-memory Firestore client. Every document carries a version number so
+    transactions can detect concurrent writes and retry, as Firestore does.
+    """
+
+    def __init__(self):
+        self.documents = {}
+        self.versions = {}
+        self.lock = threading.RLock()
+
+    def collection(self, name):
+        return FakeCollection(self, name)
+
+    def transaction(self):
+        return FakeTransaction(self)
+
+    def batch(self):
+        return FakeBatch(self)
+
+    def get_all(self, references):
+        LATENCY.sleep("firestore")
+        with self.lock:
+            return [FakeSnapshot(ref, copy.deepcopy(self.documents.get(ref.path))) for ref in references]
+
+    def write(self, path, data, merge=False, must_exist=False):
+        with self.lock:
+            if must_exist and path not in self.documents:
+                raise KeyError(f"No document to update: {path}")
+            current = self.documents.get(path, {}) if merge else {}
+            self.documents[path] = _apply_update(current, data)
+            self.versions[path] = self.versions.get(path, 0) + 1
+
+    def delete(self, path):
+        with self.lock:
+            if self.documents.pop(path, None) is not None:
+                self.versions[path] = self.versions.get(path, 0) + 1
+
+
+MAX_TRANSACTION_ATTEMPTS = 5
+
+
+def transactional(func):
+    """
+    Stand-in for firestore.transactional: runs func(transaction, ...), commits
+    the buffered writes and reruns the function on contention.
+    """
+    def run(transaction, *args, **kwargs):
+        for attempt in range(MAX_TRANSACTION_ATTEMPTS):
+            attempt_transaction = FakeTransaction(transaction._db)
+            result = func(attempt_transaction, *args, **kwargs)
+            try:
+                attempt_transaction.commit()
+                return result
+            except Contention:
+                if attempt == MAX_TRANSACTION_ATTEMPTS - 1:
+                    raise
+    return run
+
+
+class FakeAsyncDocumentReference:
+    """
+    Async view of a FakeDocumentReference, as returned by the async client.
+    """
+
+    def __init__(self, reference: FakeDocumentReference):
+        self._reference = reference
+        self._db = reference._db
+        self.id = reference.id
+        self.path = reference.path
+
+    async def get(self, transaction=None):
+        await LATENCY.asleep("firestore")
+        with self._db.lock:
+            if transaction is not None:
+                transaction.reads[self.path] = self._db.versions.get(self.path, 0)
+            return FakeSnapshot(self._reference, copy.deepcopy(self._db.documents.get(self.path)))
+
+    async def set(self, data, merge=False):
+        await LATENCY.asleep("firestore")
+        self._db.write(self.path, data, merge=merge)
+
+    async def update(self, data):
+        await LATENCY.asleep("firestore")
+        self._db.write(self.path, data, merge=True, must_exist=True)
+
+
+class FakeAsyncCollection:
+    def __init__(self, db, name):
+        self._collection = FakeCollection(db, name)
+
+    def document(self, doc_id=None):
+        return FakeAsyncDocumentReference(self._collection.document(doc_id))
+
+
+class FakeAsyncFirestore:
+    """
+    Stand-in for the async Firestore client, sharing documents with a FakeFirestore.
+    """
+
+    def __init__(self, db: FakeFirestore):
+        self._db = db
+
+    def collection(self, name):
+        return FakeAsyncCollection(self._db, name)
+
+    def transaction(self):
+        return FakeTransaction(self._db)
+
+
+def async_transactional(func):
+    """
+    Stand-in for firestore.async_transactional.
+    """
+    async def run(transaction, *args, **kwargs):
+        for attempt in range(MAX_TRANSACTION_ATTEMPTS):
+            attempt_transaction = FakeTransaction(transaction._db)
+            result = await func(attempt_transaction, *args, **kwargs)
+            await LATENCY.asleep("firestore")
+            try:
+                attempt_transaction.commit_now()
+                return result
+            except Contention:
+                if attempt == MAX_TRANSACTION_ATTEMPTS - 1:
+                    raise
+    return run
+
+
+# -- Gemini -------------------------------------------------------------------
+
+COURSE_IN_PROMPT = re.compile(r'Course: ([A-Z]{4})-(\S+) ([^\n]+)')
+
+
+class FakeUsage:
+    def __init__(self, prompt_tokens, response_tokens):
+        self.prompt_token_count = prompt_tokens
+        self.candidates_token_count = response_tokens
+
+
+class FakeResponse:
+    def __init__(self, text, prompt):
+        self.text = text
+        self.usage_metadata = FakeUsage(len(prompt) // 4, len(text) // 4)
+
+
+class FakeGenerativeModel:
+    """
+    Stand-in for vertexai GenerativeModel. The answering model (the one with a
+    system instruction) is slow unless it is a lite model; the small helper
+    models are fast. Answers cite
+    the first course found in the prompt.
+    """
+
+    answer_words = 120
+
+    def __init__(self, model_name=None, generation_config=None, system_instruction=None, **kwargs):
+        self.model_name = model_name
+        self.generation_config = generation_config or {}
+        light = not system_instruction or "lite" in (model_name or "")
+        self.kind = "gemini_fast" if light else "gemini_answer"
+
+    def _respond(self, contents) -> FakeResponse:
+        prompt = "\n".join(str(part) for part in contents)
+        if "Latest query:" in prompt:
+            latest = prompt.rsplit("Latest query:", 1)[1].split("\n")[0].strip()
+            return FakeResponse(f"{latest} courses prerequisites", prompt)
+        if "Split the student's question" in prompt:
+            question = prompt.rsplit("Question:", 1)[1].strip()
+            return FakeResponse("\n".join(part.strip() for part in re.split(r'\band\b|\bvs\.?\b', question)), prompt)
+        if "running summary" in prompt:
+            return FakeResponse("The student is exploring courses and asked about prerequisites.", prompt)
+        match = COURSE_IN_PROMPT.search(prompt)
+        course = f"**{match.group(1)}-{match.group(2)} {match.group(3).strip()}**" if match else "that course"
+        filler = " ".join(["It covers the core material and pairs well with your interests."] * (self.answer_words // 12))
+        return FakeResponse(f"You might like {course}. {filler}", prompt)
+
+    def generate_content(self, contents, **kwargs):
+        LATENCY.sleep(self.kind)
+        return self._respond(contents)
+
+    async def generate_content_async(self, contents, **kwargs):
+        await LATENCY.asleep(self.kind)
+        return self._respond(contents)
+
+
+# -- Embeddings and vector store ---------------------------------------------
+
+EMBEDDING_DIM = 256
+
+
+def hash_embedding(text: str, dim: int = EMBEDDING_DIM) -> list:
+    """
+    Deterministic bag-of-words vector: each word adds a signed unit to a hashed
+    dimension. Similar texts share words, so they land close together.
+    """
+    vector = np.zeros(dim, dtype=np.float32)
+    for word in re.findall(r'\w+', text.lower()):
+        digest = int(hashlib.md5(word.encode("utf-8")).hexdigest()[:8], 16)
+        vector[digest % dim] += 1.0 if digest & 1 << 31 else -1.0
+    norm = float(np.linalg.norm(vector))
+    return (vector / norm if norm else vector).tolist()
+
+
+class FakeEmbeddings:
+    """
+    Stand-in for OpenAIEmbeddings: one latency sample per call, batched or not.
+    """
+
+    def __init__(self, model=None, api_key=None, **kwargs):
+        self.model = model
+        self.calls = 0
+
+    def embed_documents(self, texts):
+        LATENCY.sleep("embed")
+        self.calls += 1
+        return [hash_embedding(text) for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts):
+        await LATENCY.asleep("embed")
+        self.calls += 1
+        return [hash_embedding(text) for text in texts]
+
+    async def aembed_query(self, text):
+        return (await self.aembed_documents([text]))[0]
+
+
+class FakeTextEmbedding:
+    def __init__(self, values):
+        self.values = values
+
+
+class FakeTextEmbeddingInput:
+    def __init__(self, text, task_type=None):
+        self.text = text
+        self.task_type = task_type
+
+
+class FakeTextEmbeddingModel:
+    """
+    Stand-in for vertexai TextEmbeddingModel, used by the local index.
+    """
+
+    @classmethod
+    def from_pretrained(cls, model_name):
+        return cls()
+
+    def get_embeddings(self, inputs, output_dimensionality=EMBEDDING_DIM):
+        LATENCY.sleep("embed")
+        return [FakeTextEmbedding(hash_embedding(item.text, output_dimensionality)) for item in inputs]
+
+    async def get_embeddings_async(self, inputs, output_dimensionality=EMBEDDING_DIM):
+        await LATENCY.asleep("embed")
+        return [FakeTextEmbedding(hash_embedding(item.text, output_dimensionality)) for item in inputs]
+
+
+class FakeDocument:
+    """
+    Minimal langchain Document, used only if langchain_core is not installed.
+    """
+
+    def __init__(self, page_content="", metadata=None, id=None):
+        self.page_content = page_content
+        self.metadata = metadata or {}
+        self.id = id
+
+
+def load_catalog_documents(document_cls, path=None):
+    from catalog import DEFAULT_CATALOG_PATH
+    path = path or DEFAULT_CATALOG_PATH
+    documents = []
+    with open(path, newline='', encoding='utf-8') as csvfile:
+        for row in csv.DictReader(csvfile):
+            if not row.get("tag") or not row.get("number"):
+                continue
+            documents.append(document_cls(
+                page_content=(row.get("description") or "").strip(),
+                metadata={
+                    "course_id": f"{row['tag'].strip()} {row['number'].strip()}",
+                    "course_name": (row.get("course") or "").strip(),
+                    "department": " ".join((row.get("department") or "").split()),
+                    "pre_reqs": (row.get("pre_reqs") or "").strip(),
+                },
+            ))
+    return documents
+
+
+class LocalVectorStore:
+    """
+    Stand-in for AstraDBVectorStore: brute-force cosine search over the bundled
+    catalog, supporting the {"course_id": {"$in": [...]}} metadata filter.
+    """
+
+    document_cls = FakeDocument
+
+    def __init__(self, collection_name=None, embedding=None, **kwargs):
+        self.embedding = embedding
+        self.documents = load_catalog_documents(self.document_cls)
+        self.vectors = np.asarray([
+            hash_embedding(f"{doc.metadata['course_id']} {doc.metadata['course_name']} {doc.page_content}")
+            for doc in self.documents
+        ], dtype=np.float32)
+        self.ids = [doc.metadata["course_id"] for doc in self.documents]
+
+    def _search(self, vector, k, filter=None):
+        scores = self.vectors @ np.asarray(vector, dtype=np.float32)
+        if filter and "course_id" in filter:
+            allowed = set(filter["course_id"].get("$in", []))
+            mask = np.array([doc_id in allowed for doc_id in self.ids])
+            scores = np.where(mask, scores, -np.inf)
+        order = np.argsort(-scores)[:k]
+        return [int(i) for i in order if np.isfinite(scores[i])]
+
+    def similarity_search_with_embedding_by_vector(self, embedding, k=4, filter=None):
+        LATENCY.sleep("vector_search")
+        return [(self.documents[i], self.vectors[i].tolist()) for i in self._search(embedding, k, filter)]
+
+    async def asimilarity_search_with_embedding_by_vector(self, embedding, k=4, filter=None):
+        await LATENCY.asleep("vector_search")
+        return [(self.documents[i], self.vectors[i].tolist()) for i in self._search(embedding, k, filter)]
+
+    def similarity_search_with_score(self, query, k=4, filter=None):
+        vector = self.embedding.embed_query(query)
+        LATENCY.sleep("vector_search")
+        scores = self.vectors @ np.asarray(vector, dtype=np.float32)
+        return [(self.documents[i], float(scores[i])) for i in self._search(vector, k, filter)]
+
+
+# -- Callable requests ----------------------------------------------------------
+
+class FakeAuth:
+    def __init__(self, uid):
+        self.uid = uid
+
+
+class FakeCallableRequest:
+    def __init__(self, uid, data):
+        self.auth = FakeAuth(uid) if uid else None
+        self.data = data
+
+
+# -- Installation ---------------------------------------------------------------
+
+def _module(name, **attributes):
+    module = types.ModuleType(name)
+    module.__dict__.update(attributes)
+    sys.modules[name] = module
+    return module
+
+
+def _document_class():
+    try:
+        from langchain_core.documents import Document
+    except ImportError:
+        Document = FakeDocument
+        _module("langchain_core")
+        _module("langchain_core.documents", Document=Document)
+    return Document
+
+
+def install_fakes(latency: LatencyModel = None):
+    """
+    Registers the fakes under the real client module names and returns the
+    fake Firestore client. Must run before functions/main.py is imported.
+    """
+    global LATENCY
+    if latency is not None:
+        LATENCY = latency
+    db = FakeFirestore()
+
+    LocalVectorStore.document_cls = _document_class()
+
+    firestore = _module(
+        "firebase_admin.firestore",
+        client=lambda *args, **kwargs: db,
+        transactional=transactional,
+        async_transactional=async_transactional,
+        Increment=Increment,
+        ArrayUnion=ArrayUnion,
+    )
+    firestore_async = _module("firebase_admin.firestore_async", client=lambda *args, **kwargs: FakeAsyncFirestore(db))
+    _module("firebase_admin", firestore=firestore, firestore_async=firestore_async,
+            initialize_app=lambda *args, **kwargs: None)
+
+    def on_call(**kwargs):
+        return lambda func: func
+    https_fn = types.SimpleNamespace(on_call=on_call, CallableRequest=FakeCallableRequest)
+    _module("firebase_functions", https_fn=https_fn)
+
+    generative_models = _module("vertexai.generative_models", GenerativeModel=FakeGenerativeModel)
+    language_models = _module("vertexai.language_models", TextEmbeddingModel=FakeTextEmbeddingModel,
+                              TextEmbeddingInput=FakeTextEmbeddingInput)
+    _module("vertexai", init=lambda *args, **kwargs: None, generative_models=generative_models,
+            language_models=language_models)
+    _module("langchain_astradb", AstraDBVectorStore=LocalVectorStore)
+    _module("langchain_openai", OpenAIEmbeddings=FakeEmbeddings)
+    _module("dotenv", load_dotenv=lambda *args, **kwargs: None)
+    return db
+
+
+def build_local_index(directory: str, M: int = 8, ef_construction: int = 40):
+    """
+    Builds a LocalCourseIndex over the bundled catalog with hash embeddings,
+    matching what FakeTextEmbeddingModel returns for queries. Point
+    LOCAL_INDEX_PATH at the directory to use it in a run.
+    """
+    if FUNCTIONS_DIR not in sys.path:
+        sys.path.insert(0, FUNCTIONS_DIR)
+    _document_class()
+    from local_index import LocalCourseIndex
+    documents = load_catalog_documents(FakeDocument)
+    rows = [{
+        "course_id": doc.metadata["course_id"],
+        "course": doc.metadata["course_name"],
+        "department": doc.metadata["department"],
+        "pre_reqs": doc.metadata["pre_reqs"],
+        "description": doc.page_content,
+    } for doc in documents]
+    vectors = [hash_embedding(f"{doc.metadata['course_id']} {doc.metadata['course_name']} {doc.page_content}")
+               for doc in documents]
+    index = LocalCourseIndex.build([row["course_id"] for row in rows], vectors, rows,
+                                   embedding_model="fake-hash", M=M, ef_construction=ef_construction)
+    os.makedirs(directory, exist_ok=True)
+    index.save(directory)
+    return index
+
+
+def load_instance(name: str):
+    """
+    Imports another copy of functions/main.py under a different module name,
+    standing in for a second warm instance: it has its own module globals
+    (caches, coalescer, limiter) but shares the fake Firestore. Call after
+    load_main.
+    """
+    spec = importlib.util.spec_from_file_location(name, os.path.join(FUNCTIONS_DIR, "main.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def load_main(latency: LatencyModel = None):
+    """
+    Installs the fakes and (re)imports functions/main.py against them.
+    Returns the main module.
+    """
+    install_fakes(latency)
+    if FUNCTIONS_DIR not in sys.path:
+        sys.path.insert(0, FUNCTIONS_DIR)
+    if "main" in sys.modules:
+        return importlib.reload(sys.modules["main"])
+    return importlib.import_module("main")
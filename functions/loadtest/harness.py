@@ -0,0 +1,477 @@
+"""
+Offline load test for the rag callable. Runs functions/main.py against the
+local fakes in loadtest/fakes.py with concurrent synthetic users holding
+multi-turn conversations, and reports throughput, latency percentiles and a
+per-stage breakdown taken from the trace records.
+
+    cd functions
+    python -m loadtest.harness --users 20 --turns 6 --latency-scale 0.1
+    python -m loadtest.harness --mode async --users 500                  # coroutines instead of threads
+    python -m loadtest.harness --error-rate vector_search=0.5 --local-fallback   # exercise the breakers
+    python -m loadtest.harness --max-p95-ms 800 --min-throughput 10   # exits 1 on a regression
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from loadtest.fakes import FakeCallableRequest, LatencyModel, build_local_index, load_instance, load_main
+
+# Opening questions and follow-ups for synthetic conversations. Follow-ups
+# lean on the history, so they exercise query enhancement.
+OPENERS = [
+    "What courses should I take to learn machine learning?",
+    "I'm interested in software engineering, where should I start?",
+    "Which upper division COEN classes cover databases?",
+    "Compare CSEN 174 and CSEN 146",
+    "Are there any ethics courses for engineers?",
+    "What intro programming classes are there?",
+    "I want to study computer networks and security",
+    "What math courses do I need for the engineering major?",
+    "Any art history electives about modern art?",
+    "What are the prerequisites for operating systems?",
+    "What are the prerequisites for CSEN 174?",
+    "Hi there!",
+    "Help me plan my next quarter, I like programming",
+]
+FOLLOW_UPS = [
+    "What are the prerequisites for that?",
+    "Is there a more advanced one?",
+    "Which of those has a lab?",
+    "Tell me more about the first course you mentioned.",
+    "Are there any graduate level options?",
+    "How does that compare to the other one?",
+    "Something easier please",
+    "Thanks!",
+    "What is CSEN 146?",
+    "Is CSEN 177 hard?",
+]
+
+PERCENTILES = (50, 95, 99)
+# Trace attributes counted as resilience events (hedges, timeouts, fallbacks...).
+EVENT_SUFFIXES = ("_hedged", "_timeouts", "_rejected", "_no_budget", "_fallback", "_skipped", "coalesced",
+                  "_remote", "_throttled")
+
+
+def percentile(values, pct: float) -> float:
+    """
+    Nearest-rank percentile; 0.0 for an empty list.
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(int(round(pct / 100 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def summarize_latencies(values) -> dict:
+    summary = {f"p{pct}": round(percentile(values, pct), 2) for pct in PERCENTILES}
+    summary["mean"] = round(sum(values) / len(values), 2) if values else 0.0
+    return summary
+
+
+class TraceCollector(logging.Handler):
+    """
+    Collects the JSON trace records the rag callable logs on "rag.trace".
+    """
+
+    def __init__(self):
+        super().__init__(level=logging.INFO)
+        self.records = []
+        self._lock = threading.Lock()
+
+    def emit(self, record):
+        try:
+            parsed = json.loads(record.getMessage())
+        except ValueError:
+            return
+        with self._lock:
+            self.records.append(parsed)
+
+
+class LoopLagProbe:
+    """
+    Measures how late a short timer fires on the instance's event loop while
+    the test runs. Lag means some request held the loop thread and every
+    other request in flight waited on it.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.lags_ms = []
+        self._stopped = False
+
+    async def _run(self):
+        while not self._stopped:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.lags_ms.append(max((time.perf_counter() - start - self.interval) * 1000, 0.0))
+
+    def start(self):
+        from async_runtime import get_loop
+        asyncio.run_coroutine_threadsafe(self._run(), get_loop())
+
+    def stop(self) -> dict:
+        self._stopped = True
+        return dict(summarize_latencies(self.lags_ms), max=round(max(self.lags_ms, default=0.0), 2))
+
+
+def conversation(user_index: int, turns: int, seed: int) -> list:
+    rng = random.Random(seed * 1000 + user_index)
+    return [rng.choice(OPENERS)] + [rng.choice(FOLLOW_UPS) for _ in range(turns - 1)]
+
+
+def run_user(rag, user_index: int, turns: int, think_ms: float, seed: int) -> list:
+    """
+    Plays one synthetic conversation. Returns (latency_ms, ok) per request.
+    """
+    results = []
+    for query in conversation(user_index, turns, seed):
+        request = FakeCallableRequest(f"loadtest-user-{user_index}", {"query": query})
+        start = time.perf_counter()
+        try:
+            result = rag(request)
+            ok = "error" not in result
+        except Exception as e:
+            logging.error("rag raised for user %d: %s", user_index, str(e))
+            ok = False
+        results.append(((time.perf_counter() - start) * 1000, ok))
+        if think_ms:
+            time.sleep(think_ms / 1000)
+    return results
+
+
+async def timed_call(rag_async, request, user_index: int):
+    start = time.perf_counter()
+    try:
+        result = await rag_async(request)
+        ok = "error" not in result
+    except Exception as e:
+        logging.error("rag raised for user %d: %s", user_index, str(e))
+        ok = False
+    return (time.perf_counter() - start) * 1000, ok
+
+
+async def run_user_async(instances, user_index: int, turns: int, think_ms: float, seed: int,
+                         limit: asyncio.Semaphore, duplicate_rate: float = 0.0) -> list:
+    """
+    run_user for the async entry point; limit caps how many users run at once.
+    Turns rotate over the instances. With duplicate_rate, a turn is
+    double-submitted (as a frontend retry would) to the next instance.
+    """
+    rng = random.Random(seed * 7919 + user_index)
+    results = []
+    async with limit:
+        for turn, query in enumerate(conversation(user_index, turns, seed)):
+            request = FakeCallableRequest(f"loadtest-user-{user_index}", {"query": query})
+            instance = instances[(user_index + turn) % len(instances)]
+            calls = [timed_call(instance.rag_async, request, user_index)]
+            if rng.random() < duplicate_rate:
+                duplicate_to = instances[(user_index + turn + 1) % len(instances)]
+                calls.append(timed_call(duplicate_to.rag_async, request, user_index))
+            results.extend(await asyncio.gather(*calls))
+            if think_ms:
+                await asyncio.sleep(think_ms / 1000)
+    return results
+
+
+async def run_users_async(instances, users: int, turns: int, concurrency: int, think_ms: float, seed: int,
+                          duplicate_rate: float = 0.0) -> list:
+    limit = asyncio.Semaphore(concurrency or users)
+    per_user = await asyncio.gather(
+        *(run_user_async(instances, i, turns, think_ms, seed, limit, duplicate_rate) for i in range(users))
+    )
+    return [item for results in per_user for item in results]
+
+
+def start_instances(main, count: int, shared_backend: bool) -> list:
+    """
+    Returns count simulated instances (main plus copies). With shared_backend,
+    their coalescers and user limiters share in-memory stand-ins for the
+    Firestore-backed stores, as they would with RAG_COALESCING_BACKEND=firestore.
+    """
+    instances = [main] + [load_instance(f"main_instance_{i}") for i in range(1, count)]
+    if shared_backend:
+        from coalescing import LocalFlightBackend, LocalSlotBackend, RequestCoalescer, UserConcurrencyLimiter
+        flights, slots = LocalFlightBackend(), LocalSlotBackend()
+        for instance in instances:
+            instance.request_coalescer = RequestCoalescer(flights, poll_interval=0.02)
+            instance.user_limiter = UserConcurrencyLimiter(
+                instance.user_limiter.max_active, instance.user_limiter.max_waiting, backend=slots
+            )
+    return instances
+
+
+def run_load_test(users: int = 20, turns: int = 5, concurrency: int = None, think_ms: float = 0.0,
+                  latency_scale: float = 1.0, latencies: dict = None, seed: int = 0, main=None,
+                  mode: str = "threads", error_rates: dict = None, instances: int = 1,
+                  shared_backend: bool = False, duplicate_rate: float = 0.0) -> dict:
+    """
+    Runs users conversations of turns requests each, at most concurrency users
+    at a time (default: all at once), and returns the report dict. mode
+    "threads" calls the sync rag callable from one thread per user, as the
+    platform does; "async" runs every user as a coroutine on the instance's
+    event loop via rag_async; only this mode supports several simulated
+    instances and duplicate submits.
+    """
+    main = main or load_main(LatencyModel(latencies, scale=latency_scale, seed=seed, error_rates=error_rates))
+    logging.getLogger().setLevel(logging.WARNING)
+    # Load the per-instance caches first so the run measures a warm instance.
+    main.get_catalog()
+    main.get_local_index()
+    trace_logger = logging.getLogger("rag.trace")
+    collector = TraceCollector()
+    trace_logger.addHandler(collector)
+    trace_logger.setLevel(logging.INFO)
+    trace_logger.propagate = False
+    shadow_logger = logging.getLogger("rag.shadow")
+    shadow_collector = TraceCollector()
+    shadow_logger.addHandler(shadow_collector)
+    shadow_logger.setLevel(logging.INFO)
+    shadow_logger.propagate = False
+
+    probe = LoopLagProbe()
+    probe.start()
+    start = time.perf_counter()
+    try:
+        if mode == "async":
+            from async_runtime import run_sync
+            targets = start_instances(main, instances, shared_backend)
+            results = run_sync(run_users_async(targets, users, turns, concurrency, think_ms, seed, duplicate_rate))
+        else:
+            with ThreadPoolExecutor(max_workers=concurrency or users) as pool:
+                futures = [pool.submit(run_user, main.rag, i, turns, think_ms, seed) for i in range(users)]
+                results = [item for future in futures for item in future.result()]
+    finally:
+        trace_logger.removeHandler(collector)
+    elapsed = time.perf_counter() - start
+    from resilience import upstream_metrics
+    report = build_report(results, collector.records, elapsed, users=users, turns=turns, mode=mode)
+    report["loop_lag_ms"] = probe.stop()
+    report["upstreams"] = upstream_metrics()
+    if main.shadow_runner.enabled:
+        # Replays finish after the measured run, as they would after the response.
+        from shadow import summarize
+        main.shadow_runner.drain()
+        report["shadow"] = dict(summarize(shadow_collector.records), submitted=main.shadow_runner.submitted,
+                                dropped=main.shadow_runner.dropped)
+    shadow_logger.removeHandler(shadow_collector)
+    return report
+
+
+def build_report(results, records, elapsed_seconds: float, **run_info) -> dict:
+    latencies = [latency for latency, _ in results]
+    errors = sum(1 for _, ok in results if not ok)
+    stage_values = {}
+    events = {}
+    routes = {}
+    carryover = {"reuse": 0, "extend": 0, "retrievals": 0}
+    for record in records:
+        if record.get("context_carryover"):
+            carryover[record["context_carryover"]] += 1
+        elif "retrieve" in record.get("stages_ms", {}):
+            carryover["retrievals"] += 1
+        route = routes.setdefault(record.get("route", "none"), {
+            "latencies": [], "llm_calls": 0, "llm_calls_avoided": 0, "template_answers": 0,
+        })
+        route["latencies"].append(record["total_ms"])
+        route["llm_calls"] += record.get("llm_calls", 0)
+        route["llm_calls_avoided"] += record.get("llm_calls_avoided", 0)
+        route["template_answers"] += 1 if record.get("template_answer") else 0
+        for stage, ms in record.get("stages_ms", {}).items():
+            stage_values.setdefault(stage, []).append(ms)
+        for key, value in record.items():
+            if key.endswith(EVENT_SUFFIXES):
+                events[key] = events.get(key, 0) + int(value)
+    return {
+        **run_info,
+        "requests": len(results),
+        "errors": errors,
+        "error_rate": errors / len(results) if results else 0.0,
+        "elapsed_s": round(elapsed_seconds, 3),
+        "throughput_rps": round(len(results) / elapsed_seconds, 2) if elapsed_seconds else 0.0,
+        "latency_ms": summarize_latencies(latencies),
+        "stages_ms": {stage: summarize_latencies(values) for stage, values in sorted(stage_values.items())},
+        "events": dict(sorted(events.items())),
+        "routes": {name: route_summary(route) for name, route in sorted(routes.items())},
+        "carryover": carryover_summary(carryover),
+    }
+
+
+def carryover_summary(counts: dict) -> dict:
+    """
+    How often a follow-up reused the previous turn's context instead of
+    enhancing the query and searching again.
+    """
+    carried = counts["reuse"] + counts["extend"]
+    total = carried + counts["retrievals"]
+    return dict(counts, rate=round(carried / total, 3) if total else 0.0)
+
+
+def route_summary(route: dict) -> dict:
+    made, avoided = route["llm_calls"], route["llm_calls_avoided"]
+    return {
+        "requests": len(route["latencies"]),
+        "latency_ms": summarize_latencies(route["latencies"]),
+        "llm_calls": made,
+        "llm_calls_avoided": avoided,
+        "llm_avoidance_rate": round(avoided / (made + avoided), 3) if made + avoided else 0.0,
+        "template_answers": route["template_answers"],
+    }
+
+
+def check_thresholds(report: dict, max_p50_ms: float = None, max_p95_ms: float = None,
+                     max_p99_ms: float = None, min_throughput: float = None,
+                     max_error_rate: float = None, max_stage_p95_ms: dict = None) -> list:
+    """
+    Compares a report against regression thresholds. Returns one message per
+    violated threshold; an empty list means the run passed.
+    """
+    violations = []
+    latency = report["latency_ms"]
+    for name, limit in (("p50", max_p50_ms), ("p95", max_p95_ms), ("p99", max_p99_ms)):
+        if limit is not None and latency[name] > limit:
+            violations.append(f"latency {name} {latency[name]:.1f} ms > {limit} ms")
+    if min_throughput is not None and report["throughput_rps"] < min_throughput:
+        violations.append(f"throughput {report['throughput_rps']:.2f} rps < {min_throughput} rps")
+    if max_error_rate is not None and report["error_rate"] > max_error_rate:
+        violations.append(f"error rate {report['error_rate']:.3f} > {max_error_rate}")
+    for stage, limit in (max_stage_p95_ms or {}).items():
+        observed = report["stages_ms"].get(stage, {}).get("p95", 0.0)
+        if observed > limit:
+            violations.append(f"stage {stage} p95 {observed:.1f} ms > {limit} ms")
+    return violations
+
+
+def print_report(report: dict):
+    print(f"{report['requests']} requests from {report.get('users')} users x {report.get('turns')} turns "
+          f"({report.get('mode')}) "
+          f"in {report['elapsed_s']:.2f} s: {report['throughput_rps']:.2f} rps, {report['errors']} errors")
+    latency = report["latency_ms"]
+    print(f"latency ms    p50 {latency['p50']:>9.1f}  p95 {latency['p95']:>9.1f}  p99 {latency['p99']:>9.1f}")
+    lag = report.get("loop_lag_ms")
+    if lag:
+        print(f"loop lag ms   p50 {lag['p50']:>9.1f}  p95 {lag['p95']:>9.1f}  p99 {lag['p99']:>9.1f}  "
+              f"max {lag['max']:.1f}")
+    print("stage breakdown (ms):")
+    for stage, values in report["stages_ms"].items():
+        print(f"  {stage:<18} p50 {values['p50']:>9.1f}  p95 {values['p95']:>9.1f}  p99 {values['p99']:>9.1f}")
+    print("routes:")
+    for name, route in report.get("routes", {}).items():
+        print(f"  {name:<12} {route['requests']:>5} req  p50 {route['latency_ms']['p50']:>8.1f}  "
+              f"p95 {route['latency_ms']['p95']:>8.1f}  llm calls {route['llm_calls']:>5}  "
+              f"avoided {route['llm_calls_avoided']:>4} ({route['llm_avoidance_rate']:.0%})  "
+              f"templated {route['template_answers']}")
+    carryover = report.get("carryover")
+    if carryover:
+        print(f"context carry-over: reused {carryover['reuse']}, extended {carryover['extend']}, "
+              f"fresh retrievals {carryover['retrievals']} ({carryover['rate']:.0%} of retrieving requests)")
+    if report.get("events"):
+        print("events: " + ", ".join(f"{key}={count}" for key, count in report["events"].items()))
+    shadow = report.get("shadow")
+    if shadow:
+        print(f"shadow traffic: {shadow['submitted']} replayed, {shadow['dropped']} dropped")
+        for name, metrics in shadow.items():
+            if isinstance(metrics, dict):
+                print(f"  candidate {name:<12} jaccard {metrics['jaccard_mean']}  tau {metrics['tau_mean']}  "
+                      f"top-1 {metrics['top1_agreement']}  errors {metrics['error_rate']:.1%}  "
+                      f"p50 ms {metrics['primary_ms']['p50']} -> {metrics['candidate_ms']['p50']}")
+    for name, metrics in report.get("upstreams", {}).items():
+        print(f"  upstream {name:<13} {metrics['state']:<9} opened {metrics['times_opened']}x, "
+              f"rejected {metrics['rejected']}, hedges {metrics['hedges']} ({metrics['hedge_wins']} won), "
+              f"timeouts {metrics['timeouts']}")
+
+
+def parse_stage_limits(values) -> dict:
+    limits = {}
+    for value in values or []:
+        stage, _, limit = value.partition("=")
+        limits[stage] = float(limit)
+    return limits
+
+
+def parse_latencies(values) -> dict:
+    latencies = {}
+    for value in values or []:
+        kind, _, spec = value.partition("=")
+        median, _, p95 = spec.partition(",")
+        latencies[kind] = (float(median), float(p95 or median))
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load test for the rag callable.")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--turns", type=int, default=5)
+    parser.add_argument("--mode", choices=("threads", "async"), default="threads",
+                        help="Drive the sync callable from threads, or rag_async from coroutines.")
+    parser.add_argument("--concurrency", type=int, default=None, help="Users running at once (default: all).")
+    parser.add_argument("--think-ms", type=float, default=0.0, help="Pause between a user's turns.")
+    parser.add_argument("--latency-scale", type=float, default=1.0,
+                        help="Multiplier for every simulated client latency (e.g. 0.1 for quick runs).")
+    parser.add_argument("--latency", action="append", metavar="KIND=MEDIAN,P95",
+                        help="Override a simulated latency in ms, e.g. gemini_answer=3000,9000. Repeatable.")
+    parser.add_argument("--error-rate", action="append", metavar="KIND=RATE",
+                        help="Fraction of calls of a kind that fail, e.g. vector_search=0.5. Repeatable.")
+    parser.add_argument("--local-fallback", action="store_true",
+                        help="Build a local index and use it as the AstraDB fallback.")
+    parser.add_argument("--shadow-rate", type=float, default=0.0,
+                        help="Replay this fraction of retrievals against the local index (needs --local-fallback).")
+    parser.add_argument("--budget-s", type=float, help="Request budget (RAG_REQUEST_BUDGET_S).")
+    parser.add_argument("--instances", type=int, default=1, help="Simulated instances (async mode).")
+    parser.add_argument("--shared-backend", action="store_true",
+                        help="Share coalescing and user slots across instances through in-memory stand-ins.")
+    parser.add_argument("--duplicate-rate", type=float, default=0.0,
+                        help="Fraction of turns double-submitted to the next instance (async mode).")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON.")
+    parser.add_argument("--max-p50-ms", type=float)
+    parser.add_argument("--max-p95-ms", type=float)
+    parser.add_argument("--max-p99-ms", type=float)
+    parser.add_argument("--min-throughput", type=float)
+    parser.add_argument("--max-error-rate", type=float, default=0.0)
+    parser.add_argument("--max-stage-p95-ms", action="append", metavar="STAGE=MS",
+                        help="Per-stage p95 limit, e.g. call_gemini=2000. Repeatable.")
+    args = parser.parse_args()
+    if args.mode != "async" and (args.instances > 1 or args.duplicate_rate):
+        parser.error("--instances and --duplicate-rate need --mode async")
+
+    if args.budget_s:
+        os.environ["RAG_REQUEST_BUDGET_S"] = str(args.budget_s)
+    if args.local_fallback:
+        directory = tempfile.mkdtemp(prefix="loadtest-index-")
+        build_local_index(directory)
+        os.environ["LOCAL_INDEX_PATH"] = directory
+        os.environ["LOCAL_INDEX_ROLE"] = "fallback"
+    if args.shadow_rate:
+        if not args.local_fallback:
+            parser.error("--shadow-rate needs --local-fallback")
+        os.environ["RAG_SHADOW_RATE"] = str(args.shadow_rate)
+        os.environ["RAG_SHADOW_BACKEND"] = "local"
+
+    report = run_load_test(args.users, args.turns, args.concurrency, args.think_ms, args.latency_scale,
+                           latencies=parse_latencies(args.latency), seed=args.seed, mode=args.mode,
+                           error_rates=parse_stage_limits(args.error_rate), instances=args.instances,
+                           shared_backend=args.shared_backend, duplicate_rate=args.duplicate_rate)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+    violations = check_thresholds(
+        report, args.max_p50_ms, args.max_p95_ms, args.max_p99_ms, args.min_throughput,
+        args.max_error_rate, parse_stage_limits(args.max_stage_p95_ms),
+    )
+    for violation in violations:
+        print(f"THRESHOLD FAILED: {violation}")
+    raise SystemExit(1 if violations else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Memory budget check for a warm rag instance. Loads functions/main.py,
+warms it with a round of synthetic traffic, then runs more rounds and
+fails if resident memory ends above the budget or keeps growing between
+rounds. Prints the memory report (what loading each component added and
+the size of the catalog, indexes and caches) either way.
+
+    cd functions
+    python -m loadtest.memory_check --budget-mb 512
+    python -m loadtest.memory_check --budget-mb 512 --local-index --rounds 5 --max-growth-mb 8
+    python -m loadtest.memory_check --real --budget-mb 1024    # the real clients; needs credentials
+
+Offline, the fakes stand in for langchain, vertexai and the Astra client,
+so their share of the footprint is only measured with --real.
+"""
+import argparse
+import gc
+import json
+import logging
+import os
+import tempfile
+
+from loadtest.fakes import LatencyModel, build_local_index, load_main
+from loadtest.harness import run_load_test
+
+# Budget for a warm instance's resident memory, in MB.
+DEFAULT_BUDGET_MB = float(os.getenv("RAG_MEMORY_BUDGET_MB", "512"))
+# Growth allowed between the first and last measured round; more suggests a leak.
+DEFAULT_MAX_GROWTH_MB = 16.0
+
+
+def check_memory(main, budget_mb: float, max_growth_mb: float, rounds: int = 3, users: int = 20,
+                 turns: int = 3) -> dict:
+    """
+    Warms the instance, runs rounds of load and returns a report with the
+    resident memory after each round and the list of budget violations.
+    users=0 only loads the instance (for --real, where requests would cost money).
+    """
+    from profiling import rss_bytes
+
+    main.get_catalog()
+    main.get_local_index()
+    rss_mb = []
+    if users:
+        run_load_test(users, turns, main=main, mode="async", latency_scale=0.01)  # warm-up
+        for seed in range(1, rounds + 1):
+            run_load_test(users, turns, main=main, mode="async", latency_scale=0.01, seed=seed)
+            gc.collect()
+            rss_mb.append(round(rss_bytes() / (1 << 20), 2))
+    else:
+        gc.collect()
+        rss_mb.append(round(rss_bytes() / (1 << 20), 2))
+
+    report = main.profiler.log_memory_report()
+    report["rounds_rss_mb"] = rss_mb
+    violations = []
+    if rss_mb[-1] > budget_mb:
+        violations.append(f"resident memory {rss_mb[-1]:.1f} MB > budget {budget_mb:.1f} MB")
+    growth = rss_mb[-1] - rss_mb[0]
+    if len(rss_mb) > 1 and growth > max_growth_mb:
+        violations.append(f"resident memory grew {growth:.1f} MB over {len(rss_mb)} rounds "
+                          f"(> {max_growth_mb:.1f} MB)")
+    report["violations"] = violations
+    return report
+
+
+def print_report(report: dict):
+    print(f"resident {report['rss_mb']:.1f} MB (peak {report['peak_rss_mb']:.1f} MB); "
+          f"after each round: {report['rounds_rss_mb']}")
+    print(f"loaded (after a {report['baseline_mb']:.1f} MB baseline):")
+    for name, size in sorted(report["loaded_mb"].items(), key=lambda item: -item[1]):
+        print(f"  {name:<22} {size:>8.1f} MB")
+    print("structures:")
+    for name, size in sorted(report["structures_mb"].items(), key=lambda item: -item[1]):
+        print(f"  {name:<22} {size:>8.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fail if a warm rag instance exceeds its memory budget.")
+    parser.add_argument("--budget-mb", type=float, default=DEFAULT_BUDGET_MB)
+    parser.add_argument("--max-growth-mb", type=float, default=DEFAULT_MAX_GROWTH_MB)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--turns", type=int, default=3)
+    parser.add_argument("--local-index", action="store_true", help="Build and load a local index.")
+    parser.add_argument("--real", action="store_true",
+                        help="Import main.py with the real clients and only measure the loaded instance.")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON.")
+    args = parser.parse_args()
+
+    if args.local_index:
+        directory = tempfile.mkdtemp(prefix="memcheck-index-")
+        build_local_index(directory)
+        os.environ["LOCAL_INDEX_PATH"] = directory
+    if args.real:
+        import main as main_module
+    else:
+        main_module = load_main(LatencyModel(scale=0.01))
+    logging.getLogger().setLevel(logging.WARNING)
+
+    report = check_memory(main_module, args.budget_mb, args.max_growth_mb, args.rounds,
+                          0 if args.real else args.users, args.turns)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+    for violation in report["violations"]:
+        print(f"MEMORY BUDGET FAILED: {violation}")
+    raise SystemExit(1 if report["violations"] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+"""
+Single-flight coalescing and the per-user concurrency limiter, with the
+in-memory backends and the Firestore ones on the fake Firestore.
+
+    cd functions
+    python -m pytest loadtest/test_coalescing.py
+"""
+import asyncio
+import uuid
+
+import pytest
+
+from loadtest.fakes import LatencyModel, load_main
+
+BACKENDS = ("none", "local", "firestore")
+
+
+@pytest.fixture(scope="module")
+def async_db():
+    return load_main(LatencyModel(scale=0.0, seed=0)).async_db
+
+
+@pytest.fixture(scope="module")
+def coalescing(async_db):
+    import coalescing  # Needs the fake firebase_admin installed by load_main.
+    return coalescing
+
+
+def flight_backend(coalescing, async_db, kind: str):
+    if kind == "local":
+        return coalescing.LocalFlightBackend()
+    if kind == "firestore":
+        return coalescing.FirestoreFlightBackend(async_db)
+    return None
+
+
+def slot_backend(coalescing, async_db, kind: str):
+    if kind == "local":
+        return coalescing.LocalSlotBackend()
+    if kind == "firestore":
+        return coalescing.FirestoreSlotBackend(async_db)
+    return None
+
+
+class Upstream:
+    """
+    Counts calls; each one waits until released, then answers or fails.
+    """
+
+    def __init__(self, error: Exception = None):
+        self.calls = 0
+        self.error = error
+        self.release = asyncio.Event()
+
+    async def __call__(self):
+        self.calls += 1
+        await self.release.wait()
+        if self.error is not None:
+            raise self.error
+        return {"response": "answer"}
+
+
+def new_key(coalescing) -> str:
+    # A fresh user per test, so flights published to a shared store by earlier tests do not match.
+    return coalescing.coalescing_key(uuid.uuid4().hex, "What is CSEN 174?", 0)
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0.01)
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_identical_concurrent_requests_make_one_upstream_call(coalescing, async_db, backend):
+    async def scenario():
+        backend_store = flight_backend(coalescing, async_db, backend)
+        coalescer = coalescing.RequestCoalescer(backend_store, poll_interval=0.01)
+        upstream = Upstream()
+        key = new_key(coalescing)
+        requests = [asyncio.ensure_future(coalescer.run(key, upstream)) for _ in range(10)]
+        await settle()
+        upstream.release.set()
+        results = await asyncio.gather(*requests)
+        return upstream.calls, coalescer.coalesced, results
+
+    calls, coalesced, results = asyncio.run(scenario())
+    assert calls == 1
+    assert coalesced == 9
+    assert results == [{"response": "answer"}] * 10
+
+
+@pytest.mark.parametrize("backend", ("local", "firestore"))
+def test_duplicates_on_another_instance_share_the_leaders_answer(coalescing, async_db, backend):
+    async def scenario():
+        shared = flight_backend(coalescing, async_db, backend)
+        leader = coalescing.RequestCoalescer(shared, poll_interval=0.01)
+        follower = coalescing.RequestCoalescer(shared, poll_interval=0.01)
+        upstream = Upstream()
+        key = new_key(coalescing)
+        first = asyncio.ensure_future(leader.run(key, upstream))
+        await settle()
+        second = asyncio.ensure_future(follower.run(key, upstream))
+        await settle()
+        upstream.release.set()
+        return upstream.calls, await asyncio.gather(first, second)
+
+    calls, results = asyncio.run(scenario())
+    assert calls == 1
+    assert results[0] == results[1] == {"response": "answer"}
+
+
+def test_leader_failure_propagates_to_followers(coalescing):
+    async def scenario():
+        coalescer = coalescing.RequestCoalescer()
+        upstream = Upstream(error=RuntimeError("gemini failed"))
+        key = new_key(coalescing)
+        requests = [asyncio.ensure_future(coalescer.run(key, upstream)) for _ in range(5)]
+        await settle()
+        upstream.release.set()
+        return upstream.calls, await asyncio.gather(*requests, return_exceptions=True)
+
+    calls, results = asyncio.run(scenario())
+    assert calls == 1
+    assert all(isinstance(result, RuntimeError) and str(result) == "gemini failed" for result in results)
+
+
+@pytest.mark.parametrize("backend", ("local", "firestore"))
+def test_remote_follower_runs_the_request_itself_after_the_leader_fails(coalescing, async_db, backend):
+    async def scenario():
+        shared = flight_backend(coalescing, async_db, backend)
+        leader = coalescing.RequestCoalescer(shared, poll_interval=0.01)
+        follower = coalescing.RequestCoalescer(shared, poll_interval=0.01)
+        failing, working = Upstream(error=RuntimeError("gemini failed")), Upstream()
+        working.release.set()
+        key = new_key(coalescing)
+        first = asyncio.ensure_future(leader.run(key, failing))
+        await settle()
+        second = asyncio.ensure_future(follower.run(key, working))
+        await settle()
+        failing.release.set()
+        return await asyncio.gather(first, second, return_exceptions=True), working.calls
+
+    (first, second), calls = asyncio.run(scenario())
+    assert isinstance(first, RuntimeError)
+    assert second == {"response": "answer"}
+    assert calls == 1
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_limiter_queues_then_rejects_past_the_cap(coalescing, async_db, backend):
+    async def scenario():
+        limiter = coalescing.UserConcurrencyLimiter(max_active=2, max_waiting=1, poll_interval=0.01,
+                                                    backend=slot_backend(coalescing, async_db, backend))
+        upstream = Upstream()
+        running = [asyncio.ensure_future(limiter.run("user", upstream)) for _ in range(3)]
+        await settle()
+        active_before = upstream.calls
+        with pytest.raises(coalescing.TooManyRequests):
+            await limiter.run("user", upstream)
+        other_user = await asyncio.wait_for(limiter.run("other", lambda: asyncio.sleep(0, "ok")), 1.0)
+        upstream.release.set()
+        results = await asyncio.gather(*running)
+        return active_before, upstream.calls, limiter.rejected, other_user, results, dict(limiter._users)
+
+    active_before, calls, rejected, other_user, results, users = asyncio.run(scenario())
+    assert active_before == 2  # The third request waited for a slot...
+    assert calls == 3  # ...and ran once one was released.
+    assert rejected == 1
+    assert other_user == "ok"
+    assert results == [{"response": "answer"}] * 3
+    assert users == {}
+
+
+@pytest.mark.parametrize("backend", ("local", "firestore"))
+def test_limiter_cap_holds_across_instances(coalescing, async_db, backend):
+    async def scenario():
+        shared = slot_backend(coalescing, async_db, backend)
+        first, second = (coalescing.UserConcurrencyLimiter(max_active=2, max_waiting=0, backend=shared)
+                         for _ in range(2))
+        upstream = Upstream()
+        running = [asyncio.ensure_future(first.run("user", upstream)) for _ in range(2)]
+        await settle()
+        with pytest.raises(coalescing.TooManyRequests):
+            await second.run("user", upstream)
+        upstream.release.set()
+        await asyncio.gather(*running)
+        return await second.run("user", lambda: asyncio.sleep(0, "ok"))
+
+    assert asyncio.run(scenario()) == "ok"
+
+
+def test_wait_times_out_with_too_many_requests(coalescing):
+    async def scenario():
+        limiter = coalescing.UserConcurrencyLimiter(max_active=1, max_waiting=1, wait_timeout=0.05)
+        upstream = Upstream()
+        running = asyncio.ensure_future(limiter.run("user", upstream))
+        await settle()
+        with pytest.raises(coalescing.TooManyRequests):
+            await limiter.run("user", upstream)
+        upstream.release.set()
+        await running
+        return limiter.rejected
+
+    assert asyncio.run(scenario()) == 1
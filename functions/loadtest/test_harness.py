@@ -0,0 +1,27 @@
+"""
+Regression thresholds for the rag pipeline, checked on the offline fakes.
+
+    cd functions
+    python -m pytest loadtest
+"""
+import pytest
+
+from loadtest.fakes import LatencyModel, load_main
+from loadtest.harness import check_thresholds, run_load_test
+
+
+@pytest.fixture(scope="module")
+def report():
+    main = load_main(LatencyModel(scale=0.05, seed=0))
+    return run_load_test(users=20, turns=3, main=main, mode="async", latency_scale=0.05)
+
+
+def test_load_test_stays_within_thresholds(report):
+    violations = check_thresholds(report, max_p95_ms=2000, min_throughput=5, max_error_rate=0.0,
+                                  max_stage_p95_ms={"route": 50, "generate_prompt": 100})
+    assert violations == []
+
+
+def test_thresholds_report_violations(report):
+    violations = check_thresholds(report, max_p50_ms=0.001, min_throughput=1e9)
+    assert len(violations) == 2
@@ -0,0 +1,13 @@
+"""
+Warm-instance memory budget (RAG_MEMORY_BUDGET_MB), checked on the offline
+fakes. See memory_check.py for the CLI and for measuring the real clients.
+"""
+from loadtest.fakes import LatencyModel, load_main
+from loadtest.memory_check import DEFAULT_BUDGET_MB, DEFAULT_MAX_GROWTH_MB, check_memory
+
+
+def test_warm_instance_stays_within_memory_budget():
+    main = load_main(LatencyModel(scale=0.01, seed=0))
+    report = check_memory(main, DEFAULT_BUDGET_MB, DEFAULT_MAX_GROWTH_MB, rounds=2, users=10, turns=2)
+    assert report["violations"] == []
+    assert report["rounds_rss_mb"][-1] <= DEFAULT_BUDGET_MB
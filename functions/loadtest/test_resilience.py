@@ -0,0 +1,90 @@
+"""
+Circuit breaker, fallback answer and hedging behavior of the upstream
+guards, driven through the offline fakes.
+
+    cd functions
+    python -m pytest loadtest/test_resilience.py
+"""
+import asyncio
+import time
+
+import pytest
+
+from loadtest.fakes import FakeCallableRequest, LatencyModel, load_main
+
+QUERY = "What courses should I take to learn machine learning?"
+
+
+@pytest.fixture
+def failing_gemini():
+    latency = LatencyModel(scale=0.0, seed=0, error_rates={"gemini_answer": 1.0})
+    main = load_main(latency)
+    main.gemini_upstream.breaker.open_seconds = 0.05
+    return main, latency
+
+
+def ask(main, user: str) -> dict:
+    return main.rag(FakeCallableRequest(user, {"query": QUERY}))
+
+
+def test_gemini_breaker_opens_then_recovers_through_half_open(failing_gemini):
+    main, latency = failing_gemini
+    breaker = main.gemini_upstream.breaker
+    for i in range(breaker.min_calls):
+        assert "error" in ask(main, f"failing-{i}")
+    assert breaker.metrics()["state"] == "open"
+
+    # Open: Gemini is not called and the retrieved courses are listed instead.
+    result = ask(main, "while-open")
+    assert "error" not in result
+    assert "can't write a full answer" in result["response"]
+    assert breaker.metrics()["rejected"] == 1
+
+    latency.error_rates["gemini_answer"] = 0.0
+    time.sleep(breaker.open_seconds)
+    assert breaker.metrics()["state"] == "half_open"
+    result = ask(main, "probe")
+    assert "can't write a full answer" not in result["response"]
+    assert breaker.metrics()["state"] == "closed"
+
+
+def test_failed_half_open_probe_reopens_the_circuit(failing_gemini):
+    main, _ = failing_gemini
+    breaker = main.gemini_upstream.breaker
+    for i in range(breaker.min_calls):
+        ask(main, f"failing-{i}")
+    time.sleep(breaker.open_seconds)
+    assert "error" in ask(main, "probe")
+    assert breaker.metrics()["state"] == "open"
+    assert breaker.metrics()["times_opened"] == 2
+
+
+def test_hedge_wins_when_the_first_call_stalls():
+    main = load_main(LatencyModel(scale=0.0, seed=0))
+    upstream = main.vector_upstream
+    for _ in range(20):
+        upstream.latencies.add(1.0)  # Recent p95 below hedge_min_ms, so the hedge goes out after 50 ms.
+    calls = []
+
+    async def make_call():
+        calls.append(len(calls))
+        await asyncio.sleep(5.0 if len(calls) == 1 else 0.0)
+        return len(calls)
+
+    started = time.perf_counter()
+    assert asyncio.run(upstream.call(make_call)) == 2
+    assert time.perf_counter() - started < 1.0
+    assert (upstream.hedges, upstream.hedge_wins) == (1, 1)
+
+
+def test_nested_deadline_is_not_counted_against_the_upstream():
+    main = load_main(LatencyModel(scale=0.0, seed=0))
+    upstream = main.enhance_upstream
+
+    async def make_call():
+        raise main.DeadlineExceeded("a nested stage ran out of time")
+
+    with pytest.raises(main.DeadlineExceeded):
+        asyncio.run(upstream.call(make_call))
+    assert upstream.timeouts == 0
+    assert upstream.breaker.metrics()["window_calls"] == 0
@@ -0,0 +1,125 @@
+import json
+import logging
+import os
+
+from langchain_core.documents import Document
+
+from hnsw import HNSWIndex
+
+# Chunk hits fetched per requested course; several chunks of one course can
+# rank next to each other and collapse into a single result.
+CHUNK_OVERSAMPLE = 4
+
+
+def row_course_id(row: dict) -> str:
+    return row.get("course_id") or f"{row.get('tag', '')} {row.get('number', '')}".strip()
+
+
+class LocalCourseIndex:
+    """
+    HNSW index over course (or course chunk) embeddings plus the course fields
+    for every row. Search results are grouped back to one hit per course and
+    returned as Documents shaped like the AstraDB ones.
+    """
+
+    def __init__(self, index: HNSWIndex, rows: list, embedding_model: str = "text-embedding-004",
+                 dimensionality: int = 768):
+        self.index = index
+        self.rows = rows
+        self.embedding_model = embedding_model
+        self.dimensionality = dimensionality
+
+    @classmethod
+    def build(cls, ids, vectors, rows, embedding_model: str = "text-embedding-004", **hnsw_kwargs):
+        index = HNSWIndex(len(vectors[0]), **hnsw_kwargs)
+        index.add_items(vectors, list(ids))
+        return cls(index, list(rows), embedding_model, len(vectors[0]))
+
+    def save(self, directory: str):
+        self.index.save(directory)
+        with open(os.path.join(directory, "rows.json"), "w") as f:
+            json.dump({
+                "embedding_model": self.embedding_model,
+                "dimensionality": self.dimensionality,
+                "rows": self.rows,
+            }, f)
+
+    @classmethod
+    def load(cls, directory: str):
+        index = HNSWIndex.load(directory)
+        with open(os.path.join(directory, "rows.json")) as f:
+            meta = json.load(f)
+        logging.info("Loaded local HNSW index with %d rows from %s.", len(index), directory)
+        return cls(index, meta["rows"], meta["embedding_model"], meta["dimensionality"])
+
+    def __len__(self):
+        return len(self.index)
+
+    def search(self, query_vector, k: int, metadata_filter=None, ef: int = None):
+        """
+        Returns up to k (Document, embedding) pairs, one per course, matching the
+        search_fn contract used by retrieval.retrieve_diverse. Supports the
+        {"course_id": {"$in": [...]}} filter by over-fetching and post-filtering.
+        """
+        allowed = None
+        if metadata_filter and "course_id" in metadata_filter:
+            allowed = set(metadata_filter["course_id"].get("$in", []))
+        fetch = k * CHUNK_OVERSAMPLE * (4 if allowed else 1)
+        hits = self.index.search(query_vector, fetch, ef=max(ef or self.index.ef_search, fetch))
+
+        results = []
+        seen = set()
+        for row_index, _ in hits:
+            row = self.rows[row_index]
+            course_id = row_course_id(row)
+            if course_id in seen or (allowed is not None and course_id not in allowed):
+                continue
+            seen.add(course_id)
+            document = Document(
+                page_content=row.get("description", ""),
+                metadata={
+                    "course_id": course_id,
+                    "course_name": row.get("course", ""),
+                    "department": row.get("department", ""),
+                    "pre_reqs": row.get("pre_reqs", ""),
+                    "aliases": row.get("aliases", ""),
+                    "chunk": row.get("chunk_text", ""),
+                },
+            )
+            results.append((document, self.index.vectors[row_index]))
+            if len(results) >= k:
+                break
+        return results
+
+
+class VertexQueryEmbedder:
+    """
+    Embeds queries with the same Vertex AI model the encoder used for the
+    local index, so query and document vectors share a space.
+    """
+
+    def __init__(self, model_name: str = "text-embedding-004", dimensionality: int = 768):
+        self.model_name = model_name
+        self.dimensionality = dimensionality
+        self._model = None
+
+    def _get_model(self):
+        if self._model is None:
+            from vertexai.language_models import TextEmbeddingModel
+            self._model = TextEmbeddingModel.from_pretrained(self.model_name)
+        return self._model
+
+    def embed_documents(self, texts):
+        from vertexai.language_models import TextEmbeddingInput
+        inputs = [TextEmbeddingInput(text, "RETRIEVAL_QUERY") for text in texts]
+        embeddings = self._get_model().get_embeddings(inputs, output_dimensionality=self.dimensionality)
+        return [embedding.values for embedding in embeddings]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts):
+        from vertexai.language_models import TextEmbeddingInput
+        inputs = [TextEmbeddingInput(text, "RETRIEVAL_QUERY") for text in texts]
+        embeddings = await self._get_model().get_embeddings_async(inputs, output_dimensionality=self.dimensionality)
+        return [embedding.values for embedding in embeddings]
@@ -1,13 +1,19 @@
 import numpy as np
+import asyncio
 import logging
 import datetime
-import threading
+import time
+import functools
 import os
 from typing import Any
-from firebase_admin import firestore, initialize_app
+# Imported first so the memory footprint of everything after it can be attributed.
+from profiling import Profiler, FirestoreSettingsBackend, footprint
+from firebase_admin import firestore, firestore_async, initialize_app
 from firebase_functions import https_fn
+footprint.mark("firebase")
 import vertexai
 from vertexai.generative_models import GenerativeModel
+footprint.mark("vertexai")
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -16,6 +22,29 @@ load_dotenv()
 from langchain_astradb import AstraDBVectorStore
 from langchain_openai import OpenAIEmbeddings
 from langchain_core.documents import Document
+footprint.mark("langchain")
+
+from summary_jobs import SummaryJobQueue, FirestoreJobBackend, LocalJobBackend
+from prompt_builder import build_response_prompt
+from catalog import DEFAULT_CATALOG_PATH, get_catalog
+from retrieval import aretrieve_diverse, retrieve_diverse
+from local_index import LocalCourseIndex, VertexQueryEmbedder
+from query_embeddings import CachedQueryEmbedder, FirestoreEmbeddingTier
+from query_planner import plan_query, run_plan
+from tokens import estimate_tokens, truncate_to_tokens
+from tracing import start_trace, finish_trace, span, record, incr, current_trace
+from async_runtime import run_sync
+from resilience import CircuitOpenError, DeadlineExceeded, Upstream, start_deadline, circuit_states
+from router import route_request, ANSWER_MODEL
+from neighbors import DEFAULT_NEIGHBORS_PATH, get_neighbor_graph
+from snapshots import Snapshot, SnapshotManager, content_hash, snapshot_store_from_env
+from reference_validator import get_matcher, validate_references
+from carryover import ANAPHORA_PATTERN, classify_followup, carried_documents, context_entries, previous_context
+from response_cache import ResponseCache, FirestoreResponseBackend
+from shadow import ShadowRunner, query_key
+from coalescing import (RequestCoalescer, UserConcurrencyLimiter, TooManyRequests, coalescing_key,
+                        FirestoreFlightBackend, FirestoreSlotBackend)
+footprint.mark("rag modules")
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -23,13 +52,18 @@ logging.basicConfig(level=logging.INFO)
 # Initialize Firebase Admin (using ADC; Cloud Functions provide credentials)
 initialize_app()
 db = firestore.client()
+# The request pipeline runs on asyncio and uses the async client; summary jobs
+# run on worker threads and keep the sync one.
+async_db = firestore_async.client()
 logging.info("Firebase initialized.")
+footprint.mark("firebase")
 
 # Initialize Vertex AI with your project settings.
 project_id = "bteam-6f36c"
 location = "us-central1"
 vertexai.init(project=project_id, location=location)
 logging.info("Vertex AI initialized.")
+footprint.mark("vertexai")
 
 # Initialize AstraDB and OpenAI Embeddings
 ASTRA_DB_API_ENDPOINT = os.getenv("ASTRA_DB_API_ENDPOINT")
@@ -51,24 +85,146 @@ vector_store = AstraDBVectorStore(
 )
 
 logging.info("AstraDB vector store initialized.")
+footprint.mark("astra client")
+
+# Query embeddings are cached per instance (and optionally in Firestore with
+# QUERY_EMBEDDING_CACHE=firestore) so repeated queries skip the OpenAI call.
+query_embedder = CachedQueryEmbedder(
+    embeddings,
+    persistent=FirestoreEmbeddingTier(db, "text-embedding-3-small")
+    if os.getenv("QUERY_EMBEDDING_CACHE") == "firestore" else None,
+)
+
+# Answers precomputed for frequent questions by data-collection/warm_response_cache.py,
+# served from memory with RAG_RESPONSE_CACHE=firestore. Entries are tied to the
+# snapshot version they were computed against.
+response_cache = ResponseCache(
+    FirestoreResponseBackend(db) if os.getenv("RAG_RESPONSE_CACHE") == "firestore" else None
+)
+
+# Optional local HNSW index (built by data-collection/build_hnsw_index.py). When
+# set, retrieval runs in-process against it instead of AstraDB. With
+# LOCAL_INDEX_ROLE=fallback, AstraDB stays primary and the local index is only
+# used while AstraDB is failing, slow or its circuit is open.
+LOCAL_INDEX_PATH = os.getenv("LOCAL_INDEX_PATH")
+LOCAL_INDEX_ROLE = os.getenv("LOCAL_INDEX_ROLE", "primary")
+
+# Resilience settings for remote calls. Each upstream gets a share of the
+# request budget (RAG_REQUEST_BUDGET_S) as its timeout; the fast ones are hedged
+# with a duplicate request once they run past their recent p95, and each has a
+# circuit breaker that opens on high error or slow-call rates.
+enhance_upstream = Upstream("enhance", budget_share=0.1, hedge=True, slow_call_ms=2000)
+vector_upstream = Upstream("vector_store", budget_share=0.15, hedge=True, slow_call_ms=2500)
+gemini_upstream = Upstream("gemini", budget_share=0.8, slow_call_ms=15000)
+# Time kept back from the answer call for saving it to the chat history.
+HISTORY_WRITE_RESERVE_S = 1.0
+# Retrieved courses listed in the fallback answer while Gemini is unavailable.
+FALLBACK_COURSES = 3
+
+@functools.lru_cache(maxsize=1)
+def load_bundled_local_index():
+    """
+    Loads the local index at LOCAL_INDEX_PATH once per warm instance.
+    Returns None if no index is configured or it fails to load.
+    """
+    if not LOCAL_INDEX_PATH:
+        return None
+    try:
+        return LocalCourseIndex.load(LOCAL_INDEX_PATH)
+    except Exception as e:
+        logging.error("Error loading local index from %s: %s", LOCAL_INDEX_PATH, str(e))
+        return None
+
+def bundled_snapshot() -> Snapshot:
+    """
+    The data deployed with the function, served when no snapshot store is
+    configured or its current version cannot be loaded. Its version hashes
+    the deployed files, so a redeploy with a resynced catalog gets a new one
+    (and with it, a cold response cache).
+    """
+    paths = [os.getenv("COURSE_CATALOG_PATH", DEFAULT_CATALOG_PATH),
+             os.getenv("COURSE_NEIGHBORS_PATH", DEFAULT_NEIGHBORS_PATH), LOCAL_INDEX_PATH]
+    try:
+        version = "bundled-" + content_hash(path for path in paths if path and os.path.exists(path))
+    except OSError as e:
+        logging.warning("Could not hash the bundled data (%s).", str(e))
+        version = "bundled"
+    return Snapshot(version, catalog=get_catalog(), local_index=load_bundled_local_index(),
+                    neighbors=get_neighbor_graph())
+
+# Catalog, local index and neighbor graph come from versioned snapshots when
+# RAG_SNAPSHOT_DIR or RAG_SNAPSHOT_BUCKET is set: warm instances check the
+# version pointer every RAG_SNAPSHOT_POLL_S seconds and swap a new version in
+# without a redeploy. Each request pins the snapshot it started on.
+def prepare_snapshot(snapshot: Snapshot):
+    """
+    Compiles the snapshot's course reference matcher before it serves requests.
+    """
+    if snapshot.catalog is not None:
+        get_matcher(snapshot.catalog)
+
+snapshot_manager = SnapshotManager(snapshot_store_from_env(), fallback=bundled_snapshot, prepare=prepare_snapshot)
+
+def current_snapshot() -> Snapshot:
+    return snapshot_manager.active()
 
-def enhance_query_with_context(query: str, user_id: str) -> str:
+@functools.lru_cache(maxsize=4)
+def get_index_embedder(model_name: str, dimensionality: int):
+    # Shared across snapshot versions so a swap keeps the query embedding cache.
+    return CachedQueryEmbedder(VertexQueryEmbedder(model_name, dimensionality))
+
+def get_local_index():
+    """
+    The active snapshot's local index and its query embedder, or None if it has no index.
+    """
+    index = current_snapshot().local_index
+    if index is None:
+        return None
+    return index, get_index_embedder(index.embedding_model, index.dimensionality)
+
+def memory_components() -> dict:
+    """
+    The instance's large in-memory structures, sized in memory reports.
+    """
+    snapshot = current_snapshot()
+    return {
+        "catalog": snapshot.catalog,
+        "local_index": snapshot.local_index,
+        "neighbors": snapshot.neighbors,
+        "query_embedding_cache": query_embedder._cache,
+        "response_cache": response_cache._loaded,
+    }
+
+# Memory reports, per-stage tracemalloc snapshots (debug only) and one-off CPU profiles of a
+# request; see profiling.py. With RAG_PROFILING_CONFIG=firestore they are
+# switched on warm instances through the runtime_config/profiling document.
+profiler = Profiler(
+    FirestoreSettingsBackend(db) if os.getenv("RAG_PROFILING_CONFIG") == "firestore" else None,
+    components=memory_components,
+)
+
+async def read_chat_history(user_id: str) -> dict:
+    """
+    Reads the user's chat history document once per request. Returns {} for a new user.
+    """
+    with span("history_read"):
+        snapshot = await async_db.collection("chat_histories").document(user_id).get()
+    return snapshot.to_dict() if snapshot.exists else {}
+
+async def enhance_query_with_context(query: str, messages) -> str:
     """
     Uses chat history context to enhance the query for better retrieval.
+    messages is the chat history ending with the latest query.
     """
-    # Get the chat history
-    chat_history_snapshot = db.collection("chat_histories").document(user_id).get()
-    
-    # If no chat history or only one message, return the original query
-    if not chat_history_snapshot.exists:
-        return query
-        
-    chat_data = chat_history_snapshot.to_dict()
-    messages = chat_data.get("messages", [])
-    
     # If there are fewer than 2 messages (not enough context), return original query
     if len(messages) < 2:
         return query
+
+    # Skip enhancement while the enhancement model is failing or slow.
+    if not enhance_upstream.available():
+        logging.info("Enhancement circuit open; using the original query.")
+        record("enhance_skipped", True)
+        return query
         
     # Get the last few messages for context
     recent_messages = messages[-min(5, len(messages)):]
@@ -94,46 +250,206 @@ def enhance_query_with_context(query: str, user_id: str) -> str:
 
                                 Enhanced search query:"""
 
-        response = model.generate_content([enhancement_prompt])
+        incr("llm_calls")
+        response = await enhance_upstream.call(lambda: model.generate_content_async([enhancement_prompt]))
         enhanced_query = response.text.strip()
         
-        logging.info(f"Enhanced query: '{enhanced_query}' (original: '{query}')")
+        logging.info("Enhanced query %s (original %s).", query_key(enhanced_query), query_key(query))
         return enhanced_query
     except Exception as e:
         logging.error(f"Error enhancing query: {str(e)}")
         return query  # Fall back to original query if enhancement fails
 
-def retrieve_relevant_documents(query: str, top_k: int = 5):
+async def search_with_embeddings(query_vector, k: int, metadata_filter=None):
+    """
+    Vector search against AstraDB that also returns the stored embeddings, which
+    the MMR re-ranking needs.
+    """
+    return await vector_upstream.call(
+        lambda: vector_store.asimilarity_search_with_embedding_by_vector(query_vector, k=k, filter=metadata_filter)
+    )
+
+async def search_local_index(query_vector, k: int, metadata_filter=None):
+    """
+    Search against the local index. It is CPU-bound, so it runs in a thread
+    to keep the event loop free for other requests.
+    """
+    return await asyncio.to_thread(get_local_index()[0].search, query_vector, k, metadata_filter)
+
+def local_index_is_primary() -> bool:
+    return get_local_index() is not None and LOCAL_INDEX_ROLE != "fallback"
+
+# Shadow traffic: with RAG_SHADOW_RATE > 0, that fraction of retrievals is
+# replayed in the background against RAG_SHADOW_BACKEND ("local", "astra" or
+# "astra:<collection>", embedded with RAG_SHADOW_EMBEDDING_MODEL) and the
+# comparison is logged to "rag.shadow" (see data-collection/analyze_shadow.py).
+RAG_SHADOW_BACKEND = os.getenv("RAG_SHADOW_BACKEND", "")
+
+def shadow_search_local(query: str, top_k: int) -> list:
+    """
+    Candidate retrieval against the active snapshot's local index.
+    """
+    local = get_local_index()
+    if local is None:
+        raise RuntimeError("no local index in the active snapshot")
+    index, embedder = local
+    docs = retrieve_diverse(query, embedder.embed_query(query), index.search, current_snapshot().catalog,
+                            top_k=top_k)
+    return [doc.metadata.get("course_id") for _, doc in docs]
+
+@functools.lru_cache(maxsize=1)
+def get_shadow_vector_store(collection: str):
+    """
+    A second AstraDB client for the candidate collection, so shadow calls
+    never count against the primary's circuit breaker.
+    """
+    shadow_embeddings = OpenAIEmbeddings(
+        model=os.getenv("RAG_SHADOW_EMBEDDING_MODEL", "text-embedding-3-small"),
+        api_key=OPEN_AI_API_KEY,
+    )
+    store = AstraDBVectorStore(
+        collection_name=collection,
+        embedding=shadow_embeddings,
+        api_endpoint=ASTRA_DB_API_ENDPOINT,
+        token=ASTRA_DB_APPLICATION_TOKEN,
+    )
+    return store, shadow_embeddings
+
+def shadow_search_astra(query: str, top_k: int, collection: str = "courses") -> list:
+    """
+    Candidate retrieval against an AstraDB collection.
+    """
+    store, shadow_embeddings = get_shadow_vector_store(collection)
+    search_fn = lambda vector, k, metadata_filter: store.similarity_search_with_embedding_by_vector(
+        vector, k=k, filter=metadata_filter)
+    docs = retrieve_diverse(query, shadow_embeddings.embed_query(query), search_fn, current_snapshot().catalog,
+                            top_k=top_k)
+    return [doc.metadata.get("course_id") for _, doc in docs]
+
+def shadow_candidate(backend: str):
+    """
+    The candidate search function for a RAG_SHADOW_BACKEND value, or None.
+    """
+    if backend == "local":
+        return shadow_search_local
+    if backend == "astra" or backend.startswith("astra:"):
+        collection = backend.partition(":")[2] or "courses"
+        return functools.partial(shadow_search_astra, collection=collection)
+    if backend:
+        logging.warning("Unknown RAG_SHADOW_BACKEND %r; shadow traffic disabled.", backend)
+    return None
+
+shadow_runner = ShadowRunner(RAG_SHADOW_BACKEND, shadow_candidate(RAG_SHADOW_BACKEND))
+
+def get_query_embedder():
+    """
+    Returns the cached query embedder matching the primary retrieval backend.
+    """
+    return get_local_index()[1] if local_index_is_primary() else query_embedder
+
+async def embed_queries(queries) -> list:
+    """
+    Embeds several queries (e.g. raw and enhanced, or sub-queries) with at most
+    one batched remote call; cached queries are not sent at all.
+    """
+    return await get_query_embedder().aembed_queries(queries)
+
+async def retrieve_relevant_documents(query: str, top_k: int = 5, query_vector=None):
     """
-    Uses AstraDB to retrieve the top_k most similar documents.
+    Uses AstraDB (or the local index, if configured) to retrieve the top_k most
+    relevant documents. Candidates are pre-filtered by metadata parsed from the
+    query (department, level, college) and re-ranked with maximal marginal
+    relevance to avoid near-duplicates. Pass query_vector if the query was
+    already embedded (see embed_queries) with get_query_embedder(). If AstraDB
+    fails and a fallback local index is configured, the query is re-embedded
+    for and searched against the local index.
     """
-    logging.info("Retrieving documents from AstraDB for query: %s", query)
+    use_local = local_index_is_primary()
     try:
-        # Use AstraDB's similarity search
-        relevant_docs = vector_store.similarity_search(query, k=top_k)
-        logging.info("Retrieved %d documents from AstraDB.", len(relevant_docs))
+        started = time.perf_counter()
+        try:
+            relevant_docs = await search_documents(query, top_k, query_vector, use_local)
+        except Exception as e:
+            if use_local or get_local_index() is None:
+                raise
+            logging.warning("AstraDB retrieval failed (%s); falling back to the local index.", str(e))
+            record("vector_store_fallback", True)
+            use_local = True
+            relevant_docs = await search_documents(query, top_k, None, use_local)
+        else:
+            # Only clean primary results are compared; the replay runs off the request path.
+            shadow_runner.submit(query, "local" if use_local else "astra",
+                                 [doc.metadata.get("course_id") for _, doc in relevant_docs],
+                                 (time.perf_counter() - started) * 1000, top_k)
         
         # Convert LangChain documents to a format compatible with your existing code
         formatted_docs = []
-        for doc in relevant_docs:
+        for score, doc in relevant_docs:
             # Extract metadata
             metadata = doc.metadata
-            # Create a tuple with a similarity score (we don't have actual scores from AstraDB's default search)
-            # So we'll use a placeholder value of 1.0 for all docs
-            formatted_docs.append((1.0, {
+            formatted_docs.append((score, {
                 'course': metadata.get('course_name', 'N/A'),
                 'number': metadata.get('course_id', 'N/A').split()[-1] if metadata.get('course_id') else 'N/A',
                 'department': metadata.get('department', 'N/A'),
                 'description': doc.page_content,  # Using the page_content as description
                 'tag': metadata.get('course_id', 'N/A').split()[0] if metadata.get('course_id') else 'N/A',
-                'pre_reqs': metadata.get('pre_reqs', '')
+                'pre_reqs': metadata.get('pre_reqs', ''),
+                'aliases': metadata.get('aliases', ''),
             }))
         
         return formatted_docs
     except Exception as e:
-        logging.error("Error retrieving documents from AstraDB: %s", str(e))
+        logging.error("Error retrieving documents from %s: %s", "local index" if use_local else "AstraDB", str(e))
         raise
 
+async def search_documents(query: str, top_k: int, query_vector, use_local: bool):
+    """
+    Embeds the query if needed and runs the filtered, MMR-ranked search on one backend.
+    """
+    backend = "local index" if use_local else "AstraDB"
+    logging.info("Retrieving documents from %s for query %s.", backend, query_key(query))
+    if query_vector is None:
+        embedder = get_local_index()[1] if use_local else query_embedder
+        with span("embed_query"):
+            query_vector = await embedder.aembed_query(query)
+    search_fn = search_local_index if use_local else search_with_embeddings
+    with span("vector_search"):
+        relevant_docs = await aretrieve_diverse(query, query_vector, search_fn, current_snapshot().catalog,
+                                               top_k=top_k)
+    logging.info("Retrieved %d documents from %s.", len(relevant_docs), backend)
+    return relevant_docs
+
+async def split_compound_query(query: str) -> list:
+    """
+    LLM fallback for the query planner: splits a compound question that names
+    no specific courses into standalone search queries, one per line.
+    """
+    model = GenerativeModel(
+        model_name="gemini-1.5-flash-001",
+        generation_config={"temperature": 0.0, "max_output_tokens": 120}
+    )
+    split_prompt = f"""Split the student's question into independent search queries for a course catalog.
+                    Output one query per line and nothing else. If the question asks about only one thing, output it unchanged.
+
+                    Question: {query}"""
+    incr("llm_calls")
+    response = await enhance_upstream.call(lambda: model.generate_content_async([split_prompt]))
+    return [line.strip(" -*\t") for line in response.text.strip().splitlines()]
+
+async def retrieve_for_query(query: str, search_query: str, top_k: int = 10):
+    """
+    Plans retrieval for the user's query. Compound questions (several named
+    courses, or an LLM split) run one retrieval per sub-query concurrently and
+    are merged with per-sub-query quotas; simple questions do a single
+    retrieval with search_query.
+    """
+    catalog = current_snapshot().catalog
+    plan = await plan_query(query, search_query, catalog, split_compound_query, top_k=top_k)
+    if len(plan) == 1:
+        return await retrieve_relevant_documents(search_query, top_k=top_k)
+    logging.info("Query plan: %s", [(query_key(sub.text), sub.quota, sub.course_id) for sub in plan])
+    return await run_plan(plan, retrieve_relevant_documents, embed_queries, top_k=top_k, catalog=catalog)
+
 def format_chat_history(messages):
     """
     Formats chat history in a way that's more conducive to conversational flow.
@@ -141,8 +457,8 @@ def format_chat_history(messages):
     if not messages:
         return ""
         
-    # Only use the last 5-8 messages to keep context focused
-    recent_messages = messages[-min(8, len(messages)):]
+    # Only use the most recent raw turns; older ones live in the rolling summary
+    recent_messages = messages[-min(SUMMARY_KEEP_RECENT, len(messages)):]
     
     # Format as a conversation with clear roles
     formatted_history = "\n\nPREVIOUS CONVERSATION:\n"
@@ -153,54 +469,29 @@ def format_chat_history(messages):
         
     return formatted_history
 
-def generate_response_prompt(query: str, relevant_docs, user_id: str) -> str:
+def generate_response_prompt(query: str, relevant_docs, chat_data: dict) -> str:
     """
-    Generates a prompt by concatenating information from the retrieved documents.
+    Generates a prompt from the summary, the retrieved documents and the recent
+    chat history, fitted to a fixed token budget by the prompt builder.
+    chat_data is the history document read at the start of the request.
     """
     logging.info("Generating response prompt.")
 
-    # Get chat history
-    chat_history_snapshot = db.collection("chat_histories").document(user_id).get()
-    chat_history = ""
-    if chat_history_snapshot.exists:
-        chat_data = chat_history_snapshot.to_dict()
-        messages = chat_data.get("messages", [])
-        if messages:
-            chat_history = format_chat_history(messages)
-
-    # Start with any summary from chat history if available
-    doc_ref = db.collection("chat_histories").document(user_id)
-    doc_snapshot = doc_ref.get()
-
-    context = ""
-    if doc_snapshot.exists:
-        data = doc_snapshot.to_dict()
-        if "summary" in data:
-            context += "CONVERSATION SUMMARY: " + data["summary"] + "\n\n"
-    
-    # Add relevant docs information
-    context += "RELEVANT COURSE INFORMATION:\n\n"
-    context += "\n\n".join(
-        f"Course: {doc_item.get('tag', 'N/A')}-{doc_item.get('number', 'N/A')} {doc_item.get('course', 'N/A')}\n"
-        f"Department: {doc_item.get('department', 'N/A')}\n"
-        f"Description: {doc_item.get('description', '')}\n"
-        f"Pre-requisites: {doc_item.get('pre_reqs', '')}"
-        for score, doc_item in relevant_docs
-    )
-
-    # Add the chat history
-    context += chat_history
+    messages = chat_data.get("messages", [])
+    chat_history = format_chat_history(messages) if messages else ""
+    summary = chat_data.get("summary", "")
 
-    # Build the final prompt with the current query clearly marked
-    prompt = f"{context}\n\nCURRENT QUERY: {query}\n\nRespond to the student's current query in a helpful, conversational manner."
+    prompt, sections = build_response_prompt(query, relevant_docs, summary=summary, history=chat_history)
+    record("prompt_tokens", sections)
     logging.info("Response prompt generated.")
     return prompt
 
-def call_gemini(prompt: str) -> str:
+async def call_gemini(prompt: str, model_name: str = ANSWER_MODEL, max_output_tokens: int = 1024) -> str:
     """
-    Calls the Vertex AI Gemini API to generate chatbot content.
+    Calls the Vertex AI Gemini API to generate chatbot content. The router
+    picks the model and output cap per request.
     """
-    logging.info("Calling Gemini API with prompt: %s", prompt[:100])  # Log first 100 characters for brevity
+    logging.info("Calling Gemini API with a prompt of ~%d tokens.", estimate_tokens(prompt))
     try:
         model = GenerativeModel(
             system_instruction=["""You are a friendly and helpful academic advisor chatbot for college students.
@@ -219,16 +510,25 @@ def call_gemini(prompt: str) -> str:
 
                                 Make sure your responses are grounded in the facts provided in the DOCUMENTS.
                                 If the user has previously communicated with you, use the chat history to maintain continuity and context in the conversation."""],
-            model_name="gemini-2.0-flash-001",
+            model_name=model_name,
             generation_config={
                 "temperature": 0.7,  # Slightly higher temperature for more conversational responses
                 "top_p": 0.95,
                 "top_k": 40,
-                "max_output_tokens": 1024,
+                "max_output_tokens": max_output_tokens,
             }
         )
-        response = model.generate_content([prompt])
+        incr("llm_calls")
+        response = await gemini_upstream.call(
+            lambda: model.generate_content_async([prompt]), reserve_seconds=HISTORY_WRITE_RESERVE_S
+        )
         logging.info("Gemini API call succeeded.")
+        usage = getattr(response, "usage_metadata", None)
+        if usage is not None:
+            record("gemini_prompt_tokens", usage.prompt_token_count)
+            record("gemini_response_tokens", usage.candidates_token_count)
+        else:
+            record("gemini_response_tokens", estimate_tokens(response.text))
         return response.text
     except Exception as e:
         logging.error("Error calling Gemini API: %s", str(e))
@@ -245,29 +545,81 @@ def verify_token(request) -> dict:
     # Return a dict for consistency in the rest of your code.
     return {"uid": auth_data.uid}
 
-def update_chat_history(user_id: str, role: str, message: str):
+async def update_chat_history(user_id: str, role: str, message: str, context=None) -> int:
     """
     Appends a message (with a role and content) to the user's chat history in Firestore.
+    The append runs in a transaction so it cannot clobber a concurrent summary commit.
+    Bot messages also bump the history version (completed turns), which request
+    coalescing keys on, and carry the IDs and scores of the courses the answer
+    was built from, so a follow-up can reuse them. Returns the number of
+    messages in the history after the append.
     """
-    doc_ref = db.collection("chat_histories").document(user_id)
-    doc = doc_ref.get()
-    if doc.exists:
-        chat_data = doc.to_dict()
-        messages = chat_data.get("messages", [])
-    else:
-        messages = []
-    messages.append({
+    doc_ref = async_db.collection("chat_histories").document(user_id)
+    entry = {
         "role": role,
         "message": message,
         "timestamp": datetime.datetime.now(datetime.timezone.utc)  # Use client-side timestamp
-    })
-    doc_ref.set({"messages": messages}, merge=True)
+    }
+    if context:
+        entry["context"] = context
+
+    @firestore.async_transactional
+    async def append_in_transaction(transaction):
+        doc = await doc_ref.get(transaction=transaction)
+        current = doc.to_dict() if doc.exists else {}
+        messages = current.get("messages", [])
+        messages.append(entry)
+        update = {"messages": messages}
+        if role == "bot":
+            update["version"] = current.get("version", 0) + 1
+        transaction.set(doc_ref, update, merge=True)
+        return len(messages)
+
+    message_count = await append_in_transaction(async_db.transaction())
     logging.info("Updated chat history for user %s with a %s message.", user_id, role)
+    return message_count
+
+# Rolling summary settings. Once the history holds SUMMARY_KEEP_RECENT raw turns
+# plus a full window, the oldest SUMMARY_WINDOW turns are folded into the stored
+# summary. Window size, per-turn length and summary length are all capped, so
+# every summarization call costs the same no matter how long the chat has run.
+SUMMARY_KEEP_RECENT = 8  # Matches the turns format_chat_history puts in the prompt
+SUMMARY_WINDOW = 10
+SUMMARY_THRESHOLD = SUMMARY_KEEP_RECENT + SUMMARY_WINDOW
+SUMMARY_MAX_TOKENS = 300
+SUMMARY_TURN_MAX_TOKENS = 200
+
+def fold_into_summary(summary: str, turns) -> str:
+    """
+    Folds a window of turns into the existing running summary with one bounded Gemini call.
+    """
+    conversation = "\n".join(
+        f"{msg['role']}: {truncate_to_tokens(msg['message'], SUMMARY_TURN_MAX_TOKENS)}" for msg in turns
+    )
+    summary_prompt = f"""Update the running summary of a conversation between a student and an academic advisor chatbot.
+                        Keep the courses, interests, goals and constraints the student mentioned. Drop small talk.
+                        Stay under {SUMMARY_MAX_TOKENS // 2} words and output only the updated summary.
+
+                        Current summary:
+                        {summary or "(none)"}
+
+                        New conversation turns:
+                        {conversation}
+
+                        Updated summary:"""
+    model = GenerativeModel(
+        model_name="gemini-1.5-flash-001",
+        generation_config={"temperature": 0.2, "max_output_tokens": SUMMARY_MAX_TOKENS}
+    )
+    response = model.generate_content([summary_prompt])
+    return truncate_to_tokens(response.text.strip(), SUMMARY_MAX_TOKENS)
 
 def summarize_chat_history(user_id: str):
     """
-    Summarizes the chat history for the user if it exceeds a certain threshold.
-    This function should ideally run asynchronously.
+    Folds the oldest window of turns into the user's running summary, keeping the
+    most recent turns raw for format_chat_history. Runs on the summary job queue;
+    the folded turns are removed in a transaction so that any messages appended
+    while Gemini was running are kept.
     """
     doc_ref = db.collection("chat_histories").document(user_id)
     doc = doc_ref.get()
@@ -275,32 +627,53 @@ def summarize_chat_history(user_id: str):
         return
     chat_data = doc.to_dict()
     messages = chat_data.get("messages", [])
-    threshold = 30  # Adjust this threshold as needed.
-    if len(messages) < threshold:
+    if len(messages) < SUMMARY_THRESHOLD:
         return  # No need to summarize yet.
 
-    # Prepare conversation text for summarization.
-    conversation = "\n".join(
-        [f"{msg['role']}: {msg['message']}" for msg in messages]
-    )
-    summary_prompt = f"Summarize the following conversation in a concise manner:\n\n{conversation}\n\nSummary:"
-    try:
-        summary = call_gemini(summary_prompt)
-        # Optionally, store the summary and reset the messages (or archive them).
-        doc_ref.set({"summary": summary, "messages": []}, merge=True)
-        logging.info("Chat history for user %s summarized.", user_id)
-    except Exception as e:
-        logging.error("Error summarizing chat history for user %s: %s", user_id, str(e))
+    previous_summary = chat_data.get("summary", "")
+    window = messages[:SUMMARY_WINDOW]
+    summary = fold_into_summary(previous_summary, window)
+    last_folded = window[-1].get("timestamp")
+
+    @firestore.transactional
+    def commit_summary(transaction):
+        snapshot = doc_ref.get(transaction=transaction)
+        current = snapshot.to_dict() if snapshot.exists else {}
+        current_messages = current.get("messages", [])
+        # Only drop the turns that were actually folded; if the history was
+        # rewritten in the meantime (e.g. by another summary), leave it alone.
+        if (current.get("summary", "") != previous_summary
+                or len(current_messages) < SUMMARY_WINDOW
+                or current_messages[SUMMARY_WINDOW - 1].get("timestamp") != last_folded):
+            return False
+        transaction.update(doc_ref, {"summary": summary, "messages": current_messages[SUMMARY_WINDOW:]})
+        return True
+
+    if commit_summary(db.transaction()):
+        logging.info("Folded %d turns into the summary for user %s.", SUMMARY_WINDOW, user_id)
+    else:
+        logging.info("Chat history for user %s changed during summary; discarded.", user_id)
+
+# Summaries run on a per-instance worker pool. Job state is kept in Firestore so
+# duplicate submits collapse into one job and jobs cut off by the platform after
+# the response is returned are recovered; set SUMMARY_JOB_BACKEND=local offline.
+summary_jobs = SummaryJobQueue(
+    summarize_chat_history,
+    LocalJobBackend() if os.getenv("SUMMARY_JOB_BACKEND") == "local" else FirestoreJobBackend(db),
+    workers=int(os.getenv("SUMMARY_JOB_WORKERS", "2")),
+    max_queue_size=int(os.getenv("SUMMARY_JOB_QUEUE_SIZE", "100")),
+)
 
-def schedule_summary(user_id: str):
-    """
-    Spawns a background thread to summarize the chat history.
-    In production, consider using Cloud Tasks or Pub/Sub for asynchronous processing.
-    """
-    try:
-        summarize_chat_history(user_id)
-    except Exception as e:
-        logging.error("Error in scheduled summary for user %s: %s", user_id, str(e))
+# Identical in-flight requests (double submits, retries) share one pipeline run,
+# and each user gets a few concurrent requests plus a short queue. Set
+# RAG_COALESCING_BACKEND=firestore to apply both across instances.
+SHARED_COALESCING = os.getenv("RAG_COALESCING_BACKEND") == "firestore"
+request_coalescer = RequestCoalescer(FirestoreFlightBackend(async_db) if SHARED_COALESCING else None)
+user_limiter = UserConcurrencyLimiter(
+    max_active=int(os.getenv("RAG_USER_MAX_ACTIVE", "2")),
+    max_waiting=int(os.getenv("RAG_USER_MAX_QUEUED", "4")),
+    backend=FirestoreSlotBackend(async_db) if SHARED_COALESCING else None,
+)
 
 @https_fn.on_call()
 def rag(request: https_fn.CallableRequest) -> Any:
@@ -312,46 +685,297 @@ def rag(request: https_fn.CallableRequest) -> Any:
       4. Generates a response prompt from the retrieved context.
       5. Sends the prompt to the Gemini API.
       6. Returns the final chatbot response.
+    The pipeline runs on the instance's shared event loop, so a request waiting
+    on Firestore, Gemini or the vector store does not hold a thread of its own;
+    this wrapper only blocks the platform's request thread until it is done.
+    CPU-bound stages (filter parsing, MMR, carry-over, prompt building and
+    reference checks) run in worker threads, so they never stall the loop
+    for the other requests in flight.
+    """
+    return run_sync(rag_async(request))
+
+async def rag_async(request) -> dict:
+    """
+    Async entry point: runs one request inside its own trace and time budget,
+    on the data snapshot that is active when it starts. Each stage is timed
+    and a sampled request emits one JSON trace record, which also carries the
+    snapshot version and the circuit state of every upstream. Requests the
+    profiler picks also carry per-stage allocations or log a CPU profile.
+    """
+    trace = start_trace("rag")
+    start_deadline()
+    record("snapshot_version", snapshot_manager.pin().version)
+    result = await handle_rag_request(request)
+    profiler.end(trace.observer)
+    record("circuits", circuit_states())
+    finish_trace("error" if "error" in result else "ok")
+    return result
+
+async def save_query(user_id: str, query: str):
+    with span("history_write"):
+        await update_chat_history(user_id, "user", query)
+
+def similar_course_documents(course_id: str, top_k: int = 10):
+    """
+    The course and its nearest neighbors from the precomputed graph, as
+    (score, doc_item) pairs like retrieve_relevant_documents returns.
+    Returns None if the graph or the course is missing.
     """
-    decoded_token = verify_token(request)
+    snapshot = current_snapshot()
+    graph, catalog = snapshot.neighbors, snapshot.catalog
+    if graph is None or catalog is None or course_id not in graph:
+        return None
+    docs = []
+    for neighbor_id, score in [(course_id, 1.0)] + graph.similar(course_id, top_k - 1):
+        docs.extend((score, catalog.doc_item(course)) for course in catalog.lookup(neighbor_id)[:1])
+    return docs
+
+async def enhance_and_retrieve(query: str, messages, decision):
+    route = decision.route
+    if route.neighbor_retrieval:
+        relevant_docs = similar_course_documents(decision.course_ids[0])
+        if relevant_docs is not None:
+            incr("vector_search_avoided")
+            return relevant_docs
+    if not route.skip_retrieval:
+        relevant_docs = await asyncio.to_thread(carry_over_context, query, messages)
+        if relevant_docs:
+            return relevant_docs
+    if route.skip_enhancement:
+        enhanced_query = query
+        if len(messages) >= 2:
+            incr("llm_calls_avoided")
+    else:
+        with span("enhance_query"):
+            enhanced_query = await enhance_query_with_context(query, messages)
+    if route.skip_retrieval:
+        return []
+    # MMR keeps the context diverse, so fewer documents cover the same ground.
+    with span("retrieve"):
+        return await retrieve_for_query(query, enhanced_query, top_k=10)
+
+def carry_over_context(query: str, messages):
+    """
+    Answers an anaphoric follow-up ("what about its prerequisites?") from
+    the courses stored with the previous bot turn, lightly extended with
+    courses it names or asks to compare against. Skips both the enhancement
+    call and the vector search. Returns None when a fresh retrieval is needed.
+    """
+    with span("carry_over"):
+        snapshot = current_snapshot()
+        carry = classify_followup(query, messages, snapshot.catalog)
+        if carry is None:
+            return None
+        relevant_docs = carried_documents(carry, snapshot.catalog, snapshot.neighbors)
+    if not relevant_docs:
+        return None
+    logging.info("Follow-up answered from the previous context: %s", carry)
+    record("context_carryover", carry.mode)
+    incr("llm_calls_avoided")
+    incr("vector_search_avoided")
+    return relevant_docs
+
+async def handle_rag_request(request) -> dict:
+    """
+    Runs the RAG pipeline for one callable request inside the active trace.
+    The history is read once up front; its version and the normalized query
+    key single-flight coalescing, so an identical request already in flight
+    shares that run's answer. New runs wait for one of the user's request slots.
+    """
+    with span("verify_token"):
+        decoded_token = verify_token(request)
     if not decoded_token:
         return {"error": "Unauthorized"}
     
     user_id = decoded_token["uid"]
     logging.info("Authenticated user ID: %s", user_id)
+    profiler.begin(current_trace(), user_id)
 
     try:
         request_json = request.data
         query = request_json["query"]
-        logging.info("Received query: %s", query)
+        logging.info("Received query %s.", query_key(query))
     except (KeyError, TypeError):
         error_msg = 'The request must include a "query" field in the JSON payload.'
         logging.error(error_msg)
         return {"error": error_msg}
 
     try:
-        # Save the user's query to chat history.
-        update_chat_history(user_id, "user", query)
-
-        # Enhance the query using conversation context
-        enhanced_query = enhance_query_with_context(query, user_id)
-        
-        # Retrieve relevant documents and generate the response prompt.
-        relevant_docs = retrieve_relevant_documents(enhanced_query, top_k=15)
-        response_prompt = generate_response_prompt(query, relevant_docs, user_id)
-        chatbot_response = call_gemini(response_prompt)
-
-        # Save the Gemini response to chat history.
-        update_chat_history(user_id, "bot", chatbot_response)
-
-        # Schedule asynchronous summarization if needed.
-        threading.Thread(target=schedule_summary, args=(user_id,)).start()
-
-        logging.info("Returning chatbot response for user %s.", user_id)
-        return {"response": chatbot_response}
+        chat_data = await read_chat_history(user_id)
+        key = coalescing_key(user_id, query, chat_data.get("version", 0))
+        return await request_coalescer.run(
+            key, lambda: user_limiter.run(user_id, lambda: answer_query(user_id, query, chat_data))
+        )
+    except TooManyRequests:
+        return {"error": "Too many requests in progress. Please wait for the previous answer."}
     except Exception as e:
         logging.error("Error in processing request for user %s: %s", user_id, str(e))
         return {
             "error": "An error occurred while processing the request.",
             "details": str(e)
-        }
\ No newline at end of file
+        }
+
+@https_fn.on_call()
+def similar_courses(request: https_fn.CallableRequest) -> Any:
+    """
+    Cloud Function for the course explorer: expects {"course_id": "CSEN 174"}
+    and an optional "k", and returns the most similar courses from the
+    precomputed neighbor graph (no embedding call or vector search).
+    """
+    if not verify_token(request):
+        return {"error": "Unauthorized"}
+    try:
+        course_id = request.data["course_id"]
+        k = int(request.data.get("k", 5))
+    except (KeyError, TypeError, ValueError):
+        return {"error": 'The request must include a "course_id" field in the JSON payload.'}
+
+    snapshot = current_snapshot()
+    graph, catalog = snapshot.neighbors, snapshot.catalog
+    if graph is None:
+        return {"error": "Similar courses are not available."}
+    if catalog and catalog.lookup(course_id):
+        # Alias codes of consolidated courses resolve to the canonical course.
+        course_id = catalog.lookup(course_id)[0]["course_id"]
+    if course_id not in graph:
+        return {"error": f"Unknown course: {course_id}"}
+    similar = []
+    for neighbor_id, score in graph.similar(course_id, k):
+        entry = {"course_id": neighbor_id, "score": round(score, 4)}
+        courses = catalog.lookup(neighbor_id) if catalog else []
+        if courses:
+            entry.update(course=courses[0]["course"], department=courses[0]["department"])
+        similar.append(entry)
+    return {"course_id": course_id, "similar": similar}
+
+def cached_response(query: str):
+    """
+    A precomputed answer for a standalone question. Questions that refer back
+    to the conversation ("is it hard?") depend on the history and never hit.
+    """
+    if ANAPHORA_PATTERN.search(query):
+        return None
+    return response_cache.get(query, current_snapshot().version)
+
+async def precompute_answer(query: str) -> dict:
+    """
+    Answers a question as the first turn of a conversation, for the response
+    cache warmer: same route, retrieval and prompt as a live request, without
+    reading or writing any chat history. The answer is stored unannotated;
+    the reference check runs when it is served.
+    """
+    start_deadline()
+    decision = route_request(query, current_snapshot().catalog)
+    if decision.answer is not None:
+        return {"response": decision.answer, "route": decision.route.name,
+                "context": [{"id": course_id, "score": 1.0} for course_id in decision.course_ids]}
+    messages = [{"role": "user", "message": query}]
+    relevant_docs = await enhance_and_retrieve(query, messages, decision)
+    prompt = await asyncio.to_thread(generate_response_prompt, query, relevant_docs, {"messages": messages})
+    response = await call_gemini(prompt, decision.route.model, decision.route.max_output_tokens)
+    return {"response": response, "route": decision.route.name,
+            "context": context_entries(relevant_docs)}
+
+def check_course_references(response: str, retrieved_ids) -> str:
+    """
+    Links the courses a generated answer cites and marks codes that are not
+    in the catalog; cited courses missing from the retrieved context are
+    only counted, since they may come from earlier in the conversation.
+    Only the copy returned to the client is annotated: the history keeps the
+    model's text, which goes back into prompts and summaries.
+    """
+    catalog = current_snapshot().catalog
+    if catalog is None:
+        return response
+    response, report = validate_references(response, catalog, retrieved_ids)
+    record("course_refs", len(report["references"]))
+    for kind in ("unknown", "unretrieved", "mismatched"):
+        if report[kind]:
+            record(f"{kind}_course_refs", report[kind])
+    if report["unknown"]:
+        logging.warning("Response cited courses not in the catalog: %s", ", ".join(report["unknown"]))
+    return response
+
+def fallback_answer(relevant_docs) -> str:
+    """
+    The degraded answer sent when Gemini's circuit is open or the answer call
+    ran out of time: the best retrieved courses, or a plain retry message.
+    """
+    courses = []
+    for _, doc_item in relevant_docs:
+        reference = f"**{doc_item['tag']}-{doc_item['number']} {doc_item['course']}**"
+        if reference not in courses:
+            courses.append(reference)
+    if not courses:
+        return "Sorry, I can't answer right now. Please try again in a minute."
+    listed = "\n".join(f"- {course}" for course in courses[:FALLBACK_COURSES])
+    return ("I can't write a full answer right now, but these courses look relevant to your question:\n"
+            f"{listed}\nPlease ask again in a minute for more detail.")
+
+async def answer_query(user_id: str, query: str, chat_data: dict) -> dict:
+    """
+    Answers one query. The router picks the model, output cap and stages;
+    simple catalog lookups are answered from a template without any model
+    call. Otherwise saving the query runs concurrently with enhancement and
+    retrieval, which only need the history as read. While Gemini is
+    unavailable, the retrieved courses are listed instead of an answer.
+    """
+    with span("route"):
+        decision = route_request(query, current_snapshot().catalog)
+    route = decision.route
+    record("route", route.name)
+
+    cached = None if decision.answer is not None else cached_response(query)
+    if decision.answer is not None:
+        # No model call at all; counted as the one answer call avoided.
+        incr("llm_calls_avoided")
+        record("template_answer", True)
+        await save_query(user_id, query)
+        chatbot_response = decision.answer
+        context = [{"id": course_id, "score": 1.0} for course_id in decision.course_ids]
+    elif cached is not None:
+        incr("llm_calls_avoided")
+        record("response_cache_hit", True)
+        await save_query(user_id, query)
+        chatbot_response = cached["response"]
+        context = cached.get("context") or []
+        retrieved_ids = {entry["id"] for entry in context}
+    else:
+        chat_data = dict(chat_data, messages=chat_data.get("messages", []) + [{"role": "user", "message": query}])
+
+        # Save the user's query while the query is enhanced and documents retrieved.
+        _, relevant_docs = await asyncio.gather(
+            save_query(user_id, query),
+            enhance_and_retrieve(query, chat_data["messages"], decision),
+        )
+        with span("generate_prompt"):
+            response_prompt = await asyncio.to_thread(generate_response_prompt, query, relevant_docs, chat_data)
+        with span("call_gemini"):
+            try:
+                chatbot_response = await call_gemini(response_prompt, route.model, route.max_output_tokens)
+            except (CircuitOpenError, DeadlineExceeded) as e:
+                logging.warning("Answer model unavailable (%s); sending the fallback answer.", str(e))
+                record("answer_fallback", True)
+                chatbot_response = fallback_answer(relevant_docs)
+        retrieved_ids = {f"{doc_item['tag']} {doc_item['number']}" for _, doc_item in relevant_docs}
+        # Turns without retrieval (chit-chat) keep the previous context for the next follow-up.
+        context = context_entries(relevant_docs) if relevant_docs else previous_context(chat_data["messages"])
+
+    # Only the reply gets links and catalog notes; the history keeps the plain answer.
+    reply = chatbot_response
+    if decision.answer is None:
+        with span("validate_refs"):
+            reply = await asyncio.to_thread(check_course_references, chatbot_response, retrieved_ids)
+
+    # Save the Gemini response to chat history.
+    with span("history_write"):
+        message_count = await update_chat_history(user_id, "bot", chatbot_response, context)
+
+    # Queue a background summary once the history is long enough. Claiming
+    # the job is a blocking Firestore transaction, so it runs in a thread.
+    if message_count >= SUMMARY_THRESHOLD:
+        with span("summary_enqueue"):
+            await asyncio.to_thread(summary_jobs.submit, user_id)
+
+    logging.info("Returning chatbot response for user %s.", user_id)
+    return {"response": reply}
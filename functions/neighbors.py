@@ -0,0 +1,185 @@
+import functools
+import hashlib
+import json
+import logging
+import os
+
+import numpy as np
+
+from vector_index import normalize_rows
+
+DEFAULT_NEIGHBORS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "course_neighbors.npz")
+DEFAULT_NEIGHBORS = 20
+BLOCK_SIZE = 1024  # Query rows per matmul block; bounds the similarity block to BLOCK_SIZE x catalog size
+# Above this share of changed rows an incremental rebuild is no cheaper than a full one.
+INCREMENTAL_MAX_CHANGED = 0.5
+
+
+def content_hashes(vectors) -> np.ndarray:
+    """
+    A 64-bit hash of every embedding row, used to detect which rows changed
+    between builds.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    return np.array(
+        [int.from_bytes(hashlib.blake2b(row.tobytes(), digest_size=8).digest(), "little") for row in vectors],
+        dtype=np.uint64,
+    )
+
+
+def top_k_neighbors(unit, k: int, rows=None, columns=None, block_size: int = BLOCK_SIZE):
+    """
+    Exact top-k cosine neighbors of `rows` (default: every row) among
+    `columns` (default: every row) of the unit-normalized matrix, computed one
+    block of rows at a time with a matmul and argpartition. A row is never its
+    own neighbor. Returns (indices, scores), each rows x k, best first.
+    """
+    rows = np.arange(len(unit)) if rows is None else np.asarray(rows, dtype=np.int64)
+    columns = np.arange(len(unit)) if columns is None else np.asarray(columns, dtype=np.int64)
+    k = min(k, len(columns))
+    indices = np.empty((len(rows), k), dtype=np.int64)
+    scores = np.empty((len(rows), k), dtype=np.float32)
+    if k == 0:
+        return indices, scores
+    column_vectors = unit[columns]
+    for start in range(0, len(rows), block_size):
+        block = rows[start:start + block_size]
+        sims = unit[block] @ column_vectors.T
+        sims[block[:, None] == columns[None, :]] = -np.inf
+        candidates = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+        candidate_scores = np.take_along_axis(sims, candidates, axis=1)
+        order = np.argsort(-candidate_scores, axis=1, kind="stable")
+        indices[start:start + len(block)] = columns[np.take_along_axis(candidates, order, axis=1)]
+        scores[start:start + len(block)] = np.take_along_axis(candidate_scores, order, axis=1)
+    return indices, scores
+
+
+class NeighborGraph:
+    """
+    Precomputed "similar courses" lists: for every course, its k nearest
+    courses by embedding cosine similarity. Lookups are a dict hit and a row
+    slice, so serving them needs no embedding call or vector search.
+    """
+
+    def __init__(self, ids, neighbors: np.ndarray, scores: np.ndarray, hashes: np.ndarray):
+        self.ids = list(ids)
+        self.neighbors = neighbors
+        self.scores = scores
+        self.hashes = hashes
+        self.row_by_id = {course_id: row for row, course_id in enumerate(self.ids)}
+
+    @property
+    def k(self) -> int:
+        return self.neighbors.shape[1] if self.neighbors.ndim == 2 else 0
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, course_id):
+        return course_id in self.row_by_id
+
+    def similar(self, course_id: str, k: int = None) -> list:
+        """
+        Returns up to k (course_id, score) pairs most similar to the course,
+        best first, or an empty list if the course is not in the graph.
+        """
+        row = self.row_by_id.get(course_id)
+        if row is None:
+            return []
+        k = self.k if k is None else min(k, self.k)
+        return [(self.ids[neighbor], float(score))
+                for neighbor, score in zip(self.neighbors[row, :k], self.scores[row, :k])]
+
+    @classmethod
+    def build(cls, ids, vectors, k: int = DEFAULT_NEIGHBORS, block_size: int = BLOCK_SIZE):
+        unit = normalize_rows(vectors)
+        neighbors, scores = top_k_neighbors(unit, min(k, len(unit) - 1), block_size=block_size)
+        return cls(ids, _compact(neighbors, len(unit)), scores.astype(np.float16), content_hashes(vectors))
+
+    def update(self, ids, vectors, k: int = None, block_size: int = BLOCK_SIZE):
+        """
+        Rebuilds the graph for a new set of embeddings, recomputing only what
+        changed. Rows that are new or whose embedding hash changed, and rows
+        whose lists pointed at a changed or removed course, get a full top-k
+        scan; every other row keeps its list and only merges in scores against
+        the changed rows. Returns (graph, stats).
+        """
+        ids = list(ids)
+        k = min(self.k if k is None else k, len(ids) - 1)
+        hashes = content_hashes(vectors)
+        old_rows = [self.row_by_id.get(course_id, -1) for course_id in ids]
+        changed = np.array([old < 0 or self.hashes[old] != new_hash for old, new_hash in zip(old_rows, hashes)])
+        stats = {"rows": len(ids), "changed": int(changed.sum()),
+                 "removed": len(set(self.ids) - set(ids)), "rescanned": 0, "merged": 0}
+        if k != self.k or changed.sum() > INCREMENTAL_MAX_CHANGED * len(ids):
+            stats["rescanned"] = len(ids)
+            return NeighborGraph.build(ids, vectors, k, block_size), stats
+
+        # Old row -> new row, -1 for rows that were removed or changed.
+        old_to_new = np.full(len(self.ids), -1, dtype=np.int64)
+        for new_row, old_row in enumerate(old_rows):
+            if not changed[new_row]:
+                old_to_new[old_row] = new_row
+        unit = normalize_rows(vectors)
+        neighbors = np.empty((len(ids), k), dtype=np.int64)
+        scores = np.empty((len(ids), k), dtype=np.float32)
+
+        kept = np.flatnonzero(~changed)
+        kept_neighbors = old_to_new[self.neighbors[np.array([old_rows[row] for row in kept], dtype=np.int64)]]
+        stale = np.any(kept_neighbors < 0, axis=1)
+        rescan = np.concatenate([np.flatnonzero(changed), kept[stale]])
+        if len(rescan):
+            neighbors[rescan], scores[rescan] = top_k_neighbors(unit, k, rows=rescan, block_size=block_size)
+
+        merge = kept[~stale]
+        merge_neighbors = kept_neighbors[~stale]
+        merge_scores = self.scores[np.array([old_rows[row] for row in merge], dtype=np.int64)].astype(np.float32)
+        changed_rows = np.flatnonzero(changed)
+        if len(merge) and len(changed_rows):
+            fresh, fresh_scores = top_k_neighbors(unit, k, rows=merge, columns=changed_rows, block_size=block_size)
+            candidates = np.concatenate([merge_neighbors, fresh], axis=1)
+            candidate_scores = np.concatenate([merge_scores, fresh_scores], axis=1)
+            order = np.argsort(-candidate_scores, axis=1, kind="stable")[:, :k]
+            merge_neighbors = np.take_along_axis(candidates, order, axis=1)
+            merge_scores = np.take_along_axis(candidate_scores, order, axis=1)
+        if len(merge):
+            neighbors[merge], scores[merge] = merge_neighbors, merge_scores
+
+        stats["rescanned"] = len(rescan)
+        stats["merged"] = len(merge) if len(changed_rows) else 0
+        return NeighborGraph(ids, _compact(neighbors, len(ids)), scores.astype(np.float16), hashes), stats
+
+    def save(self, path: str):
+        np.savez(
+            path,
+            ids=np.array(json.dumps(self.ids)),
+            neighbors=self.neighbors,
+            scores=self.scores,
+            hashes=self.hashes,
+        )
+
+    @classmethod
+    def load(cls, path: str):
+        data = np.load(path)
+        graph = cls(json.loads(str(data["ids"])), data["neighbors"], data["scores"], data["hashes"])
+        logging.info("Loaded neighbor graph for %d courses (k=%d) from %s.", len(graph), graph.k, path)
+        return graph
+
+
+def _compact(neighbors: np.ndarray, rows: int) -> np.ndarray:
+    # Row numbers fit in 16 bits for any realistic catalog; halve the artifact when they do.
+    return neighbors.astype(np.uint16 if rows <= np.iinfo(np.uint16).max else np.int32)
+
+
+@functools.lru_cache(maxsize=1)
+def get_neighbor_graph():
+    """
+    Loads the neighbor graph once per warm instance. Returns None if the
+    artifact is missing, in which case "similar courses" falls back to search.
+    """
+    path = os.getenv("COURSE_NEIGHBORS_PATH", DEFAULT_NEIGHBORS_PATH)
+    try:
+        return NeighborGraph.load(path)
+    except OSError as e:
+        logging.warning("Course neighbor graph unavailable (%s).", str(e))
+        return None
@@ -0,0 +1,393 @@
+import cProfile
+import json
+import logging
+import os
+import pstats
+import queue
+import random
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+
+# Settings start from these environment variables; with RAG_PROFILING_CONFIG=firestore
+# the fields of runtime_config/profiling override them, re-read every poll interval,
+# so profiling can be switched on and off on a warm instance without a redeploy.
+ENV_SETTINGS = {
+    "memory_report": os.getenv("RAG_MEMORY_REPORT") == "1",  # log a memory_report every poll
+    # Debug only: any rate above 0 starts tracemalloc for the whole process, so every
+    # request pays for allocation tracing, not just the sampled ones.
+    "tracemalloc_rate": float(os.getenv("RAG_TRACEMALLOC_RATE", "0")),  # fraction of requests with allocation stats
+    "tracemalloc_frames": int(os.getenv("RAG_TRACEMALLOC_FRAMES", "1")),
+    "profile_request": os.getenv("RAG_PROFILE_REQUEST", ""),  # a new value CPU-profiles the next request, once
+    "profile_user": os.getenv("RAG_PROFILE_USER", ""),  # ... from this user only, if set
+}
+DEFAULT_POLL_SECONDS = float(os.getenv("RAG_PROFILING_POLL_S", "60"))
+# Where full .prof files go (for snakeviz or pstats); empty logs only the top functions.
+PROFILE_DIR = os.getenv("RAG_PROFILE_DIR", "")
+TOP_ALLOCATIONS = 5  # allocation sites logged per sampled request
+TOP_FUNCTIONS = 25  # functions logged per CPU profile
+# Request snapshots waiting to be taken or diffed; more are dropped rather than held in memory.
+ANALYSIS_QUEUE_SIZE = 16
+
+memory_logger = logging.getLogger("rag.memory")
+profile_logger = logging.getLogger("rag.profile")
+
+
+def rss_bytes() -> int:
+    """
+    Current resident set size, or the peak where /proc is unavailable.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return peak_rss_bytes()
+
+
+def peak_rss_bytes() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _mb(size: int) -> float:
+    return round(size / (1 << 20), 2)
+
+
+def deep_sizeof(obj) -> int:
+    """
+    Approximate bytes held by an object graph: containers, instance
+    attributes and numpy buffers, each object counted once. Modules,
+    classes and functions are not followed.
+    """
+    seen = set()
+    stack = [obj]
+    total = 0
+    while stack:
+        item = stack.pop()
+        if id(item) in seen or isinstance(item, (type, type(sys), type(deep_sizeof))):
+            continue
+        seen.add(id(item))
+        nbytes = getattr(item, "nbytes", None)
+        if isinstance(nbytes, int) and hasattr(item, "dtype"):
+            # A view's buffer belongs to its base.
+            total += sys.getsizeof(item) if getattr(item, "base", None) is not None else nbytes
+            continue
+        try:
+            total += sys.getsizeof(item)
+        except TypeError:
+            continue
+        if isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset)):
+            stack.extend(item)
+        elif not isinstance(item, (str, bytes, int, float, bool)):
+            if hasattr(item, "__dict__"):
+                stack.append(vars(item))
+            for slot in getattr(type(item), "__slots__", ()):
+                if hasattr(item, slot):
+                    stack.append(getattr(item, slot))
+    return total
+
+
+class Footprint:
+    """
+    Resident memory added by each step of loading the instance: call mark()
+    after importing or initializing a component. Libraries shared by several
+    components count towards the first one loaded.
+    """
+
+    def __init__(self):
+        self.marks = {}
+        self.baseline = self._last = rss_bytes()  # interpreter and everything imported before
+
+    def mark(self, component: str):
+        rss = rss_bytes()
+        self.marks[component] = self.marks.get(component, 0) + rss - self._last
+        self._last = rss
+
+
+footprint = Footprint()
+
+
+def memory_report(components=None) -> dict:
+    """
+    Resident memory of the instance, what loading each marked component
+    added to it, and the approximate size of each in-memory structure in
+    components ({name: object}).
+    """
+    sizes = {}
+    for name, obj in (components or {}).items():
+        if obj is not None:
+            sizes[name] = _mb(deep_sizeof(obj))
+    return {
+        "rss_mb": _mb(rss_bytes()),
+        "peak_rss_mb": _mb(peak_rss_bytes()),
+        "baseline_mb": _mb(footprint.baseline),
+        "loaded_mb": {name: _mb(size) for name, size in footprint.marks.items()},
+        "structures_mb": sizes,
+        "tracemalloc_mb": _mb(tracemalloc.get_traced_memory()[0]) if tracemalloc.is_tracing() else None,
+    }
+
+
+def _site(frame) -> str:
+    parts = frame.filename.replace("\\", "/").split("/")
+    return f"{'/'.join(parts[-2:])}:{frame.lineno}"
+
+
+def allocation_hot_spots(start, end, limit: int = TOP_ALLOCATIONS) -> list:
+    """
+    The source lines that allocated the most between two tracemalloc
+    snapshots, as [site, kB] pairs. Snapshots held by concurrent requests
+    are not counted.
+    """
+    hot = []
+    for stat in end.compare_to(start, "lineno"):
+        if stat.size_diff > 0 and stat.traceback[0].filename != tracemalloc.__file__:
+            hot.append([_site(stat.traceback[0]), round(stat.size_diff / 1024, 1)])
+    return sorted(hot, key=lambda item: -item[1])[:limit]
+
+
+class RequestProfile:
+    """
+    Profiling state of one request, attached to its trace as the span
+    observer. With tracemalloc on, each stage records its net allocation
+    (a traced-memory delta, no snapshot), and the request's start and end
+    are marked with snapshot(trace_id, stage, phase), which takes and diffs
+    the snapshots off the request path. tracemalloc is process-wide, so
+    concurrent requests show up in each other's numbers. The CPU profile
+    covers the thread the request runs on, which on the shared event loop
+    includes interleaved requests.
+    """
+
+    def __init__(self, trace, snapshots: bool, cpu: bool, snapshot=None):
+        self.trace = trace
+        self.snapshots = snapshots
+        self.cpu = cpu
+        self.snapshot = snapshot
+        self.net_bytes = {}
+        self._open = {}
+        self._lock = threading.Lock()
+        if snapshots and snapshot is not None:
+            snapshot(trace.trace_id, "request", "start")
+        self._profiler = None
+        if cpu:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+
+    def enter(self, stage: str):
+        if not self.snapshots:
+            return
+        traced = tracemalloc.get_traced_memory()[0]
+        with self._lock:
+            # Nested or concurrent spans of the same stage keep the outermost start.
+            start, depth = self._open.get(stage, (traced, 0))
+            self._open[stage] = (start, depth + 1)
+
+    def exit(self, stage: str):
+        if not self.snapshots:
+            return
+        traced = tracemalloc.get_traced_memory()[0]
+        with self._lock:
+            start, depth = self._open.pop(stage, (None, 0))
+            if depth > 1:
+                self._open[stage] = (start, depth - 1)
+            elif start is not None:
+                self.net_bytes[stage] = self.net_bytes.get(stage, 0) + traced - start
+
+    def finish(self):
+        """
+        Adds the net allocation per stage to the trace, marks the end of the
+        request for snapshot analysis and logs the CPU profile.
+        """
+        if self.net_bytes:
+            self.trace.set("alloc_kb", {stage: round(size / 1024, 1) for stage, size in self.net_bytes.items()})
+        if self.snapshots and self.snapshot is not None:
+            self.snapshot(self.trace.trace_id, "request", "end")
+        if self._profiler is not None:
+            self._profiler.disable()
+            self.trace.set("cpu_profiled", True)
+            self._log_profile()
+
+    def _log_profile(self):
+        stats = pstats.Stats(self._profiler)
+        rows = sorted(stats.stats.items(), key=lambda item: -item[1][3])[:TOP_FUNCTIONS]
+        functions = [{"fn": f"{'/'.join(file.split('/')[-2:])}:{line}({name})", "calls": calls,
+                      "tottime_ms": round(tottime * 1000, 2), "cumtime_ms": round(cumtime * 1000, 2)}
+                     for (file, line, name), (_, calls, tottime, cumtime, _) in rows]
+        record = {"trace_id": self.trace.trace_id, "functions": functions}
+        if PROFILE_DIR:
+            path = os.path.join(PROFILE_DIR, f"rag-{self.trace.trace_id}.prof")
+            try:
+                os.makedirs(PROFILE_DIR, exist_ok=True)
+                stats.dump_stats(path)
+                record["path"] = path
+            except OSError as e:
+                logging.warning("Writing profile %s failed: %s", path, str(e))
+        profile_logger.info(json.dumps(record))
+
+
+class LocalSettingsBackend:
+    """
+    In-memory settings overrides, for tests and offline runs.
+    """
+
+    def __init__(self, values=None):
+        self.values = dict(values or {})
+
+    def load(self) -> dict:
+        return dict(self.values)
+
+
+class FirestoreSettingsBackend:
+    """
+    Settings overrides in one Firestore document (runtime_config/profiling by default).
+    """
+
+    def __init__(self, db, collection: str = "runtime_config", document: str = "profiling"):
+        self.db = db
+        self.collection = collection
+        self.document = document
+
+    def load(self) -> dict:
+        snapshot = self.db.collection(self.collection).document(self.document).get()
+        return (snapshot.to_dict() or {}) if snapshot.exists else {}
+
+
+class Profiler:
+    """
+    Decides per request whether to take tracemalloc stage snapshots or a CPU
+    profile, and logs a memory_report every poll while that is enabled.
+    Settings are re-read, and request snapshots taken and diffed into
+    allocation hot spots (logged on "rag.memory" with the trace ID), on
+    background threads; requests never wait on either. The snapshots are
+    taken when the analysis thread gets to them, so they bracket the request
+    only approximately. tracemalloc_rate is a debug setting: while it is
+    above 0, tracemalloc traces every allocation in the process. components
+    is called for the {name: object} structures to size.
+    """
+
+    def __init__(self, backend=None, poll_interval: float = DEFAULT_POLL_SECONDS, components=None):
+        self.backend = backend
+        self.poll_interval = poll_interval
+        self.components = components
+        self.settings = dict(ENV_SETTINGS)
+        self._checked_at = None
+        self._refreshing = False
+        self._profiled_token = ""
+        self._cpu_active = False
+        self._lock = threading.Lock()
+        self._analysis = queue.Queue(maxsize=ANALYSIS_QUEUE_SIZE)
+        self._analyzer = None
+
+    def refresh(self):
+        """
+        Re-reads the settings, starts or stops tracemalloc to match, and logs
+        a memory report if enabled.
+        """
+        try:
+            if self.backend is not None:
+                overrides = self.backend.load()
+                self.settings = {key: overrides.get(key, default) for key, default in ENV_SETTINGS.items()}
+            rate = float(self.settings["tracemalloc_rate"] or 0)
+            if rate > 0 and not tracemalloc.is_tracing():
+                tracemalloc.start(int(self.settings["tracemalloc_frames"] or 1))
+                logging.info("tracemalloc started (sampling %.2f of requests).", rate)
+            elif rate <= 0 and tracemalloc.is_tracing():
+                tracemalloc.stop()
+                logging.info("tracemalloc stopped.")
+            if self.settings["memory_report"]:
+                self.log_memory_report()
+        except Exception as e:
+            logging.warning("Refreshing profiling settings failed: %s", str(e))
+        finally:
+            self._refreshing = False
+
+    def log_memory_report(self) -> dict:
+        report = memory_report(self.components() if self.components else None)
+        memory_logger.info(json.dumps(report))
+        return report
+
+    def _maybe_refresh(self):
+        now = time.monotonic()
+        # The first request starts the first refresh too; until it finishes, the env settings apply.
+        if self._checked_at is not None and now - self._checked_at < self.poll_interval:
+            return
+        with self._lock:
+            start = not self._refreshing
+            self._refreshing = True
+            self._checked_at = now
+        if start:
+            threading.Thread(target=self.refresh, name="profiling-refresh", daemon=True).start()
+
+    def begin(self, trace, user_id: str = None):
+        """
+        Attaches a RequestProfile to the request's trace if it is sampled for
+        memory snapshots or due for a CPU profile, and returns it (else None).
+        """
+        self._maybe_refresh()
+        token = self.settings["profile_request"]
+        cpu = False
+        if token and token != self._profiled_token and (
+                not self.settings["profile_user"] or self.settings["profile_user"] == user_id):
+            with self._lock:
+                # Only one profiler can be active per process.
+                if token != self._profiled_token and not self._cpu_active:
+                    self._profiled_token = token
+                    self._cpu_active = cpu = True
+        snapshots = tracemalloc.is_tracing() and random.random() < float(self.settings["tracemalloc_rate"] or 0)
+        if not (cpu or snapshots):
+            return None
+        try:
+            profile = RequestProfile(trace, snapshots, cpu, snapshot=self._queue_snapshot)
+        except ValueError as e:
+            # Another profiler (a debugger, coverage) already holds the hook.
+            logging.warning("Could not start the request profile: %s", str(e))
+            self._cpu_active = False
+            return None
+        trace.sampled = True
+        trace.observer = profile
+        return profile
+
+    def _queue_snapshot(self, trace_id: str, stage: str, phase: str):
+        with self._lock:
+            if self._analyzer is None:
+                self._analyzer = threading.Thread(target=self._analyze, name="profiling-analysis", daemon=True)
+                self._analyzer.start()
+        try:
+            self._analysis.put_nowait((trace_id, stage, phase))
+        except queue.Full:
+            pass
+
+    def _analyze(self):
+        started = {}
+        while True:
+            trace_id, stage, phase = self._analysis.get()
+            try:
+                if not tracemalloc.is_tracing():
+                    started.clear()
+                elif phase == "start":
+                    started[trace_id, stage] = tracemalloc.take_snapshot()
+                    if len(started) > ANALYSIS_QUEUE_SIZE:
+                        # Its end mark was dropped; do not hold the snapshot forever.
+                        started.pop(next(iter(started)))
+                elif (trace_id, stage) in started:
+                    hot_spots = allocation_hot_spots(started.pop((trace_id, stage)), tracemalloc.take_snapshot())
+                    memory_logger.info(json.dumps({"trace_id": trace_id, "stage": stage, "hot_spots": hot_spots}))
+            except Exception as e:
+                logging.warning("Allocation analysis failed: %s", str(e))
+            finally:
+                self._analysis.task_done()
+
+    def end(self, profile):
+        if profile is None:
+            return
+        try:
+            profile.finish()
+        except Exception as e:
+            logging.warning("Finishing the request profile failed: %s", str(e))
+        finally:
+            if profile.cpu:
+                self._cpu_active = False
@@ -0,0 +1,176 @@
+import functools
+import logging
+import re
+
+from tokens import estimate_tokens, truncate_to_tokens
+
+# Total prompt budget and the caps for the sections that are not course context.
+# Whatever the summary, history and query leave unused goes to the courses.
+PROMPT_TOKEN_BUDGET = 3500
+SUMMARY_TOKEN_BUDGET = 350
+HISTORY_TOKEN_BUDGET = 900
+QUERY_TOKEN_BUDGET = 250
+
+# Description budget per relevance tier. The most relevant third of the documents
+# keep (almost) their full description, the rest are cut down to their lead.
+DESCRIPTION_TIERS = (200, 80, 30)
+
+# Documents whose descriptions share this much of their word shingles are treated
+# as the same course (cross-listings, lab/lecture pairs with copied text).
+NEAR_DUPLICATE_THRESHOLD = 0.8
+
+UNITS_PATTERN = re.compile(r'\(\d+(?:-\d+)?\s+units?\)')
+
+INSTRUCTIONS = "Respond to the student's current query in a helpful, conversational manner."
+
+
+def _shingles(text: str, size: int = 3) -> frozenset:
+    words = re.findall(r'\w+', text.lower())
+    if len(words) < size:
+        return frozenset([" ".join(words)]) if words else frozenset()
+    return frozenset(" ".join(words[i:i + size]) for i in range(len(words) - size + 1))
+
+
+def dedupe_documents(relevant_docs):
+    """
+    Drops repeated courses and near-duplicate descriptions, keeping the
+    highest scoring copy. relevant_docs is a list of (score, doc_item) tuples.
+    """
+    kept = []
+    seen_codes = set()
+    kept_shingles = []
+    for score, doc_item in sorted(relevant_docs, key=lambda pair: pair[0], reverse=True):
+        code = (doc_item.get('tag'), doc_item.get('number'))
+        if code in seen_codes:
+            continue
+        shingles = _shingles(doc_item.get('description', ''))
+        if shingles and any(
+            len(shingles & other) / len(shingles | other) >= NEAR_DUPLICATE_THRESHOLD
+            for other in kept_shingles
+        ):
+            continue
+        seen_codes.add(code)
+        kept_shingles.append(shingles)
+        kept.append((score, doc_item))
+    return kept
+
+
+def compress_description(description: str, max_tokens: int) -> str:
+    """
+    Shortens a course description to its leading sentences while keeping the units note.
+    """
+    description = (description or "").strip()
+    if estimate_tokens(description) <= max_tokens:
+        return description
+    units = UNITS_PATTERN.search(description)
+    units_text = f" {units.group(0)}" if units else ""
+    body = UNITS_PATTERN.sub("", description).strip()
+
+    compressed = ""
+    for sentence in re.split(r'(?<=[.!?])\s+', body):
+        candidate = f"{compressed} {sentence}".strip()
+        if estimate_tokens(candidate + units_text) > max_tokens:
+            break
+        compressed = candidate
+    if not compressed:
+        compressed = truncate_to_tokens(body, max_tokens - estimate_tokens(units_text))
+    return compressed + units_text
+
+
+@functools.lru_cache(maxsize=4096)
+def render_course(tag, number, course, department, description, pre_reqs, description_tokens,
+                  aliases: str = "") -> str:
+    """
+    Renders one course for the prompt. Cached per course and description tier,
+    so popular courses are not re-compressed on every request.
+    """
+    also_listed = f"Also listed as: {aliases}\n" if aliases else ""
+    return (
+        f"Course: {tag}-{number} {course}\n"
+        f"{also_listed}"
+        f"Department: {department}\n"
+        f"Description: {compress_description(description, description_tokens)}\n"
+        f"Pre-requisites: {pre_reqs}"
+    )
+
+
+def _description_tier(rank: int, count: int) -> int:
+    tier = min(rank * len(DESCRIPTION_TIERS) // max(count, 1), len(DESCRIPTION_TIERS) - 1)
+    return DESCRIPTION_TIERS[tier]
+
+
+def _fit_tail(text: str, max_tokens: int) -> str:
+    """
+    Keeps the end of a multi-line section (the most recent turns) within max_tokens.
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    lines = text.strip("\n").split("\n")
+    header, turns = lines[0], lines[1:]
+    kept = []
+    used = estimate_tokens(header)
+    for line in reversed(turns):
+        line = truncate_to_tokens(line, max_tokens // 2)
+        cost = estimate_tokens(line) + 1
+        if used + cost > max_tokens:
+            break
+        kept.append(line)
+        used += cost
+    if not kept:
+        return ""
+    return "\n\n" + header + "\n" + "\n".join(reversed(kept)) + "\n"
+
+
+def build_response_prompt(query: str, relevant_docs, summary: str = "", history: str = "",
+                          budget: int = PROMPT_TOKEN_BUDGET):
+    """
+    Assembles the response prompt within a fixed token budget.
+    Returns the prompt and a dict with the token count of each section.
+    """
+    summary_text = ""
+    if summary:
+        summary_text = "CONVERSATION SUMMARY: " + truncate_to_tokens(summary, SUMMARY_TOKEN_BUDGET) + "\n\n"
+    history_text = _fit_tail(history, HISTORY_TOKEN_BUDGET) if history else ""
+    query_text = truncate_to_tokens(query, QUERY_TOKEN_BUDGET)
+    footer = f"\n\nCURRENT QUERY: {query_text}\n\n{INSTRUCTIONS}"
+    header = "RELEVANT COURSE INFORMATION:\n\n"
+
+    course_budget = budget - sum(estimate_tokens(part) for part in (summary_text, history_text, footer, header))
+    docs = dedupe_documents(relevant_docs)
+    rendered = []
+    used = 0
+    for rank, (score, doc_item) in enumerate(docs):
+        text = render_course(
+            doc_item.get('tag', 'N/A'),
+            doc_item.get('number', 'N/A'),
+            doc_item.get('course', 'N/A'),
+            doc_item.get('department', 'N/A'),
+            doc_item.get('description', ''),
+            doc_item.get('pre_reqs', ''),
+            _description_tier(rank, len(docs)),
+            doc_item.get('aliases', ''),
+        )
+        cost = estimate_tokens(text) + 1
+        if used + cost > course_budget:
+            # A shorter lower-ranked course may still fit.
+            continue
+        rendered.append(text)
+        used += cost
+
+    courses_text = header + "\n\n".join(rendered)
+    prompt = f"{summary_text}{courses_text}{history_text}{footer}"
+    sections = {
+        "summary": estimate_tokens(summary_text),
+        "courses": estimate_tokens(courses_text),
+        "history": estimate_tokens(history_text),
+        "query": estimate_tokens(footer),
+        "total": estimate_tokens(prompt),
+        "docs_in": len(relevant_docs),
+        "docs_used": len(rendered),
+    }
+    logging.info(
+        "Prompt tokens: summary=%d courses=%d history=%d query=%d total=%d (docs %d/%d)",
+        sections["summary"], sections["courses"], sections["history"], sections["query"],
+        sections["total"], sections["docs_used"], sections["docs_in"],
+    )
+    return prompt, sections
@@ -0,0 +1,207 @@
+import asyncio
+import collections
+import hashlib
+import logging
+import re
+import threading
+import time
+
+from tracing import incr
+
+STATS_LOG_INTERVAL = 100  # Log cache stats every this many calls
+
+
+def normalize_query(text: str) -> str:
+    """
+    Normalizes query text for cache keys: case, whitespace and trailing punctuation.
+    """
+    return re.sub(r'[\s?!.]+$', '', " ".join(text.lower().split()))
+
+
+class FirestoreEmbeddingTier:
+    """
+    Persistent second-level cache shared by all instances, stored in the
+    `query_embeddings` collection. Keys hash the model name and the normalized
+    query so vectors from different models never mix.
+    """
+
+    def __init__(self, db, model_name: str, collection: str = "query_embeddings"):
+        self.db = db
+        self.model_name = model_name
+        self.collection = collection
+
+    def _ref(self, key: str):
+        digest = hashlib.sha256(f"{self.model_name}\n{key}".encode("utf-8")).hexdigest()[:40]
+        return self.db.collection(self.collection).document(digest)
+
+    def get_many(self, keys) -> dict:
+        refs = {self._ref(key).path: key for key in keys}
+        found = {}
+        for snapshot in self.db.get_all([self._ref(key) for key in keys]):
+            if snapshot.exists:
+                found[refs[snapshot.reference.path]] = snapshot.to_dict()["embedding"]
+        return found
+
+    def put_many(self, items: dict):
+        batch = self.db.batch()
+        for key, embedding in items.items():
+            batch.set(self._ref(key), {"query": key, "model": self.model_name, "embedding": list(embedding)})
+        batch.commit()
+
+
+class CachedQueryEmbedder:
+    """
+    Per-instance LRU cache (plus an optional persistent tier) in front of an
+    embeddings client. Misses from one call are embedded in a single batched
+    request. Exposes embed_query/embed_documents so it can stand in for the
+    wrapped client.
+    """
+
+    def __init__(self, embedder, max_entries: int = 2048, persistent=None):
+        self.embedder = embedder
+        self.max_entries = max_entries
+        self.persistent = persistent
+        self._cache = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+        self.batches = 0
+        self.miss_seconds = 0.0
+        self._calls = 0
+
+    def embed_query(self, text: str):
+        return self.embed_queries([text])[0]
+
+    def embed_documents(self, texts):
+        return self.embed_queries(texts)
+
+    def embed_queries(self, texts) -> list:
+        """
+        Returns one embedding per text, in order, hitting the remote model at
+        most once for all texts that are not cached.
+        """
+        keys, found, missing = self._lookup(texts)
+        if missing and self.persistent:
+            missing = self._take_stored(missing, found, self._get_persistent(missing))
+        if missing:
+            originals = self._originals(keys, texts, missing)
+            start = time.perf_counter()
+            vectors = self.embedder.embed_documents(originals)
+            fresh = self._take_fresh(missing, vectors, found, time.perf_counter() - start)
+            if self.persistent:
+                self._put_persistent(fresh)
+        return self._finish(keys, found, missing)
+
+    async def aembed_queries(self, texts) -> list:
+        """
+        embed_queries for the async pipeline. The wrapped embedder must provide
+        aembed_documents; the persistent tier is synchronous and runs in a thread.
+        """
+        keys, found, missing = self._lookup(texts)
+        if missing and self.persistent:
+            stored = await asyncio.to_thread(self._get_persistent, missing)
+            missing = self._take_stored(missing, found, stored)
+        if missing:
+            originals = self._originals(keys, texts, missing)
+            start = time.perf_counter()
+            vectors = await self.embedder.aembed_documents(originals)
+            fresh = self._take_fresh(missing, vectors, found, time.perf_counter() - start)
+            if self.persistent:
+                await asyncio.to_thread(self._put_persistent, fresh)
+        return self._finish(keys, found, missing)
+
+    async def aembed_query(self, text: str):
+        return (await self.aembed_queries([text]))[0]
+
+    def _lookup(self, texts):
+        keys = [normalize_query(text) for text in texts]
+        found = {}
+        with self._lock:
+            for key in keys:
+                if key in self._cache and key not in found:
+                    self._cache.move_to_end(key)
+                    found[key] = self._cache[key]
+                    self.hits += 1
+        missing = list(dict.fromkeys(key for key in keys if key not in found))
+        return keys, found, missing
+
+    def _get_persistent(self, missing) -> dict:
+        try:
+            return self.persistent.get_many(missing)
+        except Exception as e:
+            logging.warning("Query embedding cache lookup failed: %s", str(e))
+            return {}
+
+    def _put_persistent(self, fresh: dict):
+        try:
+            self.persistent.put_many(fresh)
+        except Exception as e:
+            logging.warning("Query embedding cache write failed: %s", str(e))
+
+    def _take_stored(self, missing, found: dict, stored: dict) -> list:
+        found.update(stored)
+        self._remember(stored)
+        with self._lock:
+            self.persistent_hits += len(stored)
+        return [key for key in missing if key not in stored]
+
+    @staticmethod
+    def _originals(keys, texts, missing) -> list:
+        # Embed the original text of the first occurrence of each key.
+        originals = {}
+        for key, text in zip(keys, texts):
+            originals.setdefault(key, text)
+        return [originals[key] for key in missing]
+
+    def _take_fresh(self, missing, vectors, found: dict, elapsed: float) -> dict:
+        fresh = dict(zip(missing, vectors))
+        found.update(fresh)
+        self._remember(fresh)
+        with self._lock:
+            self.misses += len(missing)
+            self.batches += 1
+            self.miss_seconds += elapsed
+        return fresh
+
+    def _finish(self, keys, found: dict, missing) -> list:
+        incr("query_embedding_cache_hits", len(keys) - len(missing))
+        incr("query_embedding_cache_misses", len(missing))
+        self._maybe_log_stats()
+        return [found[key] for key in keys]
+
+    def _remember(self, items: dict):
+        with self._lock:
+            for key, embedding in items.items():
+                self._cache[key] = embedding
+                self._cache.move_to_end(key)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.persistent_hits + self.misses
+            average_miss_ms = 1000 * self.miss_seconds / self.batches if self.batches else 0.0
+            return {
+                "lookups": lookups,
+                "hits": self.hits,
+                "persistent_hits": self.persistent_hits,
+                "misses": self.misses,
+                "hit_ratio": (self.hits + self.persistent_hits) / lookups if lookups else 0.0,
+                "batches": self.batches,
+                "average_miss_ms": average_miss_ms,
+                # Every in-memory hit skipped one remote embedding round trip.
+                "saved_ms": self.hits * average_miss_ms,
+                "size": len(self._cache),
+            }
+
+    def _maybe_log_stats(self):
+        with self._lock:
+            self._calls += 1
+            due = self._calls % STATS_LOG_INTERVAL == 0
+        if due:
+            stats = self.stats()
+            logging.info(
+                "Query embedding cache: %d lookups, hit ratio %.2f, %d batches, ~%.0f ms saved.",
+                stats["lookups"], stats["hit_ratio"], stats["batches"], stats["saved_ms"],
+            )
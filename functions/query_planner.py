@@ -0,0 +1,137 @@
+import asyncio
+import logging
+import math
+import re
+
+from retrieval import COURSE_CODE_PATTERN
+from shadow import query_key
+from tracing import span
+
+MAX_SUBQUERIES = 4
+# Documents reserved for each named course; the main query gets the rest.
+COURSE_QUOTA = 2
+# Signals that a question without course codes may still be compound.
+COMPOUND_PATTERN = re.compile(r'\b(compare|versus|vs\.?|as well as|and also|difference between)\b|;|\?.+\?',
+                              re.IGNORECASE)
+
+
+class SubQuery:
+    """
+    One retrieval in a query plan. course_id is set for sub-queries about a
+    specific course, which must be present in the merged context.
+    """
+
+    def __init__(self, text: str, quota: int, course_id: str = None):
+        self.text = text
+        self.quota = quota
+        self.course_id = course_id
+
+    def __repr__(self):
+        return f"SubQuery({self.text!r}, quota={self.quota}, course_id={self.course_id!r})"
+
+
+def detect_course_codes(query: str, catalog) -> list:
+    """
+    Returns the distinct catalog course IDs named in the query, in order.
+    Alias codes of consolidated courses are returned as the canonical ID.
+    """
+    codes = []
+    for match in COURSE_CODE_PATTERN.finditer(query):
+        courses = catalog.lookup(f"{match.group(1).upper()} {match.group(2).upper()}")
+        if courses and courses[0]["course_id"] not in codes:
+            codes.append(courses[0]["course_id"])
+    return codes
+
+
+async def plan_query(query: str, search_query: str, catalog=None, llm_split=None, top_k: int = 10) -> list:
+    """
+    Splits a compound question into sub-queries. Named courses are found with
+    the rule-based code detector; only questions that look compound but name
+    fewer than two courses go to the LLM splitter (a coroutine function).
+    search_query is the (context-enhanced) query used for the main retrieval.
+    """
+    codes = detect_course_codes(query, catalog)[:MAX_SUBQUERIES - 1] if catalog else []
+    if len(codes) >= 2:
+        quota = min(COURSE_QUOTA, max(top_k // (len(codes) + 1), 1))
+        plan = [SubQuery(search_query, top_k - quota * len(codes))]
+        for course_id in codes:
+            course = catalog.lookup(course_id)[0]
+            plan.append(SubQuery(f"{course_id} {course['course']}", quota, course_id))
+        return plan
+
+    if llm_split and COMPOUND_PATTERN.search(query):
+        try:
+            parts = [part for part in await llm_split(query) if part.strip()][:MAX_SUBQUERIES]
+        except Exception as e:
+            logging.error("Error splitting query: %s", str(e))
+            parts = []
+        if len(parts) >= 2:
+            quota = math.ceil(top_k / len(parts))
+            return [SubQuery(part.strip(), quota) for part in parts]
+
+    return [SubQuery(search_query, top_k)]
+
+
+def merge_results(plan, results, top_k: int, catalog=None) -> list:
+    """
+    Merges per-sub-query results into one deduplicated context. Each sub-query
+    first contributes up to its quota, then remaining slots go to the best
+    leftovers by score. Named courses missing from every result list are added
+    straight from the catalog.
+    """
+    merged = []
+    seen = set()
+    leftovers = []
+    for subquery, docs in zip(plan, results):
+        taken = 0
+        for score, doc_item in docs:
+            key = (doc_item.get('tag'), doc_item.get('number'))
+            if key in seen:
+                continue
+            if taken < subquery.quota:
+                seen.add(key)
+                merged.append((score, doc_item))
+                taken += 1
+            else:
+                leftovers.append((score, doc_item))
+
+    for subquery in plan:
+        if subquery.course_id and catalog:
+            tag, number = subquery.course_id.split(" ", 1)
+            if (tag, number) not in seen:
+                seen.add((tag, number))
+                merged.insert(0, (1.0, catalog.doc_item(catalog.lookup(subquery.course_id)[0])))
+
+    for score, doc_item in sorted(leftovers, key=lambda pair: pair[0], reverse=True):
+        if len(merged) >= top_k:
+            break
+        key = (doc_item.get('tag'), doc_item.get('number'))
+        if key not in seen:
+            seen.add(key)
+            merged.append((score, doc_item))
+    return merged[:top_k]
+
+
+async def run_plan(plan, retrieve_fn, embed_fn, top_k: int = 10, catalog=None) -> list:
+    """
+    Embeds every sub-query in one batch, runs the retrievals concurrently and
+    merges them. Both callables are coroutine functions; retrieve_fn(text,
+    top_k, query_vector) returns (score, doc_item) pairs.
+    """
+    with span("embed_query"):
+        vectors = await embed_fn([subquery.text for subquery in plan])
+    outcomes = await asyncio.gather(
+        *(retrieve_fn(subquery.text, subquery.quota + 1, vector) for subquery, vector in zip(plan, vectors)),
+        return_exceptions=True,
+    )
+    results = []
+    for subquery, outcome in zip(plan, outcomes):
+        if isinstance(outcome, Exception):
+            logging.error("Sub-query %s failed: %s", query_key(subquery.text), str(outcome))
+            outcome = []
+        results.append(outcome)
+    if not any(results):
+        raise RuntimeError("Every sub-query retrieval failed")
+    merged = merge_results(plan, results, top_k, catalog)
+    logging.info("Merged %d sub-queries into %d documents.", len(plan), len(merged))
+    return merged
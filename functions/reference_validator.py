@@ -0,0 +1,182 @@
+import os
+import re
+import weakref
+
+# Link target for a course, the Course Explorer searching for it; {tag} and
+# {number} are filled in. Empty disables links.
+COURSE_LINK_TEMPLATE = os.getenv("COURSE_LINK_TEMPLATE", "/explorer?course={tag}-{number}")
+# Titles shorter than this many words ("Seminar", "Calculus") are too generic to link on their own.
+MIN_TITLE_WORDS = 2
+# Titles are only recognized in bold (**Software Engineering**): in plain prose
+# a two-word title is usually just the subject ("Software Engineering is fun").
+UNKNOWN_NOTE = " _(not found in the course catalog)_"
+
+# A reference in the format the system prompt asks for: **TAG-NUMBER Name**.
+BOLD_REFERENCE = r'\*\*(?P<btag>[A-Z]{4})[ -](?P<bnum>\d{1,3}[A-Z]{0,2}(?:/\d{1,3}[A-Z]{0,2})?)\b(?P<btitle>[^*\n]*)\*\*'
+# A bare code such as "CSEN 174", "CSEN-174" or a combined "ANTH 11A/12A".
+BARE_CODE = r'\b(?P<tag>[A-Z]{4})[ -]?(?P<num>\d{1,3}[A-Z]{0,2}(?:/\d{1,3}[A-Z]{0,2})?)\b'
+
+_matchers = weakref.WeakKeyDictionary()
+
+
+def _normalize_title(title: str) -> str:
+    return " ".join(re.findall(r'\w+', title.lower()))
+
+
+def trie_pattern(words) -> str:
+    """
+    Compiles a list of literal strings into one regex alternation shaped
+    like a trie, so matching costs one walk down shared prefixes instead of
+    trying every string at every position (the Aho-Corasick idea, in re).
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = True
+
+    def render(node):
+        end = node.pop("", False)
+        branches = [re.escape(char) + render(child) for char, child in sorted(node.items())]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        return f"(?:{body})?" if end else body
+
+    return render(trie)
+
+
+class ReferenceMatcher:
+    """
+    Finds course references in generated text in one pass over it: bold
+    **TAG-NUMBER Name** references, bare codes, and distinctive catalog
+    titles in bold, all alternatives of a single compiled pattern.
+    """
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+        titles = {}
+        for course in catalog.courses:
+            titles.setdefault(course["course"], set()).add(course["course_id"])
+        # Only titles that name exactly one course and are specific enough to mean it.
+        self.title_ids = {title: next(iter(ids)) for title, ids in titles.items()
+                          if len(ids) == 1 and len(title.split()) >= MIN_TITLE_WORDS}
+        # Each half of a combined number ("ANTH 11A" of "ANTH 11A/12A") -> the catalog course.
+        self.part_ids = {}
+        for course in catalog.courses:
+            tag, number = course["course_id"].split(" ", 1)
+            if "/" in number:
+                for part in number.split("/"):
+                    self.part_ids.setdefault(f"{tag} {part}", course["course_id"])
+        alternatives = [BOLD_REFERENCE, BARE_CODE]
+        if self.title_ids:
+            alternatives.append(r'\*\*(?P<title>' + trie_pattern(sorted(self.title_ids)) + r')\*\*')
+        self.pattern = re.compile("|".join(alternatives))
+
+    def resolve(self, tag: str, number: str):
+        """
+        The catalog course ID a cited code refers to, or None if there is none.
+        """
+        course_id = f"{tag} {number}"
+        if self.catalog.lookup(course_id):
+            return course_id
+        return self.part_ids.get(course_id)
+
+    def title_matches(self, course_id: str, title: str) -> bool:
+        """
+        Whether a cited title agrees with the catalog (either one may be abbreviated).
+        """
+        cited = _normalize_title(title)
+        if not cited:
+            return True
+        return any(cited in _normalize_title(course["course"]) or _normalize_title(course["course"]) in cited
+                   for course in self.catalog.lookup(course_id))
+
+
+def get_matcher(catalog) -> ReferenceMatcher:
+    """
+    The matcher for a catalog, compiled once and dropped with the catalog
+    (so a swapped-out snapshot does not keep its matcher alive).
+    """
+    matcher = _matchers.get(catalog)
+    if matcher is None:
+        matcher = _matchers[catalog] = ReferenceMatcher(catalog)
+    return matcher
+
+
+def course_link(tag: str, number: str) -> str:
+    return COURSE_LINK_TEMPLATE.format(tag=tag, number=number) if COURSE_LINK_TEMPLATE else ""
+
+
+def validate_references(text: str, catalog, retrieved_ids=None):
+    """
+    Checks the courses cited in a response against the catalog and the
+    retrieved context. Known courses get a link; codes not in the catalog
+    are annotated in the text. retrieved_ids=None skips the context check.
+    Returns the annotated text and a report:
+      references   - distinct course IDs cited
+      unknown      - cited codes that are not in the catalog
+      unretrieved  - catalog courses cited that were not in the context
+      mismatched   - bold references whose title disagrees with the catalog
+    """
+    matcher = get_matcher(catalog)
+    report = {"references": [], "unknown": [], "unretrieved": [], "mismatched": []}
+    out = []
+    last = 0
+    previous = (None, -1)  # Course ID and end of the last reference, to skip "CSEN 174 <its title>"
+
+    def flag(kind, course_id):
+        if course_id not in report[kind]:
+            report[kind].append(course_id)
+
+    def cite(course_id):
+        flag("references", course_id)
+        if retrieved_ids is not None and course_id not in retrieved_ids:
+            flag("unretrieved", course_id)
+
+    for match in matcher.pattern.finditer(text):
+        kind = match.lastgroup
+        replacement = None
+        if match.group("btag"):
+            tag, number = match.group("btag"), match.group("bnum")
+            course_id = matcher.resolve(tag, number)
+            label = match.group(0)[2:-2]
+            if course_id:
+                cite(course_id)
+                if not matcher.title_matches(course_id, match.group("btitle")):
+                    flag("mismatched", course_id)
+                link = course_link(*course_id.split(" ", 1))
+                replacement = f"**[{label}]({link})**" if link else None
+            else:
+                course_id = f"{tag} {number}"
+                flag("unknown", course_id)
+                replacement = match.group(0) + UNKNOWN_NOTE
+            previous = (course_id, match.end())
+        elif match.group("tag"):
+            tag, number = match.group("tag"), match.group("num")
+            course_id = matcher.resolve(tag, number)
+            if course_id:
+                cite(course_id)
+                link = course_link(*course_id.split(" ", 1))
+                replacement = f"[{match.group(0)}]({link})" if link else None
+            elif tag in catalog.tags:
+                course_id = f"{tag} {number}"
+                # A real subject with a course number that does not exist.
+                flag("unknown", course_id)
+                replacement = match.group(0) + UNKNOWN_NOTE
+            previous = (course_id, match.end())
+        elif kind == "title":
+            course_id = matcher.title_ids[match.group("title")]
+            if previous[0] == course_id and not text[previous[1]:match.start()].strip(" :-,"):
+                continue
+            cite(course_id)
+            tag, number = course_id.split(" ", 1)
+            link = course_link(tag, number)
+            replacement = f"**[{match.group('title')}]({link})**" if link else None
+        if replacement is not None:
+            out.append(text[last:match.start()])
+            out.append(replacement)
+            last = match.end()
+    out.append(text[last:])
+    return "".join(out), report
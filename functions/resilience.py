@@ -0,0 +1,299 @@
+import asyncio
+import collections
+import contextvars
+import logging
+import os
+import threading
+import time
+
+from tracing import incr
+
+# Overall time a rag request may take; each upstream call gets a share of it.
+DEFAULT_BUDGET_SECONDS = float(os.getenv("RAG_REQUEST_BUDGET_S", "30"))
+# Upstream calls observed before hedging starts; until then p95 is a guess.
+HEDGE_MIN_SAMPLES = 20
+LATENCY_WINDOW = 200
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+_deadline = contextvars.ContextVar("rag_deadline", default=None)
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+class CircuitOpenError(RuntimeError):
+    pass
+
+
+class Deadline:
+    def __init__(self, budget_seconds: float):
+        self.budget_seconds = budget_seconds
+        self.expires = time.monotonic() + budget_seconds
+
+    def remaining(self) -> float:
+        return self.expires - time.monotonic()
+
+
+def start_deadline(budget_seconds: float = None) -> Deadline:
+    """
+    Starts the overall budget for the current request.
+    """
+    deadline = Deadline(DEFAULT_BUDGET_SECONDS if budget_seconds is None else budget_seconds)
+    _deadline.set(deadline)
+    return deadline
+
+
+def stage_timeout(budget_share: float, reserve_seconds: float = 0.0) -> float:
+    """
+    Timeout for one stage: its share of the request budget, cut short so that
+    reserve_seconds remain for the stages after it.
+    """
+    deadline = _deadline.get()
+    if deadline is None:
+        return budget_share * DEFAULT_BUDGET_SECONDS
+    return min(budget_share * deadline.budget_seconds, deadline.remaining() - reserve_seconds)
+
+
+class LatencyWindow:
+    """
+    The most recent call latencies of one upstream, for hedging thresholds.
+    """
+
+    def __init__(self, size: int = LATENCY_WINDOW):
+        self._samples = collections.deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, elapsed_ms: float):
+        with self._lock:
+            self._samples.append(elapsed_ms)
+
+    def percentile(self, pct: float, min_samples: int = HEDGE_MIN_SAMPLES):
+        with self._lock:
+            if len(self._samples) < min_samples:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(int(len(ordered) * pct / 100), len(ordered) - 1)]
+
+
+class CircuitBreaker:
+    """
+    Opens when, over the last window calls, the failure rate or slow-call rate
+    reaches its threshold. While open, calls are rejected; after open_seconds
+    one probe call is let through (half open) and its outcome closes or
+    re-opens the circuit.
+    """
+
+    def __init__(self, name: str, window: int = 20, min_calls: int = 10, failure_rate: float = 0.5,
+                 slow_call_ms: float = None, slow_rate: float = 0.8, open_seconds: float = 30.0):
+        self.name = name
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_ms = slow_call_ms
+        self.slow_rate = slow_rate
+        self.open_seconds = open_seconds
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self.rejected = 0
+        self._calls = collections.deque(maxlen=window)
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        if self.state == OPEN and time.monotonic() - self.opened_at >= self.open_seconds:
+            self.state = HALF_OPEN
+            self._probing = False
+
+    def available(self) -> bool:
+        """
+        Whether a call would currently be let through, without claiming the
+        half-open probe.
+        """
+        with self._lock:
+            self._refresh()
+            return self.state == CLOSED or (self.state == HALF_OPEN and not self._probing)
+
+    def allow(self) -> bool:
+        with self._lock:
+            self._refresh()
+            if self.state == CLOSED:
+                return True
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            self.rejected += 1
+            return False
+
+    def release_probe(self):
+        with self._lock:
+            self._probing = False
+
+    def record(self, ok: bool, elapsed_ms: float):
+        slow = self.slow_call_ms is not None and elapsed_ms >= self.slow_call_ms
+        with self._lock:
+            if self.state == HALF_OPEN:
+                if ok and not slow:
+                    self._transition(CLOSED)
+                    self._calls.clear()
+                else:
+                    self._transition(OPEN)
+                return
+            self._calls.append((ok, slow))
+            if self.state == CLOSED and len(self._calls) >= self.min_calls:
+                failures = sum(1 for call_ok, _ in self._calls if not call_ok) / len(self._calls)
+                slow_calls = sum(1 for _, call_slow in self._calls if call_slow) / len(self._calls)
+                if failures >= self.failure_rate or slow_calls >= self.slow_rate:
+                    self._transition(OPEN)
+
+    def _transition(self, state: str):
+        if state == OPEN:
+            self.opened_at = time.monotonic()
+            self.times_opened += 1
+            self._calls.clear()
+        self._probing = False
+        logging.warning("Circuit %s: %s -> %s.", self.name, self.state, state)
+        self.state = state
+
+    def metrics(self) -> dict:
+        with self._lock:
+            self._refresh()
+            calls = len(self._calls)
+            return {
+                "state": self.state,
+                "window_calls": calls,
+                "failure_rate": sum(1 for ok, _ in self._calls if not ok) / calls if calls else 0.0,
+                "slow_rate": sum(1 for _, slow in self._calls if slow) / calls if calls else 0.0,
+                "times_opened": self.times_opened,
+                "rejected": self.rejected,
+            }
+
+
+class Upstream:
+    """
+    Guards calls to one remote dependency with a stage deadline (budget_share
+    of the request budget), an optional hedged duplicate sent once the call
+    outlives the dependency's recent p95, and a circuit breaker.
+    """
+
+    def __init__(self, name: str, budget_share: float, hedge: bool = False, hedge_percentile: float = 95,
+                 hedge_min_ms: float = 50.0, **breaker_kwargs):
+        self.name = name
+        self.budget_share = budget_share
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_ms = hedge_min_ms
+        self.breaker = CircuitBreaker(name, **breaker_kwargs)
+        self.latencies = LatencyWindow()
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.timeouts = 0
+        _upstreams[name] = self
+
+    def available(self) -> bool:
+        return self.breaker.available()
+
+    def hedge_delay_ms(self):
+        if not self.hedge:
+            return None
+        threshold = self.latencies.percentile(self.hedge_percentile)
+        return None if threshold is None else max(threshold, self.hedge_min_ms)
+
+    async def call(self, make_call, reserve_seconds: float = 0.0):
+        """
+        Awaits make_call() (a zero-argument function returning a new awaitable
+        each time) under this upstream's deadline, hedging and breaker.
+        Raises CircuitOpenError without calling if the circuit is open and
+        DeadlineExceeded if the stage runs out of time.
+        """
+        timeout = stage_timeout(self.budget_share, reserve_seconds)
+        if timeout <= 0:
+            incr(f"{self.name}_no_budget")
+            raise DeadlineExceeded(f"No time left in the request budget for {self.name}")
+        if not self.breaker.allow():
+            incr(f"{self.name}_rejected")
+            raise CircuitOpenError(f"{self.name} circuit is open")
+
+        start = time.perf_counter()
+        # asyncio.wait rather than wait_for, so a stage timeout cannot be
+        # confused with a TimeoutError (or DeadlineExceeded) raised by the call.
+        task = asyncio.ensure_future(self._hedged(make_call))
+        try:
+            done, _ = await asyncio.wait({task}, timeout=timeout)
+        except asyncio.CancelledError:
+            # The caller gave up (e.g. a sibling stage failed); no verdict on the upstream.
+            task.cancel()
+            self.breaker.release_probe()
+            raise
+        if not done:
+            task.cancel()
+            self.timeouts += 1
+            self.breaker.record(False, (time.perf_counter() - start) * 1000)
+            incr(f"{self.name}_timeouts")
+            raise DeadlineExceeded(f"{self.name} timed out after {timeout:.2f} s")
+        try:
+            result = task.result()
+        except DeadlineExceeded:
+            # A nested stage ran out of the request budget; not this upstream's failure.
+            self.breaker.release_probe()
+            raise
+        except Exception:
+            self.breaker.record(False, (time.perf_counter() - start) * 1000)
+            raise
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        self.latencies.add(elapsed_ms)
+        self.breaker.record(True, elapsed_ms)
+        return result
+
+    async def _hedged(self, make_call):
+        delay_ms = self.hedge_delay_ms()
+        if delay_ms is None:
+            return await make_call()
+        tasks = [asyncio.ensure_future(make_call())]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay_ms / 1000)
+            if not done:
+                self.hedges += 1
+                incr(f"{self.name}_hedged")
+                tasks.append(asyncio.ensure_future(make_call()))
+            pending = set(tasks)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not tasks[0]:
+                            self.hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    def metrics(self) -> dict:
+        return {
+            **self.breaker.metrics(),
+            "p95_ms": self.latencies.percentile(95, min_samples=1),
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "timeouts": self.timeouts,
+        }
+
+
+_upstreams = {}
+
+
+def circuit_states() -> dict:
+    """
+    Current circuit state of every upstream, for the request trace.
+    """
+    return {name: upstream.breaker.metrics()["state"] for name, upstream in _upstreams.items()}
+
+
+def upstream_metrics() -> dict:
+    return {name: upstream.metrics() for name, upstream in _upstreams.items()}
@@ -0,0 +1,118 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+
+from query_embeddings import normalize_query
+
+# How often a warm instance reloads the cached answers for its snapshot version.
+DEFAULT_REFRESH_SECONDS = float(os.getenv("RAG_RESPONSE_CACHE_REFRESH_S", "300"))
+# After a failed load, the next one starts this long later rather than on the next request.
+RETRY_SECONDS = 30.0
+WRITE_BATCH_SIZE = 400  # Firestore allows 500 writes per batch
+
+
+class LocalResponseBackend:
+    """
+    In-memory stand-in for the shared response cache, for tests and offline runs.
+    """
+
+    def __init__(self):
+        self.entries = {}
+
+    def load(self, version: str) -> dict:
+        return dict(self.entries.get(version, {}))
+
+    def put_many(self, version: str, entries: dict):
+        self.entries.setdefault(version, {}).update(entries)
+
+
+class FirestoreResponseBackend:
+    """
+    Precomputed answers in the `response_cache` collection, one document per
+    snapshot version and normalized query. Answers are only ever read for the
+    version they were computed against, so a new catalog snapshot starts cold.
+    """
+
+    def __init__(self, db, collection: str = "response_cache"):
+        self.db = db
+        self.collection = collection
+
+    def _ref(self, version: str, key: str):
+        digest = hashlib.sha256(f"{version}\n{key}".encode("utf-8")).hexdigest()[:40]
+        return self.db.collection(self.collection).document(digest)
+
+    def load(self, version: str) -> dict:
+        query = self.db.collection(self.collection).where("snapshot_version", "==", version)
+        return {doc.to_dict()["query"]: doc.to_dict() for doc in query.stream()}
+
+    def put_many(self, version: str, entries: dict):
+        items = list(entries.items())
+        for start in range(0, len(items), WRITE_BATCH_SIZE):
+            batch = self.db.batch()
+            for key, entry in items[start:start + WRITE_BATCH_SIZE]:
+                batch.set(self._ref(version, key), dict(entry, query=key, snapshot_version=version))
+            batch.commit()
+
+
+class ResponseCache:
+    """
+    Per-instance copy of the precomputed answers for the active snapshot
+    version. Lookups are dictionary reads; loading happens on a background
+    thread whenever the version changes or refresh_interval has passed (or
+    RETRY_SECONDS after a failed load), and until it finishes lookups miss
+    rather than wait.
+    """
+
+    def __init__(self, backend=None, refresh_interval: float = DEFAULT_REFRESH_SECONDS):
+        self.backend = backend
+        self.refresh_interval = refresh_interval
+        self.hits = 0
+        self.misses = 0
+        # (version, entries), replaced as a whole so readers never mix two versions.
+        self._loaded = (None, {})
+        self._requested = None
+        self._loaded_at = 0.0
+        self._failed = False
+        self._loading = False
+        self._lock = threading.Lock()
+
+    def get(self, query: str, version: str):
+        """
+        The cached entry ({"response", "context", ...}) for a query under the
+        given snapshot version, or None.
+        """
+        if self.backend is None:
+            return None
+        loaded_version, entries = self._loaded
+        backoff = RETRY_SECONDS if self._failed else self.refresh_interval
+        if version != self._requested or time.monotonic() - self._loaded_at >= backoff:
+            self._start_load(version)
+        entry = entries.get(normalize_query(query)) if version == loaded_version else None
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return entry
+
+    def _start_load(self, version: str):
+        with self._lock:
+            if self._loading:
+                return
+            self._loading = True
+            self._requested = version
+            self._loaded_at = time.monotonic()
+        threading.Thread(target=self._load, args=(version,), name="response-cache-load", daemon=True).start()
+
+    def _load(self, version: str):
+        try:
+            entries = self.backend.load(version)
+            self._loaded = (version, entries)
+            self._failed = False
+            logging.info("Loaded %d cached responses for snapshot %s.", len(entries), version)
+        except Exception as e:
+            self._failed = True
+            logging.warning("Loading cached responses failed: %s", str(e))
+        finally:
+            self._loading = False
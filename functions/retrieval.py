@@ -0,0 +1,200 @@
+import asyncio
+import logging
+import re
+
+import numpy as np
+
+# Candidates fetched per requested document before MMR re-ranking.
+FETCH_MULTIPLIER = 4
+# Trade-off between relevance (1.0) and diversity (0.0) in MMR.
+MMR_LAMBDA = 0.7
+# Largest ID list pushed down to Astra as a `$in` filter; bigger candidate
+# sets are filtered after the search instead.
+MAX_PUSHDOWN_IDS = 100
+
+COURSE_CODE_PATTERN = re.compile(r'\b([A-Za-z]{4})\s*-?\s*(\d{1,3}[A-Za-z]{0,2})\b')
+WORD_PATTERN = re.compile(r'\b[A-Za-z]{4}\b')
+# Four-letter tags that are also ordinary words; only matched when written in caps.
+AMBIGUOUS_TAGS = {"SPAN", "CHIN", "GERM", "ARTS", "CLAS"}
+DEPARTMENT_SUFFIX = r'(courses?|class(es)?|electives?|major|minor|department)\b'
+
+LEVEL_PATTERNS = [
+    (re.compile(r'\bupper[\s-]*div(ision)?\b', re.IGNORECASE), (100, 199)),
+    (re.compile(r'\blower[\s-]*div(ision)?\b', re.IGNORECASE), (1, 99)),
+]
+HUNDRED_LEVEL_PATTERN = re.compile(r'\b([1-3])00[\s-]*level\b', re.IGNORECASE)
+
+COLLEGE_PATTERNS = {
+    "CAS": re.compile(r'\bCAS\b|\barts and sciences\b', re.IGNORECASE),
+    "LSB": re.compile(r'\bLSB\b|\bleavey\b|\bbusiness school\b|\bschool of business\b', re.IGNORECASE),
+    "SOE": re.compile(r'\bSOE\b|\bschool of engineering\b|\bengineering school\b', re.IGNORECASE),
+}
+
+
+class QueryFilters:
+    """
+    Structured metadata parsed from a free-text query.
+    """
+
+    def __init__(self, tags=None, colleges=None, level_range=None, course_ids=None):
+        self.tags = tags or set()
+        self.colleges = colleges or set()
+        self.level_range = level_range
+        self.course_ids = course_ids or []
+
+    @property
+    def active(self) -> bool:
+        return bool(self.tags or self.colleges or self.level_range)
+
+    def __repr__(self):
+        return (f"QueryFilters(tags={sorted(self.tags)}, colleges={sorted(self.colleges)}, "
+                f"level_range={self.level_range}, course_ids={self.course_ids})")
+
+
+def parse_query_filters(query: str, catalog) -> QueryFilters:
+    """
+    Extracts department tags, a course level range and colleges from the query.
+    Tags followed by a number ("CSEN 174") are explicit courses, not a facet.
+    """
+    filters = QueryFilters()
+    code_spans = []
+    for match in COURSE_CODE_PATTERN.finditer(query):
+        tag = match.group(1).upper()
+        if tag in catalog.tags:
+            filters.course_ids.append(f"{tag} {match.group(2).upper()}")
+            code_spans.append(match.span())
+
+    for match in WORD_PATTERN.finditer(query):
+        if any(start <= match.start() < end for start, end in code_spans):
+            continue
+        word = match.group(0)
+        tag = word.upper()
+        if tag in catalog.tags and (word == tag or tag not in AMBIGUOUS_TAGS):
+            filters.tags.add(tag)
+
+    # Department names only count when used as a facet ("economics electives"),
+    # not as a topic ("the history of computing").
+    lowered = " ".join(query.lower().split())
+    for department, tag in catalog.department_tags.items():
+        if re.search(rf'\b{re.escape(department)}\s+{DEPARTMENT_SUFFIX}', lowered):
+            filters.tags.add(tag)
+
+    for pattern, level_range in LEVEL_PATTERNS:
+        if pattern.search(query):
+            filters.level_range = level_range
+            break
+    else:
+        match = HUNDRED_LEVEL_PATTERN.search(query)
+        if match:
+            low = int(match.group(1)) * 100
+            filters.level_range = (low, low + 99)
+
+    for college, pattern in COLLEGE_PATTERNS.items():
+        if college in catalog.colleges and pattern.search(query):
+            filters.colleges.add(college)
+    return filters
+
+
+def maximal_marginal_relevance(query_vector, doc_vectors, k: int, lambda_mult: float = MMR_LAMBDA) -> list:
+    """
+    Greedy MMR selection. Returns indices into doc_vectors in selection order.
+    """
+    if len(doc_vectors) == 0 or k <= 0:
+        return []
+    docs = np.asarray(doc_vectors, dtype=np.float32)
+    docs = docs / np.maximum(np.linalg.norm(docs, axis=1, keepdims=True), 1e-12)
+    query = np.asarray(query_vector, dtype=np.float32)
+    query = query / max(float(np.linalg.norm(query)), 1e-12)
+
+    relevance = docs @ query
+    selected = [int(np.argmax(relevance))]
+    # Highest similarity of each candidate to anything already selected.
+    redundancy = docs @ docs[selected[0]]
+    while len(selected) < min(k, len(docs)):
+        scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        scores[selected] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        redundancy = np.maximum(redundancy, docs @ docs[best])
+    return selected
+
+
+def search_scope(query: str, catalog=None, top_k: int = 10, fetch_k: int = None):
+    """
+    Works out how to search for a query: returns (fetch size, pushdown filter,
+    allowed course IDs). allowed is None when the query has no usable filters.
+    """
+    fetch_k = fetch_k or top_k * FETCH_MULTIPLIER
+    filters = parse_query_filters(query, catalog) if catalog else QueryFilters()
+
+    allowed = None
+    pushdown = None
+    if filters.active:
+        bits = catalog.select(filters.tags, filters.colleges, filters.level_range)
+        allowed = catalog.course_ids(bits) + filters.course_ids
+        if not allowed:
+            logging.info("No catalog courses match %s; searching unfiltered.", filters)
+            allowed = None
+        elif len(allowed) <= MAX_PUSHDOWN_IDS:
+            pushdown = {"course_id": {"$in": allowed}}
+        logging.info("Query filters %s matched %d courses.", filters, len(allowed or []))
+    return fetch_k, pushdown, allowed
+
+
+def filter_candidates(candidates, pushdown, allowed) -> list:
+    """
+    Applies the allowed-ID filter to results of a search that could not push it down.
+    """
+    if allowed is not None and pushdown is None:
+        allowed_ids = set(allowed)
+        return [(doc, vector) for doc, vector in candidates if doc.metadata.get("course_id") in allowed_ids]
+    return candidates
+
+
+def rank_candidates(query_vector, candidates, top_k: int, lambda_mult: float = MMR_LAMBDA) -> list:
+    """
+    MMR re-ranks (Document, embedding) candidates and returns (cosine score, Document) pairs.
+    """
+    order = maximal_marginal_relevance(query_vector, [vector for _, vector in candidates], top_k, lambda_mult)
+    query = np.asarray(query_vector, dtype=np.float32)
+    query_norm = max(float(np.linalg.norm(query)), 1e-12)
+    results = []
+    for index in order:
+        doc, vector = candidates[index]
+        vector = np.asarray(vector, dtype=np.float32)
+        score = float(vector @ query) / (max(float(np.linalg.norm(vector)), 1e-12) * query_norm)
+        results.append((score, doc))
+    return results
+
+
+def retrieve_diverse(query: str, query_vector, search_fn, catalog=None, top_k: int = 10,
+                     fetch_k: int = None, lambda_mult: float = MMR_LAMBDA):
+    """
+    Metadata-filtered retrieval followed by MMR re-ranking.
+
+    search_fn(query_vector, k, filter) must return a list of (Document, embedding)
+    pairs. Returns (score, Document) pairs, where score is the cosine similarity
+    to the query.
+    """
+    fetch_k, pushdown, allowed = search_scope(query, catalog, top_k, fetch_k)
+    candidates = search_fn(query_vector, fetch_k if pushdown or allowed is None else fetch_k * 2, pushdown)
+    candidates = filter_candidates(candidates, pushdown, allowed)
+    if allowed is not None and not candidates:
+        # The filter was too narrow for what the store returned; fall back.
+        candidates = search_fn(query_vector, fetch_k, None)
+    return rank_candidates(query_vector, candidates, top_k, lambda_mult)
+
+
+async def aretrieve_diverse(query: str, query_vector, search_fn, catalog=None, top_k: int = 10,
+                            fetch_k: int = None, lambda_mult: float = MMR_LAMBDA):
+    """
+    retrieve_diverse for an async search_fn (a coroutine function with the same
+    contract). Filter parsing and MMR re-ranking run in worker threads so they
+    do not hold up other requests on the event loop.
+    """
+    fetch_k, pushdown, allowed = await asyncio.to_thread(search_scope, query, catalog, top_k, fetch_k)
+    candidates = await search_fn(query_vector, fetch_k if pushdown or allowed is None else fetch_k * 2, pushdown)
+    candidates = filter_candidates(candidates, pushdown, allowed)
+    if allowed is not None and not candidates:
+        candidates = await search_fn(query_vector, fetch_k, None)
+    return await asyncio.to_thread(rank_candidates, query_vector, candidates, top_k, lambda_mult)
@@ -0,0 +1,151 @@
+import re
+
+from query_planner import detect_course_codes
+
+ANSWER_MODEL = "gemini-2.0-flash-001"
+LIGHT_MODEL = "gemini-2.0-flash-lite-001"
+# Template answers are only given to short questions; anything longer is
+# likely to ask for more than one catalog field.
+TEMPLATE_MAX_WORDS = 12
+
+CHITCHAT_PATTERN = re.compile(
+    r"^\W*(hi|hello|hey|howdy|good (morning|afternoon|evening)|thanks?( you)?|thank you( so much)?|thx|"
+    r"ok(ay)?|cool|great|awesome|bye|goodbye|see you|who are you|what can you do|how are you)\b[\w\s!.,']{0,20}$",
+    re.IGNORECASE,
+)
+PLANNING_PATTERN = re.compile(
+    r'\b(plan|planning|schedule|roadmap|four[- ]year|4[- ]year|next (quarter|year|term)|'
+    r'what should i take|which order|in what order|graduate on time|requirements? for (the|my) (major|minor|degree))\b',
+    re.IGNORECASE,
+)
+# "Courses like X": answered from the precomputed neighbor graph, not a vector search.
+SIMILAR_PATTERN = re.compile(
+    r'\b(courses?|classes?|something|anything|others?|ones?) (similar to|like|related to|comparable to)\b|'
+    r'\b(similar|alternatives? (to|for)|instead of)\b',
+    re.IGNORECASE,
+)
+# The course a template lookup is about, optionally introduced ("the course CSEN 174").
+COURSE = r"(?:the )?(?:course |class )?[A-Za-z]{4}\s*-?\s*\d{1,3}[A-Za-z]{0,2}"
+PREREQ = r"(?:pre-?req(?:uisite)?s?|co-?req(?:uisite)?s?)"
+END = r"\W*$"
+# Catalog fields a lookup can be answered from without the LLM, in match order.
+# Each pattern covers the whole question with the course as its subject, so
+# "what needs CSEN 174 as a prerequisite" or "what is taught after CSEN 174"
+# go to the model instead.
+TEMPLATE_FIELDS = [
+    ("pre_reqs", re.compile(
+        rf"^\W*(?:(?:what|which) (?:are|is) (?:the )?{PREREQ} (?:for|of|to take) {COURSE}"
+        rf"|{PREREQ} (?:for|of) {COURSE}"
+        rf"|(?:what|which) (?:are|is) {COURSE}(?:'s)? {PREREQ}"
+        rf"|what(?:'s| is| do i) need(?:ed)? (?:before|to take|for) {COURSE}"
+        rf"|does {COURSE} have (?:any )?{PREREQ}){END}", re.IGNORECASE)),
+    ("department", re.compile(
+        rf"^\W*(?:which|what) (?:department|school|college) (?:offers|teaches|runs|is) {COURSE}"
+        rf"(?: (?:in|under|from|part of))?{END}", re.IGNORECASE)),
+    ("title", re.compile(rf"^\W*what(?:'s| is) the (?:name|title) of {COURSE}{END}", re.IGNORECASE)),
+    ("description", re.compile(
+        rf"^\W*(?:what(?:'s| is) {COURSE}(?: about)?|describe {COURSE}|tell me about {COURSE}){END}",
+        re.IGNORECASE)),
+]
+# Questions that need judgement, not a field value.
+OPINION_PATTERN = re.compile(r'\b(should|hard|easy|worth|recommend|better|good|like|why|how)\b', re.IGNORECASE)
+
+
+class Route:
+    """
+    How one kind of request is served: answer model, output cap, and which
+    pipeline stages it needs.
+    """
+
+    def __init__(self, name: str, model: str, max_output_tokens: int, skip_enhancement: bool = False,
+                 skip_retrieval: bool = False, neighbor_retrieval: bool = False):
+        self.name = name
+        self.model = model
+        self.max_output_tokens = max_output_tokens
+        self.skip_enhancement = skip_enhancement
+        self.skip_retrieval = skip_retrieval
+        self.neighbor_retrieval = neighbor_retrieval
+
+    def __repr__(self):
+        return f"Route({self.name!r}, {self.model}, max_output_tokens={self.max_output_tokens})"
+
+
+ROUTES = {
+    "chitchat": Route("chitchat", LIGHT_MODEL, 200, skip_enhancement=True, skip_retrieval=True),
+    "lookup": Route("lookup", LIGHT_MODEL, 400, skip_enhancement=True),
+    "similar": Route("similar", ANSWER_MODEL, 800, skip_enhancement=True, neighbor_retrieval=True),
+    "comparison": Route("comparison", ANSWER_MODEL, 800, skip_enhancement=True),
+    "planning": Route("planning", ANSWER_MODEL, 1024),
+    "general": Route("general", ANSWER_MODEL, 1024),
+}
+
+
+class RouteDecision:
+    """
+    The route chosen for a request, the course IDs it names and, for simple
+    lookups, a ready answer built from catalog fields.
+    """
+
+    def __init__(self, route: Route, course_ids=(), answer: str = None):
+        self.route = route
+        self.course_ids = list(course_ids)
+        self.answer = answer
+
+    def __repr__(self):
+        return f"RouteDecision({self.route.name!r}, {self.course_ids}, templated={self.answer is not None})"
+
+
+def template_answer(course: dict, field: str) -> str:
+    """
+    Answers a single-field lookup about one course from its catalog entry.
+    """
+    name = f"**{course['tag']}-{course['number']} {course['course']}**"
+    if field == "pre_reqs":
+        if course.get("pre_reqs"):
+            return f"The prerequisites for {name} are: {course['pre_reqs'].rstrip('. ')}."
+        return f"{name} has no prerequisites listed in the course catalog."
+    if field == "department":
+        return f"{name} is offered by {course['department']}."
+    if field == "title":
+        return f"{course['tag']}-{course['number']} is {name}."
+    description = course.get("description") or "The catalog does not include a description for this course."
+    return f"{name} ({course['department']}): {description}"
+
+
+def lookup_field(query: str):
+    """
+    Returns the catalog field a short factual question asks for, or None.
+    """
+    if len(query.split()) > TEMPLATE_MAX_WORDS or OPINION_PATTERN.search(query):
+        return None
+    for field, pattern in TEMPLATE_FIELDS:
+        if pattern.match(query.strip()):
+            return field
+    return None
+
+
+def route_request(query: str, catalog=None) -> RouteDecision:
+    """
+    Classifies a request with local rules (no model call): chit-chat,
+    single-course lookup, similar courses, comparison, planning, or general.
+    Lookups that ask for one catalog field of one course come back with a
+    template answer.
+    """
+    codes = detect_course_codes(query, catalog) if catalog else []
+    if not codes and CHITCHAT_PATTERN.match(query.strip()):
+        return RouteDecision(ROUTES["chitchat"])
+    if len(codes) >= 2:
+        return RouteDecision(ROUTES["comparison"], codes)
+    if len(codes) == 1:
+        if PLANNING_PATTERN.search(query):
+            return RouteDecision(ROUTES["planning"], codes)
+        if SIMILAR_PATTERN.search(query):
+            return RouteDecision(ROUTES["similar"], codes)
+        field = lookup_field(query)
+        answer = template_answer(catalog.lookup(codes[0])[0], field) if field else None
+        return RouteDecision(ROUTES["lookup"], codes, answer)
+    if PLANNING_PATTERN.search(query):
+        return RouteDecision(ROUTES["planning"])
+    # Comparisons without course codes stay general: enhancement has to
+    # resolve what is being compared.
+    return RouteDecision(ROUTES["general"])
@@ -0,0 +1,183 @@
+import hashlib
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+
+# Fraction of live retrievals replayed against the candidate backend; 0 disables shadowing.
+DEFAULT_SAMPLE_RATE = float(os.getenv("RAG_SHADOW_RATE", "0"))
+# Replays waiting for the worker; beyond this, new samples are dropped rather than queued.
+QUEUE_SIZE = 64
+# Log raw queries instead of hashes, here and in the request logs (off by default:
+# queries can contain personal details).
+LOG_QUERIES = os.getenv("RAG_SHADOW_LOG_QUERIES") == "1"
+
+shadow_logger = logging.getLogger("rag.shadow")
+
+
+def jaccard(first, second) -> float:
+    first, second = set(first), set(second)
+    if not first and not second:
+        return 1.0
+    return len(first & second) / len(first | second)
+
+
+def kendall_tau(first, second):
+    """
+    Kendall rank correlation of the items both rankings contain, from -1
+    (reversed) to 1 (same order). None if they share fewer than two items.
+    """
+    position = {item: i for i, item in enumerate(second)}
+    common = [item for item in first if item in position]
+    if len(common) < 2:
+        return None
+    concordant = discordant = 0
+    for i in range(len(common)):
+        for j in range(i + 1, len(common)):
+            if position[common[i]] < position[common[j]]:
+                concordant += 1
+            else:
+                discordant += 1
+    return (concordant - discordant) / (concordant + discordant)
+
+
+def query_key(query: str) -> str:
+    return query if LOG_QUERIES else hashlib.sha256(query.encode("utf-8")).hexdigest()[:12]
+
+
+class ShadowRunner:
+    """
+    Replays a sample of live retrievals against a candidate backend on a
+    background thread and logs how its results compare with the primary's.
+    The request only pays for a random draw and a non-blocking queue put;
+    when the worker falls behind, samples are dropped.
+
+    candidate(query, top_k) must return the candidate's course IDs, best
+    first. It runs on the worker thread, so it must be synchronous and must
+    not share the primary's circuit breakers.
+    """
+
+    def __init__(self, name: str, candidate, sample_rate: float = DEFAULT_SAMPLE_RATE,
+                 queue_size: int = QUEUE_SIZE, seed=None):
+        self.name = name
+        self.candidate = candidate
+        self.sample_rate = sample_rate
+        self.submitted = 0
+        self.dropped = 0
+        self.errors = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._random = random.Random(seed)
+        self._worker = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.candidate is not None and self.sample_rate > 0
+
+    def submit(self, query: str, primary: str, primary_ids, primary_ms: float, top_k: int) -> bool:
+        """
+        Samples a finished primary retrieval for replay. Never blocks or raises.
+        Returns whether it was queued.
+        """
+        if not self.enabled or self._random.random() >= self.sample_rate:
+            return False
+        self._ensure_worker()
+        try:
+            self._queue.put_nowait((time.time(), query, primary, list(primary_ids), primary_ms, top_k))
+        except queue.Full:
+            self.dropped += 1
+            return False
+        self.submitted += 1
+        return True
+
+    def _ensure_worker(self):
+        if self._worker is not None:
+            return
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="shadow-traffic", daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                shadow_logger.info(json.dumps(self.compare(*item), separators=(",", ":")))
+            except Exception as e:
+                logging.warning("Shadow comparison failed: %s", str(e))
+            finally:
+                self._queue.task_done()
+
+    def compare(self, timestamp, query, primary, primary_ids, primary_ms, top_k) -> dict:
+        """
+        Runs the candidate for one sampled query and returns the compact log record.
+        """
+        record = {"ts": round(timestamp, 3), "q": query_key(query), "p": primary, "c": self.name, "k": top_k,
+                  "pm": round(primary_ms, 1), "pn": len(primary_ids)}
+        start = time.perf_counter()
+        try:
+            candidate_ids = list(self.candidate(query, top_k))
+        except Exception as e:
+            self.errors += 1
+            record.update(cm=round((time.perf_counter() - start) * 1000, 1), err=type(e).__name__)
+            return record
+        tau = kendall_tau(primary_ids, candidate_ids)
+        record.update(
+            cm=round((time.perf_counter() - start) * 1000, 1),
+            cn=len(candidate_ids),
+            j=round(jaccard(primary_ids, candidate_ids), 3),
+            tau=None if tau is None else round(tau, 3),
+            top1=bool(primary_ids and candidate_ids and primary_ids[0] == candidate_ids[0]),
+        )
+        return record
+
+    def drain(self, timeout: float = 30.0) -> bool:
+        """
+        Waits for queued replays to finish (for offline runs). Returns False on timeout.
+        """
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+
+def _percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else None
+
+
+def summarize(records) -> dict:
+    """
+    Aggregates shadow log records per candidate backend: latency of both
+    sides, overlap, rank correlation, top-1 agreement and error rate.
+    """
+    by_candidate = {}
+    for record in records:
+        by_candidate.setdefault(record.get("c", "?"), []).append(record)
+    summary = {}
+    for name, rows in sorted(by_candidate.items()):
+        ok = [row for row in rows if "err" not in row]
+        taus = [row["tau"] for row in ok if row.get("tau") is not None]
+        errors = {}
+        for row in rows:
+            if "err" in row:
+                errors[row["err"]] = errors.get(row["err"], 0) + 1
+        summary[name] = {
+            "samples": len(rows),
+            "error_rate": round(1 - len(ok) / len(rows), 4),
+            "errors": errors,
+            "primary_ms": {"p50": _percentile([r["pm"] for r in rows], 0.5),
+                           "p95": _percentile([r["pm"] for r in rows], 0.95)},
+            "candidate_ms": {"p50": _percentile([r["cm"] for r in rows], 0.5),
+                             "p95": _percentile([r["cm"] for r in rows], 0.95)},
+            "jaccard_mean": round(sum(r["j"] for r in ok) / len(ok), 3) if ok else None,
+            "jaccard_p10": _percentile([r["j"] for r in ok], 0.1),
+            "tau_mean": round(sum(taus) / len(taus), 3) if taus else None,
+            "top1_agreement": round(sum(1 for r in ok if r["top1"]) / len(ok), 3) if ok else None,
+        }
+    return summary
@@ -0,0 +1,368 @@
+import contextvars
+import datetime
+import gc
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import weakref
+
+from catalog import Catalog
+from neighbors import NeighborGraph
+
+POINTER_FILE = "CURRENT"
+MANIFEST_FILE = "manifest.json"
+# Component name -> file or directory name inside a snapshot.
+COMPONENTS = {
+    "catalog": "courses.csv",
+    "local_index": "hnsw_index",
+    "neighbors": "course_neighbors.npz",
+}
+# How often a warm instance reads the version pointer.
+DEFAULT_POLL_SECONDS = float(os.getenv("RAG_SNAPSHOT_POLL_S", "60"))
+
+_pinned = contextvars.ContextVar("rag_snapshot", default=None)
+
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _files(path: str):
+    """
+    Relative paths of the files under a component (the path itself if it is a file).
+    """
+    if os.path.isfile(path):
+        return [os.path.basename(path)]
+    return sorted(os.path.relpath(os.path.join(root, name), os.path.dirname(path))
+                  for root, _, names in os.walk(path) for name in names)
+
+
+def content_hash(paths) -> str:
+    """
+    A short hash of the files under the given paths (names and contents).
+    """
+    digest = hashlib.sha256()
+    for path in sorted(paths):
+        for name in _files(path):
+            digest.update(name.encode("utf-8"))
+            digest.update(_sha256(os.path.join(os.path.dirname(path), name)).encode("ascii"))
+    return digest.hexdigest()[:8]
+
+
+def new_version(paths) -> str:
+    """
+    A sortable version ID: UTC time plus a short hash of the snapshot contents.
+    """
+    return f"{datetime.datetime.now(datetime.timezone.utc):%Y%m%dT%H%M%SZ}-{content_hash(paths)}"
+
+
+def stage_snapshot(version: str, components: dict, directory: str) -> dict:
+    """
+    Copies the given {component: path} into directory and writes its
+    manifest (file hashes per component). Returns the manifest.
+    """
+    manifest = {"version": version, "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                "components": {}}
+    for name, source in components.items():
+        target = os.path.join(directory, COMPONENTS[name])
+        if os.path.isdir(source):
+            shutil.copytree(source, target)
+        else:
+            shutil.copyfile(source, target)
+        manifest["components"][name] = {
+            "path": COMPONENTS[name],
+            "files": {file: _sha256(os.path.join(directory, file)) for file in _files(target)},
+        }
+    with open(os.path.join(directory, MANIFEST_FILE), "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+class Snapshot:
+    """
+    One immutable version of the serving data: catalog, local vector index
+    and similar-courses graph. Components missing from a snapshot are None.
+    """
+
+    def __init__(self, version: str, catalog=None, local_index=None, neighbors=None):
+        self.version = version
+        self.catalog = catalog
+        self.local_index = local_index
+        self.neighbors = neighbors
+
+    @classmethod
+    def load(cls, directory: str, verify: bool = True):
+        """
+        Loads a snapshot directory written by stage_snapshot, checking every
+        file against the manifest first.
+        """
+        with open(os.path.join(directory, MANIFEST_FILE)) as f:
+            manifest = json.load(f)
+        components = manifest["components"]
+        if verify:
+            for name, component in components.items():
+                for file, expected in component["files"].items():
+                    if _sha256(os.path.join(directory, file)) != expected:
+                        raise ValueError(f"Snapshot {manifest['version']}: {file} does not match its manifest")
+
+        def path(name):
+            return os.path.join(directory, components[name]["path"]) if name in components else None
+
+        local_index = None
+        if path("local_index"):
+            # Imported here so publishing snapshots does not need the LangChain stack.
+            from local_index import LocalCourseIndex
+            local_index = LocalCourseIndex.load(path("local_index"))
+        return cls(
+            manifest["version"],
+            catalog=Catalog.from_csv(path("catalog")) if path("catalog") else None,
+            local_index=local_index,
+            neighbors=NeighborGraph.load(path("neighbors")) if path("neighbors") else None,
+        )
+
+
+class LocalSnapshotStore:
+    """
+    Snapshots in a directory: one sub-directory per version and a CURRENT
+    file naming the active one. Versions are staged under a temporary name
+    and renamed into place; the pointer is replaced atomically.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def read_pointer(self):
+        try:
+            with open(os.path.join(self.root, POINTER_FILE)) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def set_pointer(self, version: str):
+        if not os.path.exists(os.path.join(self.root, version, MANIFEST_FILE)):
+            raise ValueError(f"No snapshot {version} in {self.root}")
+        fd, temp_path = tempfile.mkstemp(dir=self.root)
+        with os.fdopen(fd, "w") as f:
+            f.write(version)
+        os.replace(temp_path, os.path.join(self.root, POINTER_FILE))
+
+    def fetch(self, version: str) -> str:
+        return os.path.join(self.root, version)
+
+    def release(self, version: str):
+        pass  # Local versions stay available for rollback.
+
+    def publish(self, components: dict, version: str = None, activate: bool = True) -> str:
+        version = version or new_version(components.values())
+        os.makedirs(self.root, exist_ok=True)
+        staging = tempfile.mkdtemp(dir=self.root, prefix=".staging-")
+        try:
+            stage_snapshot(version, components, staging)
+            os.rename(staging, os.path.join(self.root, version))
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        if activate:
+            self.set_pointer(version)
+        return version
+
+
+class StorageSnapshotStore:
+    """
+    Snapshots in Cloud Storage under `prefix/<version>/`, with the pointer in
+    `prefix/CURRENT`. Versions are downloaded into cache_dir before loading
+    and deleted from it once an instance has moved on.
+    """
+
+    def __init__(self, bucket_name: str = None, prefix: str = "snapshots", cache_dir: str = None):
+        from firebase_admin import storage
+        self.bucket = storage.bucket(bucket_name)
+        self.prefix = prefix.strip("/")
+        self.cache_dir = cache_dir or os.path.join(tempfile.gettempdir(), "rag-snapshots")
+
+    def read_pointer(self):
+        blob = self.bucket.blob(f"{self.prefix}/{POINTER_FILE}")
+        if not blob.exists():
+            return None
+        return blob.download_as_text().strip() or None
+
+    def set_pointer(self, version: str):
+        if not self.bucket.blob(f"{self.prefix}/{version}/{MANIFEST_FILE}").exists():
+            raise ValueError(f"No snapshot {version} in gs://{self.bucket.name}/{self.prefix}")
+        self.bucket.blob(f"{self.prefix}/{POINTER_FILE}").upload_from_string(version, content_type="text/plain")
+
+    def fetch(self, version: str) -> str:
+        directory = os.path.join(self.cache_dir, version)
+        if os.path.exists(os.path.join(directory, MANIFEST_FILE)):
+            return directory
+        staging = tempfile.mkdtemp(dir=self._ensure_cache_dir(), prefix=".staging-")
+        remote_prefix = f"{self.prefix}/{version}/"
+        for blob in self.bucket.list_blobs(prefix=remote_prefix):
+            target = os.path.join(staging, blob.name[len(remote_prefix):])
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            blob.download_to_filename(target)
+        os.rename(staging, directory)
+        return directory
+
+    def _ensure_cache_dir(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        return self.cache_dir
+
+    def release(self, version: str):
+        # Only called once no request is pinned to the version any more.
+        shutil.rmtree(os.path.join(self.cache_dir, version), ignore_errors=True)
+
+    def publish(self, components: dict, version: str = None, activate: bool = True) -> str:
+        version = version or new_version(components.values())
+        with tempfile.TemporaryDirectory() as staging:
+            stage_snapshot(version, components, staging)
+            names = [os.path.relpath(os.path.join(root, name), staging)
+                     for root, _, files in os.walk(staging) for name in files]
+            # The manifest goes last so a half-uploaded version is never loadable.
+            for name in sorted(names, key=lambda name: name == MANIFEST_FILE):
+                blob = self.bucket.blob(f"{self.prefix}/{version}/{name.replace(os.sep, '/')}")
+                blob.upload_from_filename(os.path.join(staging, name))
+        if activate:
+            self.set_pointer(version)
+        return version
+
+
+class SnapshotManager:
+    """
+    Holds the active snapshot of a warm instance. At most every
+    poll_interval seconds a request triggers a background check of the
+    version pointer; a new version is fetched and loaded on a worker thread
+    and swapped in with a single reference assignment, so requests never
+    wait on it. Each request pins the snapshot it started with, and the old
+    version is freed once the last request using it finishes. prepare, if
+    given, is called with every snapshot before it starts serving, to build
+    per-snapshot caches off the request path.
+    """
+
+    def __init__(self, store=None, fallback=None, poll_interval: float = DEFAULT_POLL_SECONDS, prepare=None):
+        self.store = store
+        self.fallback = fallback
+        self.poll_interval = poll_interval
+        self.prepare = prepare
+        self.swaps = 0
+        self._active = None
+        self._checked_at = 0.0
+        self._refreshing = False
+        self._lock = threading.Lock()
+
+    def _initial(self) -> Snapshot:
+        with self._lock:
+            if self._active is None:
+                snapshot = None
+                if self.store is not None:
+                    try:
+                        snapshot = self._load_pointed()
+                    except Exception as e:
+                        logging.error("Loading the current snapshot failed: %s", str(e))
+                if snapshot is None:
+                    snapshot = self.fallback() if self.fallback else Snapshot("none")
+                self._prepare(snapshot)
+                self._active = snapshot
+                self._checked_at = time.monotonic()
+                logging.info("Serving snapshot %s.", snapshot.version)
+        return self._active
+
+    def _load_pointed(self):
+        version = self.store.read_pointer()
+        if version is None:
+            return None
+        return Snapshot.load(self.store.fetch(version))
+
+    def current(self) -> Snapshot:
+        """
+        The active snapshot; may start a background refresh but never waits for one.
+        """
+        snapshot = self._active or self._initial()
+        if self.store is not None and time.monotonic() - self._checked_at >= self.poll_interval:
+            with self._lock:
+                start = not self._refreshing
+                self._refreshing = True
+                self._checked_at = time.monotonic()
+            if start:
+                threading.Thread(target=self.refresh, name="snapshot-refresh", daemon=True).start()
+        return snapshot
+
+    def refresh(self) -> bool:
+        """
+        Loads and swaps in the pointed-to version if it differs from the
+        active one. Returns whether a swap happened. On failure the active
+        snapshot keeps serving.
+        """
+        try:
+            version = self.store.read_pointer()
+            if version is None or self._active is None or version == self._active.version:
+                return False
+            start = time.perf_counter()
+            snapshot = Snapshot.load(self.store.fetch(version))
+            self._prepare(snapshot)
+            self._swap(snapshot, (time.perf_counter() - start) * 1000)
+            return True
+        except Exception as e:
+            logging.error("Snapshot refresh failed: %s", str(e))
+            return False
+        finally:
+            self._refreshing = False
+
+    def _prepare(self, snapshot: Snapshot):
+        if self.prepare is not None:
+            try:
+                self.prepare(snapshot)
+            except Exception as e:
+                logging.error("Preparing snapshot %s failed: %s", snapshot.version, str(e))
+
+    def _swap(self, snapshot: Snapshot, load_ms: float):
+        old = self._active
+        self._active = snapshot
+        self.swaps += 1
+        logging.info("Swapped snapshot %s -> %s (loaded in %.0f ms).", old.version, snapshot.version, load_ms)
+        # Requests still pinned to the old version keep it alive; its files
+        # are released when the last reference goes away.
+        if old.version != snapshot.version and self.store is not None:
+            weakref.finalize(old, self._release, old.version)
+        del old
+        # Collect whatever is already unreferenced now rather than at the next GC cycle.
+        gc.collect()
+
+    def _release(self, version: str):
+        try:
+            self.store.release(version)
+        except Exception as e:
+            logging.error("Releasing snapshot %s failed: %s", version, str(e))
+
+    def pin(self) -> Snapshot:
+        """
+        Fixes the snapshot for the current request (context), so a swap in the
+        middle of a request does not mix versions.
+        """
+        snapshot = self.current()
+        _pinned.set(snapshot)
+        return snapshot
+
+    def active(self) -> Snapshot:
+        return _pinned.get() or self.current()
+
+
+def snapshot_store_from_env():
+    """
+    RAG_SNAPSHOT_DIR selects a directory store, RAG_SNAPSHOT_BUCKET a Cloud
+    Storage one (with RAG_SNAPSHOT_PREFIX); neither means bundled data only.
+    """
+    if os.getenv("RAG_SNAPSHOT_DIR"):
+        return LocalSnapshotStore(os.environ["RAG_SNAPSHOT_DIR"])
+    if os.getenv("RAG_SNAPSHOT_BUCKET"):
+        return StorageSnapshotStore(os.environ["RAG_SNAPSHOT_BUCKET"], os.getenv("RAG_SNAPSHOT_PREFIX", "snapshots"))
+    return None
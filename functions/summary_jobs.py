@@ -0,0 +1,261 @@
+import datetime
+import logging
+import queue
+import threading
+import time
+
+from firebase_admin import firestore
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+def summary_job_key(user_id: str) -> str:
+    """
+    Returns the idempotent job key for a user's summarization job.
+    There is at most one live summarization job per user at any time.
+    """
+    return f"summary-{user_id}"
+
+
+def _utcnow():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+class LocalJobBackend:
+    """
+    In-memory job store. Jobs do not survive a restart, so this is only meant
+    for running offline (emulator, load tests) where Firestore is not available.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._jobs = {}
+
+    def claim(self, job_key: str, user_id: str, lease_seconds: float) -> bool:
+        now = _utcnow()
+        with self._lock:
+            job = self._jobs.get(job_key)
+            if job and job["status"] in (PENDING, RUNNING) and job["lease_expires"] > now:
+                return False
+            self._jobs[job_key] = {
+                "user_id": user_id,
+                "status": PENDING,
+                "attempts": job["attempts"] if job else 0,
+                "lease_expires": now + datetime.timedelta(seconds=lease_seconds),
+            }
+            return True
+
+    def mark_running(self, job_key: str, lease_seconds: float):
+        with self._lock:
+            job = self._jobs[job_key]
+            job["status"] = RUNNING
+            job["attempts"] += 1
+            job["lease_expires"] = _utcnow() + datetime.timedelta(seconds=lease_seconds)
+
+    def complete(self, job_key: str):
+        with self._lock:
+            self._jobs[job_key]["status"] = DONE
+
+    def fail(self, job_key: str, error: str):
+        with self._lock:
+            self._jobs[job_key]["status"] = FAILED
+            self._jobs[job_key]["error"] = error
+
+    def stale_jobs(self) -> list:
+        now = _utcnow()
+        with self._lock:
+            return [
+                (job_key, job["user_id"])
+                for job_key, job in self._jobs.items()
+                if job["status"] in (PENDING, RUNNING) and job["lease_expires"] <= now
+            ]
+
+
+class FirestoreJobBackend:
+    """
+    Durable job store backed by the `summary_jobs` collection. The document ID is
+    the job key, so enqueueing the same job twice is a no-op while it is live.
+    Jobs whose lease expires (e.g. the instance was throttled or shut down after
+    returning a response) are picked up again by `SummaryJobQueue.recover`.
+    """
+
+    def __init__(self, db, collection: str = "summary_jobs"):
+        self.db = db
+        self.collection = collection
+
+    def _ref(self, job_key: str):
+        return self.db.collection(self.collection).document(job_key)
+
+    def claim(self, job_key: str, user_id: str, lease_seconds: float) -> bool:
+        doc_ref = self._ref(job_key)
+
+        @firestore.transactional
+        def claim_in_transaction(transaction):
+            now = _utcnow()
+            snapshot = doc_ref.get(transaction=transaction)
+            attempts = 0
+            if snapshot.exists:
+                job = snapshot.to_dict()
+                if job.get("status") in (PENDING, RUNNING) and job.get("lease_expires") and job["lease_expires"] > now:
+                    return False
+                attempts = job.get("attempts", 0)
+            transaction.set(doc_ref, {
+                "user_id": user_id,
+                "status": PENDING,
+                "attempts": attempts,
+                "enqueued_at": now,
+                "lease_expires": now + datetime.timedelta(seconds=lease_seconds),
+            })
+            return True
+
+        return claim_in_transaction(self.db.transaction())
+
+    def mark_running(self, job_key: str, lease_seconds: float):
+        self._ref(job_key).update({
+            "status": RUNNING,
+            "attempts": firestore.Increment(1),
+            "lease_expires": _utcnow() + datetime.timedelta(seconds=lease_seconds),
+        })
+
+    def complete(self, job_key: str):
+        self._ref(job_key).update({"status": DONE, "completed_at": _utcnow()})
+
+    def fail(self, job_key: str, error: str):
+        self._ref(job_key).update({"status": FAILED, "error": error, "completed_at": _utcnow()})
+
+    def stale_jobs(self) -> list:
+        now = _utcnow()
+        stale = []
+        query = self.db.collection(self.collection).where("status", "in", [PENDING, RUNNING])
+        for snapshot in query.stream():
+            job = snapshot.to_dict()
+            if job.get("lease_expires") and job["lease_expires"] <= now:
+                stale.append((snapshot.id, job.get("user_id")))
+        return stale
+
+
+class SummaryJobQueue:
+    """
+    Runs summarization jobs on a small pool of in-process worker threads fed by a
+    bounded queue. Job state lives in a pluggable backend so duplicate submits for
+    the same user collapse into one job and lost jobs can be recovered. The
+    workers look for stale jobs every recover_interval, whether or not new jobs
+    are being submitted.
+    """
+
+    def __init__(self, handler, backend, workers: int = 2, max_queue_size: int = 100,
+                 lease_seconds: float = 300, recover_interval: float = 300):
+        self.handler = handler
+        self.backend = backend
+        self.workers = workers
+        self.lease_seconds = lease_seconds
+        self.recover_interval = recover_interval
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._lock = threading.Lock()
+        self._threads = []
+        self._last_recover = None
+
+    def start(self):
+        """
+        Starts the worker threads (once per instance) and recovers stale jobs.
+        """
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._worker, name=f"summary-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        self.recover()
+
+    def submit(self, user_id: str) -> bool:
+        """
+        Enqueues a summarization job for the user. Returns False if an identical
+        job is already pending or running, or if the local queue is full (the job
+        stays pending in the backend and is recovered later).
+        """
+        self.start()
+        job_key = summary_job_key(user_id)
+        try:
+            if not self.backend.claim(job_key, user_id, self.lease_seconds):
+                logging.info("Summary job %s already pending; skipping.", job_key)
+                return False
+        except Exception as e:
+            logging.error("Error claiming summary job %s: %s", job_key, str(e))
+            return False
+        try:
+            self._queue.put_nowait(user_id)
+        except queue.Full:
+            logging.warning("Summary queue full; job %s left pending for recovery.", job_key)
+            return False
+        return True
+
+    def recover(self):
+        """
+        Re-enqueues jobs whose lease expired before they completed.
+        """
+        self._last_recover = time.monotonic()
+        try:
+            stale = self.backend.stale_jobs()
+        except Exception as e:
+            logging.error("Error listing stale summary jobs: %s", str(e))
+            return
+        for job_key, user_id in stale:
+            if not user_id:
+                continue
+            try:
+                claimed = self.backend.claim(job_key, user_id, self.lease_seconds)
+            except Exception as e:
+                logging.error("Error reclaiming summary job %s: %s", job_key, str(e))
+                continue
+            if claimed:
+                try:
+                    self._queue.put_nowait(user_id)
+                    logging.info("Recovered summary job %s.", job_key)
+                except queue.Full:
+                    return
+
+    def join(self):
+        """
+        Blocks until every queued job has been processed.
+        """
+        self._queue.join()
+
+    def _maybe_recover(self):
+        now = time.monotonic()
+        with self._lock:
+            # One worker runs each recovery pass; the others go back to the queue.
+            due = self._last_recover is None or now - self._last_recover >= self.recover_interval
+            if due:
+                self._last_recover = now
+        if due:
+            self.recover()
+
+    def _worker(self):
+        while True:
+            try:
+                user_id = self._queue.get(timeout=self.recover_interval)
+            except queue.Empty:
+                user_id = None
+            if user_id is not None:
+                try:
+                    self._run(user_id)
+                finally:
+                    self._queue.task_done()
+            self._maybe_recover()
+
+    def _run(self, user_id: str):
+        job_key = summary_job_key(user_id)
+        try:
+            self.backend.mark_running(job_key, self.lease_seconds)
+            self.handler(user_id)
+            self.backend.complete(job_key)
+        except Exception as e:
+            logging.error("Summary job %s failed: %s", job_key, str(e))
+            try:
+                self.backend.fail(job_key, str(e))
+            except Exception as backend_error:
+                logging.error("Error recording failure for job %s: %s", job_key, str(backend_error))
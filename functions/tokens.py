@@ -0,0 +1,24 @@
+CHARS_PER_TOKEN = 4  # Rough average for English text with Gemini/OpenAI tokenizers
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimates the number of tokens in a piece of text without calling a tokenizer.
+    """
+    if not text:
+        return 0
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """
+    Truncates text to roughly max_tokens tokens, cutting on a word boundary.
+    """
+    if not text or estimate_tokens(text) <= max_tokens:
+        return text
+    limit = max(max_tokens, 0) * CHARS_PER_TOKEN
+    cut = text[:limit]
+    space = cut.rfind(" ")
+    if space > limit // 2:
+        cut = cut[:space]
+    return cut.rstrip(" ,;:.") + "..."
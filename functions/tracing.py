@@ -0,0 +1,136 @@
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+
+# Fraction of requests that get a trace record. Unsampled requests only pay
+# for one context-variable lookup per span.
+DEFAULT_SAMPLE_RATE = float(os.getenv("RAG_TRACE_SAMPLE_RATE", "1.0"))
+
+trace_logger = logging.getLogger("rag.trace")
+
+_current_trace = contextvars.ContextVar("rag_trace", default=None)
+_NOOP = contextlib.nullcontext()
+
+
+class Trace:
+    """
+    Timing and counters for one request. Stage timings with the same name are
+    summed (e.g. two history reads). Safe to update from worker threads.
+    """
+
+    def __init__(self, name: str, sampled: bool):
+        self.name = name
+        self.sampled = sampled
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.start = time.perf_counter()
+        self.stages_ms = {}
+        self.attributes = {}
+        # Optional object with enter(stage) and exit(stage), called around every span (see profiling).
+        self.observer = None
+        self._lock = threading.Lock()
+
+    def add_stage(self, stage: str, elapsed_ms: float):
+        with self._lock:
+            self.stages_ms[stage] = self.stages_ms.get(stage, 0.0) + elapsed_ms
+
+    def set(self, key: str, value):
+        with self._lock:
+            self.attributes[key] = value
+
+    def incr(self, key: str, amount: int = 1):
+        with self._lock:
+            self.attributes[key] = self.attributes.get(key, 0) + amount
+
+    def to_record(self, status: str) -> dict:
+        with self._lock:
+            return {
+                "trace": self.name,
+                "trace_id": self.trace_id,
+                "status": status,
+                "total_ms": round((time.perf_counter() - self.start) * 1000, 2),
+                "stages_ms": {stage: round(ms, 2) for stage, ms in self.stages_ms.items()},
+                **self.attributes,
+            }
+
+
+class _Span:
+    __slots__ = ("trace", "stage", "start")
+
+    def __init__(self, trace: Trace, stage: str):
+        self.trace = trace
+        self.stage = stage
+
+    def __enter__(self):
+        if self.trace.observer is not None:
+            self.trace.observer.enter(self.stage)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.trace.add_stage(self.stage, (time.perf_counter() - self.start) * 1000)
+        if self.trace.observer is not None:
+            self.trace.observer.exit(self.stage)
+        return False
+
+
+def start_trace(name: str, sample_rate: float = None) -> Trace:
+    """
+    Starts a trace for the current request and makes it the active one.
+    """
+    rate = DEFAULT_SAMPLE_RATE if sample_rate is None else sample_rate
+    trace = Trace(name, sampled=rate >= 1.0 or random.random() < rate)
+    _current_trace.set(trace)
+    return trace
+
+
+def finish_trace(status: str = "ok") -> dict:
+    """
+    Emits the active trace as one structured JSON log line and clears it.
+    Returns the record, or None if the request was not sampled.
+    """
+    trace = _current_trace.get()
+    _current_trace.set(None)
+    if trace is None or not trace.sampled:
+        return None
+    record = trace.to_record(status)
+    trace_logger.info(json.dumps(record, default=str))
+    return record
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+def span(stage: str):
+    """
+    Context manager that adds the time spent in the block to the active trace.
+    """
+    trace = _current_trace.get()
+    if trace is None or not trace.sampled:
+        return _NOOP
+    return _Span(trace, stage)
+
+
+def record(key: str, value):
+    """
+    Sets an attribute (token counts, chosen route, ...) on the active trace.
+    """
+    trace = _current_trace.get()
+    if trace is not None and trace.sampled:
+        trace.set(key, value)
+
+
+def incr(key: str, amount: int = 1):
+    """
+    Increments a counter (cache hits, fallbacks, ...) on the active trace.
+    """
+    trace = _current_trace.get()
+    if trace is not None and trace.sampled and amount:
+        trace.incr(key, amount)
+
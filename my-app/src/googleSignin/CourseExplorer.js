@@ -1,4 +1,5 @@
 import React, { useState, useEffect, useCallback } from "react";
+import { useSearchParams } from "react-router-dom";
 import Papa from "papaparse";
 import * as XLSX from "xlsx";
 import "./CourseExplorer.css";
@@ -440,6 +441,15 @@ function CourseExplorer() {
     const [selectedLevel, setSelectedLevel] = useState("");
     const [searchTerm, setSearchTerm] = useState("");
 
+    // Course links in chat answers open /explorer?course=CSEN-174
+    const [searchParams] = useSearchParams();
+    const linkedCourse = searchParams.get("course");
+    useEffect(() => {
+        if (linkedCourse) {
+            setSearchTerm(linkedCourse.replace("-", " "));
+        }
+    }, [linkedCourse]);
+
     // Selected course and related data
     const [selectedCourse, setSelectedCourse] = useState(null);
     const [dependentCourses, setDependentCourses] = useState([]);
@@ -4,8 +4,19 @@ import { getFirestore, doc, getDoc, deleteDoc } from "firebase/firestore";
 import { getAuth } from "firebase/auth";
 import "./home.css";
 
-function parseBold(text) {
-  return text.replace(/\*\*(.*?)\*\*/g, '<strong>$1</strong>');
+// Stored history keeps the model's plain text; link its bold course
+// references (**CSEN-174 Software Engineering**) when it is rendered.
+// Codes the server marked as not in the catalog stay unlinked.
+const COURSE_REFERENCE =
+  /\*\*([A-Z]{4})[ -](\d{1,3}[A-Z]{0,2})\b[^*\n]*\*\*(?! _\(not found in the course catalog\)_)/g;
+
+export function parseMarkdown(text) {
+  return text
+    .replace(COURSE_REFERENCE, (match, tag, number) =>
+      `**[${match.slice(2, -2)}](/explorer?course=${tag}-${number})**`)
+    .replace(/\*\*(.*?)\*\*/g, '<strong>$1</strong>')
+    .replace(/\[([^\]]+)\]\(((?:https:\/\/|\/)[^\s)"]*)\)/g, '<a href="$2">$1</a>')
+    .replace(/_\(([^)]*)\)_/g, '<em>($1)</em>');
 }
 
 function Home() {
@@ -155,7 +166,7 @@ function Home() {
             {msg.type === "bot" ? (
               <div
                 className="message-content"
-                dangerouslySetInnerHTML={{ __html: parseBold(msg.message) }}
+                dangerouslySetInnerHTML={{ __html: parseMarkdown(msg.message) }}
               ></div>
             ) : (
               <div className="message-content">{msg.message}</div>
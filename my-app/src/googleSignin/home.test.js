@@ -1,6 +1,6 @@
 import React from "react";
 import { render, fireEvent, waitFor } from "@testing-library/react";
-import Home from "../googleSignin/home";
+import Home, { parseMarkdown } from "../googleSignin/home";
 import { GoogleGenerativeAI } from "@google/generative-ai";
 
 // Mocking the GoogleGenerativeAI module
@@ -30,4 +30,34 @@ describe("Chatbot functionality in Home component", () => {
 
     await waitFor(() => expect(findByText("Hello! How can I help you today?"))); // Checking chatbot response
   });
-});
\ No newline at end of file
+});
+
+describe("parseMarkdown", () => {
+  it("should render course links from the answer as anchors", () => {
+    const html = parseMarkdown(
+      "Take **[CSEN 174 Software Engineering](/explorer?course=CSEN-174)** after [CSEN 79](/explorer?course=CSEN-79)."
+    );
+
+    expect(html).toContain(
+      '<strong><a href="/explorer?course=CSEN-174">CSEN 174 Software Engineering</a></strong>'
+    );
+    expect(html).toContain('<a href="/explorer?course=CSEN-79">CSEN 79</a>');
+  });
+
+  it("should link plain course references from the stored history", () => {
+    const html = parseMarkdown("Try **CSEN-174 Software Engineering** next.");
+
+    expect(html).toContain(
+      '<strong><a href="/explorer?course=CSEN-174">CSEN-174 Software Engineering</a></strong>'
+    );
+  });
+
+  it("should not link other schemes and should render catalog notes", () => {
+    const html = parseMarkdown(
+      "[click](javascript:alert(1)) CSEN 999 _(not found in the course catalog)_"
+    );
+
+    expect(html).not.toContain("<a");
+    expect(html).toContain("<em>(not found in the course catalog)</em>");
+  });
+});